@@ -1,28 +1,51 @@
 from dotenv import load_dotenv
+# Must run before importing engine modules: they read LLM/DB settings from the environment at import
 load_dotenv()
-from fastapi import FastAPI, HTTPException
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 import uvicorn
 from pydantic import BaseModel
 import logging
+import logging.handlers
+import queue
 import traceback
 
 from engine.edi_converter import EDIConverter
 
 
-logging.basicConfig(filename="logs/app.log",
-                    level=logging.INFO,
-                    format='%(asctime)s %(levelname)s %(message)s',
-                    datefmt='%m-%d %H:%M:%S')
 LOGGER = logging.getLogger(__name__)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker startup/shutdown: configure logging and own the EDIConverter lifecycle."""
+    # Request handlers only enqueue records; a background thread writes them to a per-worker file
+    file_handler = logging.handlers.RotatingFileHandler(f"logs/app.{os.getpid()}.log",
+                                                        maxBytes=10 * 1024 * 1024,
+                                                        backupCount=5)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s',
+                                                datefmt='%m-%d %H:%M:%S'))
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(log_queue)])
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    log_listener.start()
+
+    app.state.edi_converter = EDIConverter()
+    yield
+    await app.state.edi_converter.close()
+    log_listener.stop()
+
+
 app = FastAPI(
     title="EDI AI Engine",
     description="EDI AI Engine is a tool that converts text to EDI format.",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-edi_converter = EDIConverter()
 
 class EDIConverterQuery(BaseModel):
     interchange_sender: str
@@ -30,18 +53,18 @@ class EDIConverterQuery(BaseModel):
     build_edi: bool = True  # Flag to control EDI building
 
 @app.post("/convert_text_to_edi")
-async def convert_text_to_edi(query: EDIConverterQuery):
+async def convert_text_to_edi(query: EDIConverterQuery, request: Request):
     """Legacy endpoint - uses old segment-by-segment extraction"""
     try:
         LOGGER.info(f"Converting text to EDI (legacy): {query.interchange_sender} for segment {query.edi_info_id}")
-        return await edi_converter.convert_text_to_edi(query.interchange_sender, query.edi_info_id)
+        return await request.app.state.edi_converter.convert_text_to_edi(query.interchange_sender, query.edi_info_id)
     except Exception as e:
         LOGGER.error(f"Error converting text to EDI: {str(e)}\nTraceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/convert_text_to_edi_v2")
-async def convert_text_to_edi_v2(query: EDIConverterQuery):
+async def convert_text_to_edi_v2(query: EDIConverterQuery, request: Request):
     """
     New endpoint - uses structured JSON extraction + deterministic EDI building.
     
@@ -56,7 +79,7 @@ async def convert_text_to_edi_v2(query: EDIConverterQuery):
     """
     try:
         LOGGER.info(f"Converting text to EDI (v2): {query.interchange_sender} for segment {query.edi_info_id}, build_edi={query.build_edi}")
-        result = await edi_converter.convert_text_to_edi_v2(query.interchange_sender, query.edi_info_id, build_edi=query.build_edi)
+        result = await request.app.state.edi_converter.convert_text_to_edi_v2(query.interchange_sender, query.edi_info_id, build_edi=query.build_edi)
         return result
     except Exception as e:
         LOGGER.error(f"Error converting text to EDI (v2): {str(e)}\nTraceback: {traceback.format_exc()}")
@@ -69,4 +92,23 @@ def read_root():
 
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=False)
\ No newline at end of file
+    # Prefer uvloop/httptools (uvicorn[standard]); fall back to the pure-Python stack in dev
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=False,
+        loop=loop,
+        http=http,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+    )
\ No newline at end of file
@@ -1,9 +1,15 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
 import chromadb
 import httpx
+import numpy as np
+import orjson
 from typing import List, Dict, Optional, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 import logging
-import uuid
+import binascii
 
 logger = logging.getLogger(__name__)
 from typing import List, Optional
@@ -11,21 +17,46 @@ from typing import List, Optional
 import requests
 from langchain.embeddings.base import Embeddings
 
+EMBEDDINGS_API_URL = "http://ai.kontratar.com:5000"
+
+# Texts per /embed_batch request and max requests in flight for aembed_documents
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "16"))
+# Max number of embeddings kept by CachedEmbeddings
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+
+
+def document_filter(interchange_sender: str, edi_info_id: str) -> Dict[str, Any]:
+    """
+    Chroma `where` filter selecting the chunks of one EDI document. Build it once per document
+    and pass the same dict to every retrieval for it (or to one batched retrieval).
+    """
+    return {
+        "$and": [
+            {"interchange_sender": interchange_sender},
+            {"edi_info_id": edi_info_id}
+        ]
+    }
+
 
 class MercuryEmbeddings(Embeddings):
     """
     LangChain wrapper for a self-hosted embedding model with an HTTP API.
     """
 
-    def __init__(self, api_url: str, api_key: Optional[str] = None):
+    def __init__(self, api_url: str, api_key: Optional[str] = None, client: Optional[httpx.AsyncClient] = None):
         self.api_url = api_url
         self.api_key = api_key
+        self._client = client or httpx.AsyncClient(timeout=60)
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
         Embed a list of documents.
         """
-        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        headers = self._headers()
         response = requests.post(
             f"{self.api_url}/embed_batch",
             json={"texts": texts},
@@ -40,6 +71,110 @@ class MercuryEmbeddings(Embeddings):
         Embed a single query.
         """
         return self.embed_documents([text])[0]
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        response = await self._client.post(
+            f"{self.api_url}/embed_batch",
+            json={"texts": texts},
+            headers=self._headers(),
+        )
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents without blocking the event loop.
+        Texts are sorted by length, split into EMBED_BATCH_SIZE micro-batches and
+        sent concurrently (at most EMBED_MAX_CONCURRENCY in flight).
+        """
+        if len(texts) <= EMBED_BATCH_SIZE:
+            return await self._aembed_batch(texts)
+
+        # Group similar lengths together to minimise padding on the embedding server
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[i:i + EMBED_BATCH_SIZE] for i in range(0, len(order), EMBED_BATCH_SIZE)]
+        semaphore = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
+
+        async def run(batch: List[int]) -> List[List[float]]:
+            async with semaphore:
+                return await self._aembed_batch([texts[i] for i in batch])
+
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+
+        # Restore the caller's ordering
+        embeddings: List[List[float]] = [None] * len(texts)
+        for batch, batch_embeddings in zip(batches, results):
+            for i, embedding in zip(batch, batch_embeddings):
+                embeddings[i] = embedding
+        return embeddings
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query without blocking the event loop.
+        """
+        return (await self.aembed_documents([text]))[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    LRU cache in front of another Embeddings implementation.
+    Only cache misses are sent to the wrapped model.
+    """
+
+    def __init__(self, embeddings: MercuryEmbeddings, capacity: int = EMBED_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.capacity = capacity
+        self._namespace = embeddings.api_url.encode()
+        self._cache: "OrderedDict[bytes, List[float]]" = OrderedDict()
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256(self._namespace + b"\0" + text.encode()).digest()
+
+    def _get(self, key: bytes) -> Optional[List[float]]:
+        embedding = self._cache.get(key)
+        if embedding is not None:
+            self._cache.move_to_end(key)
+        return embedding
+
+    def _put(self, key: bytes, embedding: List[float]) -> None:
+        self._cache[key] = embedding
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def _split(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], Dict[bytes, str]]:
+        """
+        Return cached embeddings (None for misses) and the unique missing texts by key.
+        """
+        keys = [self._key(text) for text in texts]
+        cached = [self._get(key) for key in keys]
+        misses = {key: text for key, text, hit in zip(keys, texts, cached) if hit is None}
+        return cached, misses
+
+    def _merge(self, texts: List[str], cached: List[Optional[List[float]]], misses: Dict[bytes, str], embedded: List[List[float]]) -> List[List[float]]:
+        fresh = dict(zip(misses.keys(), embedded))
+        for key, embedding in fresh.items():
+            self._put(key, embedding)
+        return [hit if hit is not None else fresh[self._key(text)] for text, hit in zip(texts, cached)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        cached, misses = self._split(texts)
+        embedded = self.embeddings.embed_documents(list(misses.values())) if misses else []
+        return self._merge(texts, cached, misses, embedded)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # The cache is only touched between awaits, so no lock is needed on the event loop
+        cached, misses = self._split(texts)
+        embedded = await self.embeddings.aembed_documents(list(misses.values())) if misses else []
+        return self._merge(texts, cached, misses, embedded)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
 # DTOs
 class ComplianceResult:
     def __init__(self, compliance_result: str, individual_rule_checks: Optional[List[str]] = None):
@@ -58,18 +193,34 @@ class CollectionExistenceResult:
         self.was_created = was_created
 
 class AddDocumentResult:
-    def __init__(self, status: bool = False, error_message: str = '', total_processed: int = 0, total_failed: int = 0, failed_ids: Optional[List[str]] = None):
+    def __init__(self, status: bool = False, error_message: str = '', total_processed: int = 0, total_failed: int = 0, failed_ids: Optional[List[str]] = None, duplicates: int = 0):
         self.status = status
         self.error_message = error_message
         self.total_processed = total_processed
         self.total_failed = total_failed
         self.failed_ids = failed_ids or []
+        self.duplicates = duplicates
 
 # Main service class
 class ChromaDBService:
     def __init__(self):
         self.chroma_url = "http://3.217.236.185:8050"
-        self.embeddings = MercuryEmbeddings("http://ai.kontratar.com:5000")
+        # Shared pooled client so keep-alive connections are reused across calls.
+        # httpx only negotiates HTTP/2 via TLS ALPN, so it is enabled only when this client talks to an https endpoint
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=60,
+            http2=any(url.startswith("https://") for url in (self.chroma_url, EMBEDDINGS_API_URL)),
+        )
+        self.embeddings = CachedEmbeddings(MercuryEmbeddings(EMBEDDINGS_API_URL, client=self._client))
+        # Collection name -> id, so retrievals skip the collection lookup request after the first one
+        self._collection_ids: Dict[str, str] = {}
+
+    async def close(self) -> None:
+        """
+        Close the shared HTTP client and release pooled connections.
+        """
+        await self._client.aclose()
 
     async def add_documents(self, collection_name: str, documents: List[str], embeddings: List[List[float]], metadatas: List[Dict]) -> AddDocumentResult:
         try:
@@ -100,10 +251,11 @@ class ChromaDBService:
                 logger.error(f"Failed to add documents to collection '{collection_name}' (ID: {collection_id})")
                 return AddDocumentResult(status=False, total_processed=0)
 
-            documents, embeddings = result
+            unique_documents, _ = result
+            duplicates = len(documents) - len(unique_documents)
 
-            logger.info(f"Successfully added {len(documents)} documents to collection '{collection_name}' (ID: {collection_id})")
-            return AddDocumentResult(status=True, total_processed=len(documents))
+            logger.info(f"Successfully added {len(unique_documents)} documents to collection '{collection_name}' (ID: {collection_id}), skipped {duplicates} duplicates")
+            return AddDocumentResult(status=True, total_processed=len(unique_documents), duplicates=duplicates)
         except Exception as e:
             logger.error(f"Exception occurred while adding documents to collection '{collection_name}': {e}", exc_info=True)
             return AddDocumentResult(status=False, error_message=str(e), total_failed=len(documents), failed_ids=[f"doc_{i}" for i in range(len(documents))])
@@ -114,13 +266,41 @@ class ChromaDBService:
 
     # Additional methods for update, query, etc. can be added here 
     async def get_collection_id(self, chroma_url: str, collection_name: str) -> Optional[str]:
-        async with httpx.AsyncClient() as client:
-            collections_url = f"{chroma_url}/api/v1/collections/{collection_name}"
-            resp = await client.get(collections_url)
-            if resp.status_code >= 400:
-                return None
+        client = self._client
+        collections_url = f"{chroma_url}/api/v1/collections/{collection_name}"
+        resp = await client.get(collections_url)
+        if resp.status_code >= 400:
+            return None
+        collection_id = resp.json()["id"]
+        return collection_id
+
+    async def _retrieval_collection_id(self, collection_name: str) -> Optional[str]:
+        """
+        Collection id for retrievals; resolved once per collection name, errors are raised.
+        """
+        collection_id = self._collection_ids.get(collection_name)
+        if collection_id is None:
+            resp = await self._client.get(f"{self.chroma_url}/api/v1/collections/{collection_name}")
+            resp.raise_for_status()
             collection_id = resp.json()["id"]
-            return collection_id
+            if collection_id:
+                self._collection_ids[collection_name] = collection_id
+        return collection_id
+
+    async def _query_collection(self, collection_name: str, collection_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST a query to the collection. A 404 means the cached id is stale (the collection was
+        deleted and recreated, e.g. on re-ingest), so the id is resolved again and the query retried once.
+        """
+        query_resp = await self._client.post(f"{self.chroma_url}/api/v1/collections/{collection_id}/query", json=payload)
+        if query_resp.status_code == 404 and self._collection_ids.pop(collection_name, None) is not None:
+            collection_id = await self._retrieval_collection_id(collection_name)
+            if not collection_id:
+                logger.warning(f"Collection {collection_name} not found in ChromaDB")
+                return {}
+            query_resp = await self._client.post(f"{self.chroma_url}/api/v1/collections/{collection_id}/query", json=payload)
+        query_resp.raise_for_status()
+        return query_resp.json()
 
     # async def get_relevant_chunks(
     #     self,
@@ -180,60 +360,91 @@ class ChromaDBService:
         Retrieve relevant chunks from ChromaDB using the REST API.
         """
 
-        chroma_url = self.chroma_url
         latest_collection_name = collection_name
-        # 1. Get collection ID by name
-        async with httpx.AsyncClient() as client:
-            collections_url = f"{chroma_url}/api/v1/collections/{latest_collection_name}"
-            resp = await client.get(collections_url)
-            resp.raise_for_status()
-            collection_id = resp.json()["id"]
-            
-            if not collection_id:
-                logger.warning(f"Collection {latest_collection_name} not found in ChromaDB")
-                return []
+        # 1. Get collection ID by name while the query is embedded (independent requests)
+        collection_id, query_embedding = await asyncio.gather(
+            self._retrieval_collection_id(latest_collection_name),
+            self.embeddings.aembed_query(query),
+        )
+        
+        if not collection_id:
+            logger.warning(f"Collection {latest_collection_name} not found in ChromaDB")
+            return []
 
-            # 2. Query the collection for relevant chunks
-            query_url = f"{chroma_url}/api/v1/collections/{collection_id}/query"
-            query_embedding = self.embeddings.embed_query(query)
-            payload = {
-                "query_embeddings": [query_embedding],
-                "n_results": n_results,
-                "include": ["documents", "metadatas", "distances"],
-                # "where": {
-                #         "$and": [{key:{ "$eq": metadata_filter[key]}} for key in metadata_filter.keys()]
-                #         },
-                "where": metadata_filter if metadata_filter is not None else {},
-            }
-            query_resp = await client.post(query_url, json=payload)
-            query_resp.raise_for_status()
-            results = query_resp.json()
-            
-            #logger.debug(f"results: {results}")
-            # The relevant chunks are in results["documents"][0]
-            if "documents" in results and results["documents"]:
-                return results["documents"][0]
-            else:
-                logger.warning(f"No relevant documents found for query in collection {collection_name}")
-                return []
+        # 2. Query the collection for relevant chunks
+        payload = {
+            "query_embeddings": [query_embedding],
+            "n_results": n_results,
+            "include": ["documents", "metadatas", "distances"],
+            # "where": {
+            #         "$and": [{key:{ "$eq": metadata_filter[key]}} for key in metadata_filter.keys()]
+            #         },
+            "where": metadata_filter if metadata_filter is not None else {},
+        }
+        results = await self._query_collection(latest_collection_name, collection_id, payload)
+        
+        #logger.debug(f"results: {results}")
+        # The relevant chunks are in results["documents"][0]
+        if "documents" in results and results["documents"]:
+            return results["documents"][0]
+        else:
+            logger.warning(f"No relevant documents found for query in collection {collection_name}")
+            return []
+
+    async def get_relevant_chunks_batch(
+        self,
+        collection_name: str,
+        queries: List[str],
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        n_results: int = 5
+    ) -> List[List[str]]:
+        """
+        Retrieve relevant chunks for several queries with one embedding batch and one query request.
+        Returns one list of chunks per query, in the order of `queries`.
+        """
+        if not queries:
+            return []
+
+        collection_id, query_embeddings = await asyncio.gather(
+            self._retrieval_collection_id(collection_name),
+            self.embeddings.aembed_documents(queries),
+        )
+
+        if not collection_id:
+            logger.warning(f"Collection {collection_name} not found in ChromaDB")
+            return [[] for _ in queries]
+
+        payload = {
+            "query_embeddings": query_embeddings,
+            "n_results": n_results,
+            "include": ["documents"],
+            "where": metadata_filter if metadata_filter is not None else {},
+        }
+        results = await self._query_collection(collection_name, collection_id, payload)
+
+        # results["documents"] holds one list of chunks per query embedding
+        documents = results.get("documents") or []
+        if not documents:
+            logger.warning(f"No relevant documents found for queries in collection {collection_name}")
+        return [documents[i] if i < len(documents) and documents[i] else [] for i in range(len(queries))]
 
     async def create_collection(self, collection_name: str, chroma_url: str) -> Optional[str]:
         """
         Creates a collection and returns the collection id if successful, otherwise returns None
         """
-        async with httpx.AsyncClient() as client:
-            collections_url = f"{chroma_url}/api/v1/collections"
-            payload = {
-                "name": collection_name,
-                "get_or_create": True,
-                "metadata": {
-                    "collection_name": collection_name
-                }
+        client = self._client
+        collections_url = f"{chroma_url}/api/v1/collections"
+        payload = {
+            "name": collection_name,
+            "get_or_create": True,
+            "metadata": {
+                "collection_name": collection_name
             }
-            resp = await client.post(collections_url, json=payload)
-            resp.raise_for_status()
-            collection_id = resp.json()["id"]
-            return collection_id
+        }
+        resp = await client.post(collections_url, json=payload)
+        resp.raise_for_status()
+        collection_id = resp.json()["id"]
+        return collection_id
 
     async def get_sample_documents(self, collection_name: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """
@@ -242,63 +453,89 @@ class ChromaDBService:
         try:
             chroma_url = self.chroma_url
 
-            async with httpx.AsyncClient() as client:
-                # Step 1: Get collection ID
-                collections_url = f"{chroma_url}/api/v1/collections/{collection_name}"
-                resp = await client.get(collections_url)
-                resp.raise_for_status()
-                collection_id = resp.json()["id"]
-
-                if not collection_id:
-                    logger.warning(f"Collection '{collection_name}' not found.")
-                    return []
-
-                # Step 2: Generate valid embedding using your Mercury model
-                dummy_embedding = self.embeddings.embed_query("test")
-
-                # Step 3: Query
-                query_url = f"{chroma_url}/api/v1/collections/{collection_id}/query"
-                payload = {
-                    "query_embeddings": [dummy_embedding],
-                    "n_results": n_results,
-                    "include": ["documents", "metadatas", "distances"]
-                }
-
-                query_resp = await client.post(query_url, json=payload)
-                query_resp.raise_for_status()
-                results = query_resp.json()
-
-                if "documents" in results and results["documents"]:
-                    docs = results["documents"][0]
-                    metas = results["metadatas"][0] if "metadatas" in results else [{}] * len(docs)
-                    return [{"document": doc, "metadata": meta} for doc, meta in zip(docs, metas)]
-                else:
-                    logger.info(f"No documents returned from collection '{collection_name}'.")
-                    return []
+            client = self._client
+            # Step 1 + 2: Get collection ID and generate a valid embedding using your Mercury model concurrently
+            collections_url = f"{chroma_url}/api/v1/collections/{collection_name}"
+            resp, dummy_embedding = await asyncio.gather(
+                client.get(collections_url),
+                self.embeddings.aembed_query("test"),
+            )
+            resp.raise_for_status()
+            collection_id = resp.json()["id"]
+
+            if not collection_id:
+                logger.warning(f"Collection '{collection_name}' not found.")
+                return []
+
+            # Step 3: Query
+            query_url = f"{chroma_url}/api/v1/collections/{collection_id}/query"
+            payload = {
+                "query_embeddings": [dummy_embedding],
+                "n_results": n_results,
+                "include": ["documents", "metadatas", "distances"]
+            }
+
+            query_resp = await client.post(query_url, json=payload)
+            query_resp.raise_for_status()
+            results = query_resp.json()
+
+            if "documents" in results and results["documents"]:
+                docs = results["documents"][0]
+                metas = results["metadatas"][0] if "metadatas" in results else [{}] * len(docs)
+                return [{"document": doc, "metadata": meta} for doc, meta in zip(docs, metas)]
+            else:
+                logger.info(f"No documents returned from collection '{collection_name}'.")
+                return []
 
         except Exception as e:
             logger.error(f"Error fetching sample documents from collection '{collection_name}': {e}", exc_info=True)
             return []
 
     async def add_documents_to_collection(self, chroma_url: str, collection_id: str, documents: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]) -> Optional[Tuple[List[str], List[List[float]]]]:
+        """
+        Upload documents to a collection, skipping in-batch duplicates (first occurrence wins).
+        Returns the documents and embeddings actually uploaded, or None on failure.
+        """
         try:
             logger.info(f"Preparing to add {len(documents)} documents to collection {collection_id}")
-            # Generate random string ids for each document
-            ids = [str(uuid.uuid4()) for _ in documents]
+            # Drop repeated chunks before upload; blake2b is only used as a fast content key
+            seen = set()
+            unique_indices = []
+            for i, doc in enumerate(documents):
+                digest = hashlib.blake2b(doc.encode(), digest_size=16).digest()
+                if digest not in seen:
+                    seen.add(digest)
+                    unique_indices.append(i)
+            if len(unique_indices) < len(documents):
+                logger.info(f"Skipping {len(documents) - len(unique_indices)} duplicate documents")
+                documents = [documents[i] for i in unique_indices]
+                embeddings = [embeddings[i] for i in unique_indices]
+                metadatas = [metadatas[i] for i in unique_indices]
+
+            # Generate random string ids for each document: 128 random bits each (same entropy as uuid4),
+            # drawn with a single urandom call and hex-encoded in one pass
+            hex_ids = binascii.hexlify(os.urandom(16 * len(documents))).decode()
+            ids = [hex_ids[i:i + 32] for i in range(0, len(hex_ids), 32)]
             logger.debug(f"Generated document IDs: {ids}")
 
-            async with httpx.AsyncClient() as client:
-                collections_url = f"{chroma_url}/api/v1/collections/{collection_id}/add"
-                payload = {
-                    "ids": ids,
-                    "documents": documents,
-                    "embeddings": embeddings,
-                    "metadatas": metadatas
-                }
-                logger.debug(f"POST {collections_url} with payload")
-                resp = await client.post(collections_url, json=payload)
-                resp.raise_for_status()
-                logger.info(f"Successfully added {len(documents)} documents to collection {collection_id}")
+            client = self._client
+            collections_url = f"{chroma_url}/api/v1/collections/{collection_id}/add"
+            payload = {
+                "ids": ids,
+                "documents": documents,
+                # float32 is what Chroma stores; orjson prints it with ~9 instead of ~17 significant digits
+                "embeddings": np.asarray(embeddings, dtype=np.float32),
+                "metadatas": metadatas
+            }
+            logger.debug(f"POST {collections_url} with payload")
+            # orjson is much faster than stdlib json on large float arrays and accepts numpy embeddings as-is
+            resp = await client.post(
+                collections_url,
+                content=orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+                headers={"Content-Type": "application/json"},
+            )
+            resp.raise_for_status()
+            logger.info(f"Successfully added {len(documents)} documents to collection {collection_id}")
             return documents, embeddings
         except Exception as e:
             logger.error(f"Error adding documents to collection {collection_id}: {e}")
@@ -2,6 +2,7 @@
 Compare generated EDI against boss's expected output.
 """
 import json
+from collections import Counter
 
 # Boss's expected output
 boss_output = [
@@ -38,8 +39,13 @@ matches = []
 missing = []
 extra = []
 
+# Multiset lookups: O(1) per segment and duplicate segments are matched one-for-one
+generated_counts = Counter(generated)
+boss_counts = Counter(boss_output)
+
 for i, boss_seg in enumerate(boss_output, 1):
-    if boss_seg in generated:
+    if generated_counts[boss_seg] > 0:
+        generated_counts[boss_seg] -= 1
         print(f"{i:2}. ✓ {boss_seg}")
         matches.append(boss_seg)
     else:
@@ -52,7 +58,9 @@ print("=" * 70)
 print("EXTRA SEGMENTS (not in boss's output):")
 print("=" * 70)
 for seg in generated:
-    if seg not in boss_output:
+    if boss_counts[seg] > 0:
+        boss_counts[seg] -= 1
+    else:
         print(f"  + {seg}")
         extra.append(seg)
 
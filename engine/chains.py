@@ -1,12 +1,33 @@
+"""
+LLM chains used by the EDI converter.
+LangChain, the OpenAI client and the embeddings service are imported on first use: the
+get_* factories build each object once, so importing this module stays cheap for code
+paths that never call the LLM.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
 import json
 import os
-from typing import List, Dict, Any, Optional
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import BaseOutputParser
-from langchain_core.runnables import RunnableSequence
+import re
+import time
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple, Type
+import numpy as np
+import orjson
 from pydantic import BaseModel, Field
-import httpx
+from utils.schemas import ExtractedTransaction
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.runnables import Runnable
+    from langchain_openai import ChatOpenAI
+    from openai import OpenAI
+    from chroma.chromadb_service import CachedEmbeddings
 
 
 # Define the output structure
@@ -20,60 +41,205 @@ class EntityExtractionResult(BaseModel):
     extracted_entities: List[ExtractedEntity] = Field(description="List of extracted entities")
     confidence_score: float = Field(description="Overall confidence score (0-1)")
 
-# Custom output parser
-class EntityOutputParser(BaseOutputParser[EntityExtractionResult]):
-    def parse(self, text: str) -> EntityExtractionResult:
-        try:
-            # Clean the text to extract JSON
-            if "```json" in text:
-                json_start = text.find("```json") + 7
-                json_end = text.find("```", json_start)
-                json_text = text[json_start:json_end].strip()
-            else:
-                json_text = text.strip()
-            
-            data = json.loads(json_text)
-            return EntityExtractionResult(**data)
-        except Exception as e:
-            # Fallback parsing
-            return EntityExtractionResult(
-                extracted_entities=[],
-                confidence_score=0.0
-            )
+# Set EDI_STRICT to fully validate parsed LLM output instead of trusting its structure
+EDI_STRICT = bool(os.getenv("EDI_STRICT"))
+
+# Matches the body of a ```json ... ``` (or untagged ``` ... ```) fenced block in one scan;
+# responses without a fence are parsed as-is
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(.+?)```", re.DOTALL | re.IGNORECASE)
+
+# Custom output parser (the class is defined on first use since it subclasses a LangChain base)
+@lru_cache(maxsize=1)
+def get_entity_output_parser_class() -> type:
+    from langchain_core.output_parsers import BaseOutputParser
+
+    class EntityOutputParser(BaseOutputParser[EntityExtractionResult]):
+        def parse(self, text: str) -> EntityExtractionResult:
+            try:
+                # Clean the text to extract JSON
+                match = _JSON_FENCE.search(text)
+                json_text = (match.group(1) if match else text).strip()
+                
+                if EDI_STRICT:
+                    # pydantic-core parses and validates in one pass, no intermediate dict
+                    return EntityExtractionResult.model_validate_json(json_text)
+
+                # Structured output already constrains the shape, so skip validation
+                data = orjson.loads(json_text)
+                return EntityExtractionResult.model_construct(
+                    extracted_entities=[ExtractedEntity.model_construct(**entity) for entity in data.get("extracted_entities", [])],
+                    confidence_score=data.get("confidence_score", 0.0)
+                )
+            except Exception as e:
+                # Fallback parsing
+                return EntityExtractionResult(
+                    extracted_entities=[],
+                    confidence_score=0.0
+                )
+
+    return EntityOutputParser
 
 # Initialize the LLM - Use custom LLM if configured, otherwise fallback to OpenAI
 LLM_API_URL = os.getenv("LLM_API_URL")
 LLM_API_KEY = os.getenv("LLM_API_KEY")
 LLM_MODEL = os.getenv("LLM_MODEL")
+# Async transport for the chains: "httpx" (HTTP/2 multiplexing) or "aiohttp" (HTTP/1.1 keep-alive pool)
+LLM_HTTP_BACKEND = os.getenv("LLM_HTTP_BACKEND", "httpx").lower()
+
+
+def _llm_http_clients(verify: bool):
+    """
+    One sync and one async pooled client shared by every chain (all chains use the same ChatOpenAI).
+    HTTP/2 lets concurrent chain calls multiplex over a few TLS connections; it is negotiated via
+    ALPN and falls back to HTTP/1.1 if the server does not speak h2.
+    """
+    import httpx
+
+    # Set timeout to 10 minutes for large extractions, but fail fast on connect
+    # The default httpx pool (10 connections) serializes concurrent chain calls, so size it explicitly
+    llm_http_timeout = httpx.Timeout(600.0, connect=5.0)
+    llm_http_limits = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60)
+    http_client = httpx.Client(verify=verify, timeout=llm_http_timeout, limits=llm_http_limits, http2=True)
+    if LLM_HTTP_BACKEND == "aiohttp":
+        try:
+            # openai[aiohttp]: an httpx.AsyncClient whose requests go through aiohttp's connection pool
+            from openai import DefaultAioHttpClient
+            return http_client, DefaultAioHttpClient(verify=verify, timeout=llm_http_timeout, limits=llm_http_limits)
+        except (ImportError, RuntimeError):
+            # Older openai has no DefaultAioHttpClient; newer raises RuntimeError without the aiohttp extra
+            print("LLM_HTTP_BACKEND=aiohttp needs openai[aiohttp]; using httpx")
+    # Async client for ainvoke so chains reuse pooled keep-alive connections instead of a threadpool
+    http_async_client = httpx.AsyncClient(verify=verify, timeout=llm_http_timeout, limits=llm_http_limits, http2=True)
+    return http_client, http_async_client
+
+
+@lru_cache(maxsize=1)
+def get_llm() -> ChatOpenAI:
+    """The shared chat model, built on first use."""
+    from langchain_openai import ChatOpenAI
+
+    if not (LLM_API_URL and LLM_API_KEY and LLM_MODEL):
+        # Fallback to OpenAI
+        print("🔧 Using OpenAI GPT-4.1")
+        http_client, http_async_client = _llm_http_clients(verify=True)
+        return ChatOpenAI(
+            model="gpt-4.1",
+            temperature=0.1,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            # OpenAI caches prompt prefixes automatically; a stable key routes our requests to the same cache
+            extra_body={"prompt_cache_key": "edi-ai-engine-v1"},
+            streaming=True  # Receive tokens as they are generated instead of one response at the end
+        )
 
-if LLM_API_URL and LLM_API_KEY and LLM_MODEL:
     # Use custom LLM (OpenAI-compatible API)
     print(f"🔧 Using custom LLM: {LLM_MODEL} at {LLM_API_URL}")
 
-    # Create HTTP client that ignores SSL verification (for self-signed certs)
-    # Set timeout to 10 minutes for large extractions
-    http_client = httpx.Client(verify=False, timeout=600.0)
+    # Ignore SSL verification (for self-signed certs)
+    http_client, http_async_client = _llm_http_clients(verify=False)
 
-    llm = ChatOpenAI(
+    return ChatOpenAI(
         model=LLM_MODEL,
         temperature=0.1,
         openai_api_key=LLM_API_KEY,
         openai_api_base=LLM_API_URL,
         http_client=http_client,
+        http_async_client=http_async_client,
         request_timeout=600,  # 10 minute timeout for complex extractions
         max_tokens=None,  # No limit - let the LLM server decide (128k available)
-        streaming=False  # Disable streaming for stability
-    )
-else:
-    # Fallback to OpenAI
-    print("🔧 Using OpenAI GPT-4.1")
-    llm = ChatOpenAI(
-        model="gpt-4.1",
-        temperature=0.1
+        streaming=True  # Receive tokens as they are generated instead of one response at the end
     )
 
+
+def structured_llm(schema: Type[BaseModel]) -> Runnable:
+    """
+    The LLM bound to `schema` as a forced tool call, like with_structured_output(method="function_calling"),
+    but the tool-call arguments are validated by pydantic-core straight from the JSON string
+    instead of being parsed to a dict and passed to the model's __init__.
+    """
+    from langchain_core.runnables import RunnableLambda
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    tool_name = convert_to_openai_tool(schema)["function"]["name"]
+
+    # Left unannotated: RunnableLambda derives its input schema from the first parameter's annotation
+    def parse(message):
+        raw_tool_calls = message.additional_kwargs.get("tool_calls")
+        if raw_tool_calls:
+            return schema.model_validate_json(raw_tool_calls[0]["function"]["arguments"])
+        # Providers that only report parsed tool calls
+        if message.tool_calls:
+            return schema.model_validate(message.tool_calls[0]["args"])
+        return None
+
+    return (get_llm().bind_tools([schema], tool_choice=tool_name, parallel_tool_calls=False)
+            | RunnableLambda(parse, name=f"Parse{schema.__name__}"))
+
+
+class PromptChain:
+    """
+    prompt | llm replacement that renders the template once with str.format_map
+    instead of going through LangChain's per-call template parsing.
+    Messages without input variables (static system preambles) are built once and reused;
+    messages that only use variables outside `per_call_variables` (e.g. transaction type and
+    metadata summary, constant across a batch) are rendered once per distinct value set.
+    """
+
+    def __init__(self, prompt_template: ChatPromptTemplate, runnable: Runnable, name: str,
+                 per_call_variables: Tuple[str, ...] = ("text",), output_schema: Optional[Type[BaseModel]] = None):
+        from langchain_core.messages import HumanMessage, SystemMessage
+        from langchain_core.prompts import HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
+        message_types = {
+            SystemMessagePromptTemplate: SystemMessage,
+            HumanMessagePromptTemplate: HumanMessage,
+        }
+        # (message class, f-string template, prebuilt message if the template is static,
+        #  variables to key the render cache on if the message is cacheable)
+        self.messages = []
+        for message in prompt_template.messages:
+            message_cls = message_types[type(message)]
+            template = message.prompt.template
+            variables = tuple(message.input_variables)
+            static = message_cls(content=template.format_map({})) if not variables else None
+            cache_key = variables if variables and not set(variables) & set(per_call_variables) else None
+            self.messages.append((message_cls, template, static, cache_key))
+        self.input_variables = tuple(prompt_template.input_variables)
+        self.runnable = runnable
+        self.name = name
+        # Pydantic model the runnable returns, used to restore responses from the disk cache
+        self.output_schema = output_schema
+        self._render_cached = lru_cache(maxsize=32)(self._render)
+
+    def _render(self, index: int, values: Tuple[str, ...]) -> BaseMessage:
+        message_cls, template, _, variables = self.messages[index]
+        return message_cls(content=template.format_map(dict(zip(variables, values))))
+
+    def to_messages(self, inputs: Dict[str, Any]) -> List[BaseMessage]:
+        messages = []
+        for index, (message_cls, template, static, cache_key) in enumerate(self.messages):
+            if static is not None:
+                messages.append(static)
+            elif cache_key is not None:
+                messages.append(self._render_cached(index, tuple(str(inputs[v]) for v in cache_key)))
+            else:
+                messages.append(message_cls(content=template.format_map(inputs)))
+        return messages
+
+    def format(self, inputs: Dict[str, Any]) -> str:
+        return "\n\n".join(message.content for message in self.to_messages(inputs))
+
+    def invoke(self, inputs: Dict[str, Any]) -> Any:
+        return self.runnable.invoke(self.to_messages(inputs))
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> Any:
+        return await self.runnable.ainvoke(self.to_messages(inputs))
+
+
 # Create the prompt template
-prompt_template_entities_extraction = ChatPromptTemplate.from_template("""
+# The static instructions go in the system message so providers can reuse the cached prefix;
+# only the human message changes between calls.
+_ENTITIES_EXTRACTION_MESSAGES = [("system", """
 You are an expert EDI (Electronic Data Interchange) data extraction specialist. Your task is to extract specific entities from the given text.
 
 **Instructions:**
@@ -83,12 +249,6 @@ You are an expert EDI (Electronic Data Interchange) data extraction specialist.
 4. Maintain the required status (M=Mandatory, O=Optional) as provided
 5. Provide a confidence score between 0 and 1 for the overall extraction
 
-**Text to analyze:**
-{text}
-
-**Entities to extract:**
-{entities}
-
 **Output format (JSON):**
 ```json
 {{
@@ -103,23 +263,88 @@ You are an expert EDI (Electronic Data Interchange) data extraction specialist.
     "confidence_score": 0.95
 }}
 ```
+"""), ("human", """
+**Text to analyze:**
+{text}
+
+**Entities to extract:**
+{entities}
 
 Extract the entities now:
-""")
+""")]
     
 # Create the output parser
-# output_parser = EntityOutputParser()
+# output_parser = get_entity_output_parser_class()()
 
 # Create the chain
-chain_entities_extraction = prompt_template_entities_extraction | llm.with_structured_output(EntityExtractionResult)
-chain_entities_extraction.name = "ChainEntitiesExtraction"
+@lru_cache(maxsize=1)
+def get_chain_entities_extraction() -> PromptChain:
+    from langchain_core.prompts import ChatPromptTemplate
+    return PromptChain(ChatPromptTemplate.from_messages(_ENTITIES_EXTRACTION_MESSAGES),
+                       structured_llm(EntityExtractionResult), "ChainEntitiesExtraction",
+                       output_schema=EntityExtractionResult)
+
+
+## Batched variant: extract entities for several segments of the same text in one LLM call
+class SegmentEntityExtractionResult(EntityExtractionResult):
+    segment_id: str = Field(description="The segment id this result belongs to")
+
+class BatchEntityExtractionResult(BaseModel):
+    results: List[SegmentEntityExtractionResult] = Field(description="One extraction result per requested segment")
+
+_ENTITIES_EXTRACTION_BATCH_MESSAGES = [("system", """
+You are an expert EDI (Electronic Data Interchange) data extraction specialist. Your task is to extract specific entities for several EDI segments from the given text.
+
+**Instructions:**
+1. Carefully analyze the provided text
+2. For each segment listed in the request, extract values for each of its entities if present
+3. Mark entities as found (true) or not found (false)
+4. Maintain the required status (M=Mandatory, O=Optional) as provided
+5. Provide a confidence score between 0 and 1 for each segment
+6. Return exactly one result per segment, with its segment_id
+
+**Output format (JSON):**
+```json
+{{
+    "results": [
+        {{
+            "segment_id": "SEGMENT_ID",
+            "extracted_entities": [
+                {{
+                    "entity": "ENTITY_NAME",
+                    "value": "extracted_value_or_null",
+                    "required": "M_or_O",
+                    "found": true_or_false
+                }}
+            ],
+            "confidence_score": 0.95
+        }}
+    ]
+}}
+```
+"""), ("human", """
+**Text to analyze:**
+{text}
+
+**Segments and entities to extract:**
+{items}
+
+Extract the entities now:
+""")]
+
+@lru_cache(maxsize=1)
+def get_chain_entities_extraction_batch() -> PromptChain:
+    from langchain_core.prompts import ChatPromptTemplate
+    return PromptChain(ChatPromptTemplate.from_messages(_ENTITIES_EXTRACTION_BATCH_MESSAGES),
+                       structured_llm(BatchEntityExtractionResult), "ChainEntitiesExtractionBatch",
+                       output_schema=BatchEntityExtractionResult)
 
 
 ## Chain to return whether the text is relevant to the segment
 class RelevantTextResult(BaseModel):
     relevant: bool = Field(description="Whether the text is relevant to the segment")
 
-prompt_template_relevant_text = ChatPromptTemplate.from_template("""You are an expert EDI (Electronic Data Interchange) data extraction specialist. Your task is to determine whether the text is relevant to the segment.
+_RELEVANT_TEXT_TEMPLATE = """You are an expert EDI (Electronic Data Interchange) data extraction specialist. Your task is to determine whether the text is relevant to the segment.
 
 **Text to analyze:**
 {text}
@@ -136,17 +361,21 @@ Is expected to contain the following entities:
     "relevant": true_or_false
 }}
 ```
-""")
+"""
 
-chain_relevant_text = prompt_template_relevant_text | llm.with_structured_output(RelevantTextResult)
-chain_relevant_text.name = "ChainRelevantText"
+@lru_cache(maxsize=1)
+def get_chain_relevant_text() -> PromptChain:
+    from langchain_core.prompts import ChatPromptTemplate
+    return PromptChain(ChatPromptTemplate.from_template(_RELEVANT_TEXT_TEMPLATE),
+                       structured_llm(RelevantTextResult), "ChainRelevantText",
+                       output_schema=RelevantTextResult)
 
 # Chain to generate EDI expression given the segment and entities extracted
 class EDIExpressionOutputParser(BaseModel):
     edi_expression: str = Field(description="The EDI expression for the segment and entities extracted")
 
 
-prompt_template_edi_expression = ChatPromptTemplate.from_template("""
+_EDI_EXPRESSION_TEMPLATE = """
 You are an expert EDI (Electronic Data Interchange) data extraction specialist. Your task is to generate an EDI expression for the segment and the entities extracted below.
 Version: {version}
 
@@ -159,20 +388,22 @@ Output format:
     "edi_expression": "EDI_EXPRESSION"
 }}
 ```
-""")
+"""
 
-chain_edi_expression = prompt_template_edi_expression | llm.with_structured_output(EDIExpressionOutputParser)
-chain_edi_expression.name = "ChainEDIExpression"
+@lru_cache(maxsize=1)
+def get_chain_edi_expression() -> PromptChain:
+    from langchain_core.prompts import ChatPromptTemplate
+    return PromptChain(ChatPromptTemplate.from_template(_EDI_EXPRESSION_TEMPLATE),
+                       structured_llm(EDIExpressionOutputParser), "ChainEDIExpression",
+                       output_schema=EDIExpressionOutputParser)
 
 
 # ============================================================================
 # NEW: Structured extraction chain that returns full transaction JSON
 # ============================================================================
 
-from utils.schemas import ExtractedTransaction
-
-prompt_template_structured_extraction = ChatPromptTemplate.from_template("""
-Extract EDI transaction data from the text below into structured JSON.
+_STRUCTURED_EXTRACTION_MESSAGES = [("system", """
+Extract EDI transaction data from the text provided by the user into structured JSON.
 
 **Extract:**
 1. Header: transaction type, PO/invoice number & date, currency (default USD)
@@ -185,14 +416,6 @@ Extract EDI transaction data from the text below into structured JSON.
 8. Service charges: indicator (C/A), amount, code
 9. Totals: subtotal, total, line count
 
-**Transaction Type:** {transaction_type}
-
-**Natural Language Text:**
-{text}
-
-**Expected Fields Reference (from metadata):**
-{metadata_summary}
-
 **Output the extracted data as JSON matching the ExtractedTransaction schema.**
 
 IMPORTANT:
@@ -201,7 +424,337 @@ IMPORTANT:
 - Keep notes field brief (max 50 words)
 - Extract only what's explicitly in the text
 - Be concise and precise
-""")
 
-chain_structured_extraction = prompt_template_structured_extraction | llm.with_structured_output(ExtractedTransaction)
-chain_structured_extraction.name = "ChainStructuredExtraction"
\ No newline at end of file
+**Transaction Type:** {transaction_type}
+
+**Expected Fields Reference (from metadata):**
+{metadata_summary}
+"""), ("human", """
+**Natural Language Text:**
+{text}
+""")]
+
+@lru_cache(maxsize=1)
+def get_chain_structured_extraction() -> PromptChain:
+    from langchain_core.prompts import ChatPromptTemplate
+    return PromptChain(ChatPromptTemplate.from_messages(_STRUCTURED_EXTRACTION_MESSAGES),
+                       structured_llm(ExtractedTransaction), "ChainStructuredExtraction",
+                       output_schema=ExtractedTransaction)
+
+
+# Structured output uses function calling rather than json_schema response_format:
+# strict JSON-schema mode compiles a grammar per schema on the server, which costs tens of
+# seconds on first use (and again after the server evicts it) for large schemas like ExtractedTransaction.
+def _warm_schemas() -> None:
+    """Send one tiny request per chain so server-side schema/tool setup is done before real traffic."""
+    from langchain_core.messages import HumanMessage
+
+    for get_chain in _CHAIN_FACTORIES.values():
+        chain = get_chain()
+        try:
+            chain.runnable.invoke([HumanMessage(content="Return an empty result.")])
+        except Exception as e:
+            print(f"Schema warm-up failed for {chain.name}: {e}")
+
+
+_CHAIN_FACTORIES = {
+    "chain_entities_extraction": get_chain_entities_extraction,
+    "chain_entities_extraction_batch": get_chain_entities_extraction_batch,
+    "chain_relevant_text": get_chain_relevant_text,
+    "chain_edi_expression": get_chain_edi_expression,
+    "chain_structured_extraction": get_chain_structured_extraction,
+}
+
+
+if os.getenv("LLM_WARM_SCHEMAS", "").lower() in ("1", "true", "yes"):
+    # Background thread so importing this module is not blocked on the LLM
+    threading.Thread(target=_warm_schemas, name="llm-schema-warmup", daemon=True).start()
+
+
+# ============================================================================
+# Semantic cache in front of the LLM chains
+# ============================================================================
+
+class SemanticLLMCache:
+    """
+    In-memory cache of chain responses keyed by the embedding of the rendered prompt.
+    Entries are namespaced (e.g. per edi_info_id) and expire after `ttl` seconds.
+    Each namespace keeps its embeddings as one (n, d) float32 matrix, so a lookup is a single matrix-vector product.
+    """
+
+    def __init__(self, embeddings: CachedEmbeddings, threshold: float = 0.97, ttl: float = 3600, max_entries: int = 256):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # namespace -> (expiry times, embedding matrix, responses), oldest entry first
+        self._entries: Dict[str, Tuple[np.ndarray, np.ndarray, List[Any]]] = {}
+
+    def _live(self, namespace: str) -> Optional[Tuple[np.ndarray, np.ndarray, List[Any]]]:
+        entries = self._entries.get(namespace)
+        if entries is None:
+            return None
+        expires, matrix, responses = entries
+        # Entries expire in insertion order, so the live ones are a suffix
+        first_live = int(np.searchsorted(expires, time.monotonic(), side='right'))
+        if first_live:
+            if first_live == len(responses):
+                del self._entries[namespace]
+                return None
+            entries = self._entries[namespace] = (expires[first_live:], matrix[first_live:], responses[first_live:])
+        return entries
+
+    def lookup(self, namespace: str, vector: np.ndarray) -> Optional[Any]:
+        entries = self._live(namespace)
+        if entries is None:
+            return None
+        _, matrix, responses = entries
+        similarities = matrix @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.threshold:
+            return responses[best]
+        return None
+
+    def store(self, namespace: str, vector: np.ndarray, response: Any) -> None:
+        expires_at = np.array([time.monotonic() + self.ttl])
+        entries = self._live(namespace)
+        if entries is None:
+            self._entries[namespace] = (expires_at, vector[np.newaxis, :].copy(), [response])
+            return
+        expires, matrix, responses = entries
+        # Drop the oldest entries so the new one fits within max_entries
+        start = max(len(responses) + 1 - self.max_entries, 0)
+        self._entries[namespace] = (
+            np.concatenate((expires[start:], expires_at)),
+            np.vstack((matrix[start:], vector)),
+            responses[start:] + [response],
+        )
+
+
+# Off by default: a whole-prompt embedding barely moves when only a value (a quantity, a date,
+# a part number) is edited, so a near-match can return another document's extraction.
+# Set LLM_SEMANTIC_CACHE=1 only for workloads that tolerate that.
+LLM_SEMANTIC_CACHE = os.getenv("LLM_SEMANTIC_CACHE", "").lower() in ("1", "true", "yes")
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache() -> SemanticLLMCache:
+    from chroma.chromadb_service import CachedEmbeddings, MercuryEmbeddings, EMBEDDINGS_API_URL
+    return SemanticLLMCache(
+        CachedEmbeddings(MercuryEmbeddings(EMBEDDINGS_API_URL)),
+        threshold=float(os.getenv("LLM_CACHE_THRESHOLD", "0.97")),
+        ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+    )
+
+
+def __getattr__(name: str) -> Any:
+    """Lazy module attributes, so `from engine.chains import llm` etc. keep working."""
+    if name in _CHAIN_FACTORIES:
+        return _CHAIN_FACTORIES[name]()
+    if name == "llm":
+        return get_llm()
+    if name == "llm_cache":
+        return get_llm_cache()
+    if name == "EntityOutputParser":
+        return get_entity_output_parser_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ============================================================================
+# Exact-match response cache on disk (survives restarts, shared by workers)
+# ============================================================================
+
+try:
+    from blake3 import blake3 as _key_hash
+except ImportError:
+    from hashlib import blake2b as _key_hash
+
+# Set LLM_DISK_CACHE=0 to disable; responses are kept for LLM_DISK_CACHE_TTL seconds
+LLM_DISK_CACHE = os.getenv("LLM_DISK_CACHE", "1").lower() not in ("0", "false", "no")
+LLM_DISK_CACHE_DIR = os.getenv("LLM_DISK_CACHE_DIR", "./.edi_cache")
+LLM_DISK_CACHE_TTL = float(os.getenv("LLM_DISK_CACHE_TTL", str(7 * 24 * 3600)))
+
+
+@lru_cache(maxsize=1)
+def get_response_cache():
+    """diskcache.Cache for exact-match responses, or None when disabled."""
+    if not LLM_DISK_CACHE:
+        return None
+    import diskcache
+    return diskcache.Cache(LLM_DISK_CACHE_DIR)
+
+
+@lru_cache(maxsize=None)
+def _schema_fingerprint(schema: Type[BaseModel]) -> bytes:
+    return orjson.dumps(schema.model_json_schema(), option=orjson.OPT_SORT_KEYS)
+
+
+def _response_cache_key(chain: PromptChain, inputs: Dict[str, Any]) -> str:
+    # The rendered messages, the model and the output schema: editing a prompt template,
+    # switching LLM_MODEL or changing the schema all make earlier responses unreachable
+    payload = orjson.dumps({
+        "model": get_llm().model_name,
+        "schema": _schema_fingerprint(chain.output_schema).decode(),
+        "messages": [(message.type, message.content) for message in chain.to_messages(inputs)],
+    })
+    return _key_hash(payload).hexdigest()
+
+
+async def cached_invoke(chain: PromptChain, inputs: Dict[str, Any], namespace: str, cache: bool = True) -> Any:
+    """
+    Invoke a PromptChain, reusing a previous response when the identical prompt was
+    answered before (disk cache) or, with LLM_SEMANTIC_CACHE enabled, a semantically
+    equivalent prompt was already answered in the same namespace.
+    Set cache=False to bypass the caches entirely.
+    """
+    if not cache:
+        return await chain.ainvoke(inputs)
+
+    response_cache = get_response_cache() if chain.output_schema else None
+    if response_cache is not None:
+        key = _response_cache_key(chain, inputs)
+        # diskcache is blocking SQLite/file I/O, so it runs off the event loop
+        cached_json = await asyncio.to_thread(response_cache.get, key)
+        if cached_json is not None:
+            return chain.output_schema.model_validate_json(cached_json)
+        result, invoked = await _semantic_cached_invoke(chain, inputs, namespace)
+        # Only answers to this exact prompt are persisted, never a semantic near-match
+        if invoked and isinstance(result, chain.output_schema):
+            await asyncio.to_thread(response_cache.set, key, result.model_dump_json(), expire=LLM_DISK_CACHE_TTL)
+        return result
+
+    result, _ = await _semantic_cached_invoke(chain, inputs, namespace)
+    return result
+
+
+async def _semantic_cached_invoke(chain: PromptChain, inputs: Dict[str, Any], namespace: str) -> Tuple[Any, bool]:
+    """The response and whether the chain was invoked for it (False for a semantic cache hit)."""
+    if not LLM_SEMANTIC_CACHE:
+        return await chain.ainvoke(inputs), True
+    llm_cache = get_llm_cache()
+    try:
+        prompt_text = chain.format(inputs)
+        vector = np.asarray(await llm_cache.embeddings.aembed_query(prompt_text), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+    except Exception as e:
+        print(f"LLM cache unavailable, invoking chain directly: {e}")
+        return await chain.ainvoke(inputs), True
+
+    cached = llm_cache.lookup(namespace, vector)
+    if cached is not None:
+        return cached, False
+
+    result = await chain.ainvoke(inputs)
+    llm_cache.store(namespace, vector, result)
+    return result, True
+
+
+# ============================================================================
+# OpenAI Batch API path for offline bulk structured extraction
+# ============================================================================
+
+_OPENAI_ROLES = {"system": "system", "human": "user"}
+
+
+class BatchHandle:
+    """A submitted Batch API job; call wait() to poll it and get the parsed transactions."""
+
+    def __init__(self, client: OpenAI, batch_id: str, count: int):
+        self.client = client
+        self.batch_id = batch_id
+        self.count = count
+
+    def wait(self, poll_interval: float = 30) -> List[Optional[ExtractedTransaction]]:
+        """
+        Block until the batch finishes and return one ExtractedTransaction per submitted record,
+        in submission order. Records that failed or returned unparsable output are None.
+        """
+        while True:
+            batch = self.client.batches.retrieve(self.batch_id)
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"Batch {self.batch_id} ended with status {batch.status}")
+            time.sleep(poll_interval)
+
+        results: List[Optional[ExtractedTransaction]] = [None] * self.count
+        if not batch.output_file_id:
+            return results
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            row = orjson.loads(line)
+            try:
+                message = row["response"]["body"]["choices"][0]["message"]
+                arguments = message["tool_calls"][0]["function"]["arguments"]
+                results[int(row["custom_id"])] = ExtractedTransaction.model_validate_json(arguments)
+            except Exception as e:
+                print(f"Batch record {row.get('custom_id')} could not be parsed: {e}")
+        return results
+
+
+def submit_bulk_extraction(records: List[Dict[str, str]]) -> BatchHandle:
+    """
+    Submit structured extractions to the OpenAI Batch API (half the cost of live calls, 24h window).
+    Each record holds the chain_structured_extraction inputs: text, transaction_type, metadata_summary.
+    Only available when the OpenAI fallback is in use, not a custom LLM_API_URL.
+    """
+    if LLM_API_URL:
+        raise ValueError("The Batch API path is only available with OpenAI (LLM_API_URL is set)")
+
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+    from openai import OpenAI
+
+    llm = get_llm()
+    chain_structured_extraction = get_chain_structured_extraction()
+    tool = convert_to_openai_tool(ExtractedTransaction)
+    lines = []
+    for index, record in enumerate(records):
+        messages = [{"role": _OPENAI_ROLES[message.type], "content": message.content}
+                    for message in chain_structured_extraction.to_messages(record)]
+        lines.append(orjson.dumps({
+            "custom_id": str(index),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": llm.model_name,
+                "temperature": llm.temperature,
+                "messages": messages,
+                "tools": [tool],
+                "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+            },
+        }))
+
+    client = OpenAI()
+    batch_file = client.files.create(file=("edi_extraction.jsonl", io.BytesIO(b"\n".join(lines))), purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    print(f"Submitted batch {batch.id} with {len(records)} extraction(s)")
+    return BatchHandle(client, batch.id, len(records))
+
+
+async def _extract_live(records: List[Dict[str, str]]) -> List[Optional[ExtractedTransaction]]:
+    chain_structured_extraction = get_chain_structured_extraction()
+    results = await asyncio.gather(*(chain_structured_extraction.ainvoke(record) for record in records),
+                                   return_exceptions=True)
+    return [None if isinstance(result, Exception) else result for result in results]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract structured EDI transactions from text files")
+    parser.add_argument("files", nargs="+", help="Text files to extract, one transaction per file")
+    parser.add_argument("--transaction-type", required=True, help='Transaction type, e.g. "810" or "850"')
+    parser.add_argument("--metadata-summary", default="", help="Expected fields reference passed to the prompt")
+    parser.add_argument("--batch-api", action="store_true", help="Use the OpenAI Batch API instead of live calls")
+    args = parser.parse_args()
+
+    records = []
+    for path in args.files:
+        with open(path, encoding="utf-8") as f:
+            records.append({"text": f.read(), "transaction_type": args.transaction_type,
+                            "metadata_summary": args.metadata_summary})
+
+    if args.batch_api:
+        transactions = submit_bulk_extraction(records).wait()
+    else:
+        transactions = asyncio.run(_extract_live(records))
+
+    for path, transaction in zip(args.files, transactions):
+        print(json.dumps({"file": path, "transaction": transaction.model_dump() if transaction else None}, indent=2))
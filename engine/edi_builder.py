@@ -2,19 +2,40 @@
 Deterministic EDI segment builder.
 Takes structured JSON (ExtractedTransaction) and builds properly formatted EDI segments.
 """
+from operator import attrgetter
 from typing import List, Dict, Optional
 from utils.schemas import ExtractedTransaction, LineItem, Party, Address, DateReference, Reference
 
+# Pulls every field the line-item builders need in one C-level call, so the
+# per-item loops below work on plain tuples instead of repeated attribute lookups.
+_line_item_fields = attrgetter(
+    "quantity", "unit_of_measure", "unit_price", "product_id_qualifier", "item_id", "status"
+)
+_reference_fields = attrgetter("qualifier", "identifier", "description")
+_date_fields = attrgetter("qualifier", "date_value", "time_value")
+
 
 class EDIBuilder:
     """Builds EDI segments from structured JSON data using deterministic rules."""
     
+    # Segments are formatted with the X12 defaults, "*" between elements and "~" after each segment
     def __init__(self, version: str = "004010"):
         self.version = version
-        self.segment_terminator = "~"
-        self.element_separator = "*"
         
-    def build_transaction(self, data: ExtractedTransaction, transaction_type: str) -> List[str]:
+    def build_transaction(self, data: ExtractedTransaction, transaction_type: str) -> str:
+        """
+        Build the complete transaction as a single EDI string.
+        
+        Args:
+            data: Extracted transaction data
+            transaction_type: "810", "850", etc.
+            
+        Returns:
+            Concatenated EDI segments (each already terminated with "~")
+        """
+        return "".join(self.build_transaction_list(data, transaction_type))
+    
+    def build_transaction_list(self, data: ExtractedTransaction, transaction_type: str) -> List[str]:
         """
         Build complete transaction segments based on type.
         
@@ -25,16 +46,12 @@ class EDIBuilder:
         Returns:
             List of formatted EDI segment strings
         """
-        segments = []
-        
         if transaction_type == "810":
-            segments.extend(self._build_810_invoice(data))
+            return self._build_810_invoice(data)
         elif transaction_type == "850":
-            segments.extend(self._build_850_po(data))
+            return self._build_850_po(data)
         else:
             raise ValueError(f"Unsupported transaction type: {transaction_type}")
-        
-        return segments
     
     def _build_810_invoice(self, data: ExtractedTransaction) -> List[str]:
         """Build 810 invoice segments."""
@@ -47,10 +64,7 @@ class EDIBuilder:
                 segments.append(big)
         
         # REF - Reference Identification
-        for ref in data.references:
-            ref_seg = self._build_REF(ref)
-            if ref_seg:
-                segments.append(ref_seg)
+        segments.extend(self._build_REF_segments(data.references))
         
         # N1 loops - Standard 810 hierarchy: BT → SE → ST → SF
         n1_hierarchy = [
@@ -62,26 +76,14 @@ class EDIBuilder:
         
         for entity_code, party, address in n1_hierarchy:
             if party:
-                # Override entity_code to enforce correct qualifier
-                party_copy = Party(
-                    entity_code=entity_code,
-                    name=party.name,
-                    id_qualifier=party.id_qualifier,
-                    identifier=party.identifier
-                )
-                segments.extend(self._build_N1_loop(party_copy, address))
+                # The hierarchy's entity_code overrides the party's own to enforce the correct qualifier
+                segments.extend(self._build_N1_loop(entity_code, party, address))
         
         # DTM - Date/Time Reference
-        for date_ref in data.dates:
-            dtm = self._build_DTM(date_ref)
-            if dtm:
-                segments.append(dtm)
+        segments.extend(self._build_DTM_segments(data.dates))
         
         # IT1 - Baseline Item Data (Invoice)
-        for idx, item in enumerate(data.items, start=1):
-            it1 = self._build_IT1(item, idx)
-            if it1:
-                segments.append(it1)
+        segments.extend(self._build_IT1_segments(data.items))
         
         # TDS - Total Monetary Value Summary
         if data.total_amount is not None:
@@ -108,16 +110,10 @@ class EDIBuilder:
                 segments.append(beg)
         
         # REF - Reference Identification
-        for ref in data.references:
-            ref_seg = self._build_REF(ref)
-            if ref_seg:
-                segments.append(ref_seg)
+        segments.extend(self._build_REF_segments(data.references))
         
         # DTM - Date/Time Reference
-        for date_ref in data.dates:
-            dtm = self._build_DTM(date_ref)
-            if dtm:
-                segments.append(dtm)
+        segments.extend(self._build_DTM_segments(data.dates))
         
         # N1 loops - Standard 850 hierarchy: BY → SE → BT → ST → SF
         n1_hierarchy = [
@@ -130,20 +126,11 @@ class EDIBuilder:
         
         for entity_code, party, address in n1_hierarchy:
             if party:
-                # Override entity_code to enforce correct qualifier
-                party_copy = Party(
-                    entity_code=entity_code,
-                    name=party.name,
-                    id_qualifier=party.id_qualifier,
-                    identifier=party.identifier
-                )
-                segments.extend(self._build_N1_loop(party_copy, address))
+                # The hierarchy's entity_code overrides the party's own to enforce the correct qualifier
+                segments.extend(self._build_N1_loop(entity_code, party, address))
         
         # PO1 - Baseline Item Data (Purchase Order)
-        for idx, item in enumerate(data.items, start=1):
-            po1 = self._build_PO1(item, idx)
-            if po1:
-                segments.append(po1)
+        segments.extend(self._build_PO1_segments(data.items))
         
         # CTT - Transaction Totals
         if data.number_of_line_items:
@@ -159,115 +146,70 @@ class EDIBuilder:
     
     def _build_BIG(self, data: ExtractedTransaction) -> Optional[str]:
         """BIG - Beginning Segment for Invoice"""
-        parts = ["BIG"]
-        parts.append(data.invoice_date or "")
-        parts.append(data.invoice_number or "")
-        parts.append(data.po_date or "")
-        parts.append(data.po_number or "")
-        parts.append("")  # Release number
-        parts.append("")  # Change order sequence
-        parts.append(data.transaction_purpose or "")
-        parts.append("")  # Transaction type code
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+        # Elements 5, 6 and 8 (release number, change order sequence, transaction type code) are empty
+        return (f"BIG*{data.invoice_date or ''}*{data.invoice_number or ''}*{data.po_date or ''}"
+                f"*{data.po_number or ''}***{data.transaction_purpose or ''}*~")
     
     def _build_BEG(self, data: ExtractedTransaction) -> Optional[str]:
         """BEG - Beginning Segment for Purchase Order"""
-        parts = ["BEG"]
-        parts.append(data.transaction_purpose or "00")  # Purpose code
-        parts.append("SA")  # PO type code (SA = Stand Alone)
-        parts.append(data.po_number or "")
-        parts.append("")  # Release number
-        parts.append(data.po_date or "")
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+        # Purpose code, PO type code (SA = Stand Alone), PO number, empty release number, PO date
+        return f"BEG*{data.transaction_purpose or '00'}*SA*{data.po_number or ''}**{data.po_date or ''}~"
     
-    def _build_REF(self, ref: Reference) -> Optional[str]:
-        """REF - Reference Identification"""
-        if not ref.qualifier:
-            return None
-        
-        parts = ["REF"]
-        parts.append(ref.qualifier)
-        parts.append(ref.identifier or "")
-        parts.append(ref.description or "")
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+    def _build_REF_segments(self, references: List[Reference]) -> List[str]:
+        """REF - Reference Identification, one per reference with a qualifier"""
+        return [
+            f"REF*{qualifier}*{identifier or ''}*{description or ''}~"
+            for qualifier, identifier, description in map(_reference_fields, references)
+            if qualifier
+        ]
     
-    def _build_N1_loop(self, party: Party, address: Optional[Address] = None) -> List[str]:
-        """Build N1/N3/N4 loop for a party"""
+    def _build_N1_loop(self, entity_code: str, party: Party, address: Optional[Address] = None) -> List[str]:
+        """Build N1/N3/N4 loop for a party under the given entity identifier code"""
         segments = []
         
         # N1 - Name
-        if party.entity_code:
-            parts = ["N1"]
-            parts.append(party.entity_code)
-            parts.append(party.name or "")
-            parts.append(party.id_qualifier or "")
-            parts.append(party.identifier or "")
-            segments.append(self.element_separator.join(parts) + self.segment_terminator)
+        if entity_code:
+            segments.append(f"N1*{entity_code}*{party.name or ''}*{party.id_qualifier or ''}*{party.identifier or ''}~")
         
         # N3 - Address Information
         if address and (address.street_line_1 or address.street_line_2):
-            parts = ["N3"]
-            parts.append(address.street_line_1 or "")
-            if address.street_line_2:
-                parts.append(address.street_line_2)
-            segments.append(self.element_separator.join(parts) + self.segment_terminator)
+            street_line_2 = f"*{address.street_line_2}" if address.street_line_2 else ""
+            segments.append(f"N3*{address.street_line_1 or ''}{street_line_2}~")
         
         # N4 - Geographic Location
         if address and (address.city or address.state or address.postal_code):
-            parts = ["N4"]
-            parts.append(address.city or "")
-            parts.append(address.state or "")
-            parts.append(address.postal_code or "")
-            if address.country_code:
-                parts.append(address.country_code)
-            segments.append(self.element_separator.join(parts) + self.segment_terminator)
+            country_code = f"*{address.country_code}" if address.country_code else ""
+            segments.append(f"N4*{address.city or ''}*{address.state or ''}*{address.postal_code or ''}{country_code}~")
         
         return segments
     
-    def _build_DTM(self, date_ref: DateReference) -> Optional[str]:
-        """DTM - Date/Time Reference"""
-        if not date_ref.qualifier or not date_ref.date_value:
-            return None
-        
-        parts = ["DTM"]
-        parts.append(date_ref.qualifier)
-        parts.append(date_ref.date_value)
-        if date_ref.time_value:
-            parts.append(date_ref.time_value)
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+    def _build_DTM_segments(self, dates: List[DateReference]) -> List[str]:
+        """DTM - Date/Time Reference, one per date with a qualifier and value"""
+        return [
+            f"DTM*{qualifier}*{date_value}{f'*{time_value}' if time_value else ''}~"
+            for qualifier, date_value, time_value in map(_date_fields, dates)
+            if qualifier and date_value
+        ]
     
-    def _build_IT1(self, item: LineItem, line_num: int) -> Optional[str]:
-        """IT1 - Baseline Item Data (Invoice)"""
-        parts = ["IT1"]
-        parts.append(str(line_num))
-        parts.append(str(item.quantity) if item.quantity else "")
-        parts.append(item.unit_of_measure or "")
-        parts.append(str(item.unit_price) if item.unit_price else "")
-        parts.append("")  # Basis of unit price
-        parts.append(item.product_id_qualifier or "")
-        parts.append(item.item_id or "")
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+    def _build_IT1_segments(self, items: List[LineItem]) -> List[str]:
+        """IT1 - Baseline Item Data (Invoice), one per line item, numbered from 1"""
+        # Element 5 (basis of unit price) is empty
+        return [
+            f"IT1*{line_num}*{quantity if quantity else ''}*{uom or ''}*{unit_price if unit_price else ''}"
+            f"**{qualifier or ''}*{item_id or ''}~"
+            for line_num, (quantity, uom, unit_price, qualifier, item_id, _status)
+            in enumerate(map(_line_item_fields, items), start=1)
+        ]
     
-    def _build_PO1(self, item: LineItem, line_num: int) -> Optional[str]:
-        """PO1 - Baseline Item Data (Purchase Order)"""
-        # Handle cancelled items
-        qty = 0 if item.status == "CANCELLED" else (item.quantity or 0)
-        
-        parts = ["PO1"]
-        parts.append(str(line_num))
-        parts.append(str(qty))
-        parts.append(item.unit_of_measure or "EA")
-        parts.append(str(item.unit_price) if item.unit_price else "")
-        parts.append("")  # Basis of unit price
-        parts.append(item.product_id_qualifier or "BP")
-        parts.append(item.item_id or "")
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+    def _build_PO1_segments(self, items: List[LineItem]) -> List[str]:
+        """PO1 - Baseline Item Data (Purchase Order), one per line item, numbered from 1"""
+        # Cancelled items are sent with quantity 0; element 5 (basis of unit price) is empty
+        return [
+            f"PO1*{line_num}*{0 if status == 'CANCELLED' else (quantity or 0)}*{uom or 'EA'}"
+            f"*{unit_price if unit_price else ''}**{qualifier or 'BP'}*{item_id or ''}~"
+            for line_num, (quantity, uom, unit_price, qualifier, item_id, status)
+            in enumerate(map(_line_item_fields, items), start=1)
+        ]
     
     def _build_TDS(self, data: ExtractedTransaction) -> Optional[str]:
         """TDS - Total Monetary Value Summary"""
@@ -275,19 +217,11 @@ class EDIBuilder:
             return None
         
         # Convert to cents/smallest unit (multiply by 100, no decimal)
-        amount_str = str(int(data.total_amount * 100))
-        
-        parts = ["TDS"]
-        parts.append(amount_str)
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+        return f"TDS*{round(data.total_amount * 100)}~"
     
     def _build_CTT(self, data: ExtractedTransaction) -> Optional[str]:
         """CTT - Transaction Totals"""
         if not data.number_of_line_items:
             return None
         
-        parts = ["CTT"]
-        parts.append(str(data.number_of_line_items))
-        
-        return self.element_separator.join(parts) + self.segment_terminator
+        return f"CTT*{data.number_of_line_items}~"
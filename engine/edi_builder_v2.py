@@ -2,194 +2,327 @@
 DB-driven EDI builder that dynamically constructs segments based on mercury schema.
 Uses elementusagedefs and segmentusage tables to build accurate EDI expressions.
 """
-from typing import Dict, List, Optional, Any
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import text
+import asyncio
+from collections import namedtuple
+from functools import lru_cache
+from operator import attrgetter
+from typing import Callable, ClassVar, Dict, Iterable, List, Optional, Any, Sequence, Tuple, Union
+import asyncpg
 from utils.schemas import ExtractedTransaction
-from utils.constants import DATABASE_URL
+from utils.constants import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_RECYCLE
+
+
+# Full element/segment usage for one (agency, version) in a single round trip: custom rows,
+# plus base rows for any segment/transaction the custom table does not override
+_ELEMENT_USAGE_SQL = """
+    SELECT segment_id, position, element_id, description, requirement_designator, 
+           type, minimum_length, maximum_length, composite_element
+    FROM mercury.custom_elementusagedefs 
+    WHERE agency=$1 AND version=$2
+    UNION ALL
+    SELECT b.segment_id, b.position, b.element_id, b.description, b.requirement_designator, 
+           b.type, b.minimum_length, b.maximum_length, b.composite_element
+    FROM mercury.elementusagedefs b
+    WHERE b.agency=$1 AND b.version=$2
+      AND NOT EXISTS (
+          SELECT 1 FROM mercury.custom_elementusagedefs c
+          WHERE c.segment_id=b.segment_id AND c.agency=b.agency AND c.version=b.version
+      )
+    ORDER BY segment_id, position ASC
+"""
+_SEGMENT_USAGE_SQL = """
+    SELECT transactionsetid, position, segmentid, requirementdesignator, maximumusage, 
+           maximumlooprepeat, loopid, section
+    FROM mercury.custom_segmentusage 
+    WHERE agency=$1 AND version=$2
+    UNION ALL
+    SELECT b.transactionsetid, b.position, b.segmentid, b.requirementdesignator, b.maximumusage, 
+           b.maximumlooprepeat, b.loopid, b.section
+    FROM mercury.segmentusage b
+    WHERE b.agency=$1 AND b.version=$2
+      AND NOT EXISTS (
+          SELECT 1 FROM mercury.custom_segmentusage c
+          WHERE c.transactionsetid=b.transactionsetid AND c.agency=b.agency AND c.version=b.version
+      )
+    ORDER BY transactionsetid, position ASC
+"""
+
+# One elementusagedefs row (segment_id is the cache key); far smaller than a dict per row
+ElementSpec = namedtuple(
+    "ElementSpec",
+    "position element_id description requirement_designator type minimum_length maximum_length composite_element",
+)
+
+
+@lru_cache(maxsize=256)
+def _formatter_for(element_type: str, max_len: int) -> Callable[[Any], str]:
+    """
+    Formatter for a (type, maximum_length) element spec, built once and reused.
+    Callers skip None/"" values before formatting.
+    """
+    # Most elements are plain alphanumeric/ID values, so they are checked first
+    if element_type != 'DT' and element_type != 'N0' and element_type != 'N2' and element_type != 'R':
+        def format_string(value: Any) -> str:
+            # Strings are used as-is; truncate to max length only when needed
+            value_str = value if type(value) is str else str(value)
+            return value_str if len(value_str) <= max_len else value_str[:max_len]
+        return format_string
+    
+    if element_type == 'DT':
+        # Dates are already YYYYMMDD when 8 characters long, otherwise truncated like strings
+        def format_date(value: Any) -> str:
+            value_str = value if type(value) is str else str(value)
+            return value_str if len(value_str) == 8 else value_str[:max_len]
+        return format_date
+    
+    # Numeric types: whole numbers lose the decimal point, N0 drops it entirely; never truncated
+    strip_point = element_type == 'N0'
+    
+    def format_numeric(value: Any) -> str:
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        value_str = str(value)
+        return value_str.replace('.', '') if strip_point else value_str
+    return format_numeric
+
+
+def _to_cents(amount: float) -> str:
+    """
+    Monetary amount as whole cents (implied two decimals, as in SAC05/TDS01).
+    Rounds rather than truncates: 0.29 * 100 is 28.999999999999996 in binary floating point.
+    """
+    return str(round(amount * 100))
+
+
+# Fixed-shape segments: position -> (ExtractedTransaction attribute, default when falsy).
+# Positions not listed (release number, change order sequence, action code) are always empty.
+_BIG_FIELDS = {
+    1: ('invoice_date', None),  # Date
+    2: ('invoice_number', None),  # Invoice Number
+    3: ('po_date', None),  # Purchase Order Date (optional)
+    4: ('po_number', None),  # Purchase Order Number (optional)
+    7: ('transaction_type_code', None),  # Transaction Type Code (PP for prepaid)
+    8: ('transaction_purpose', None),  # Transaction Set Purpose Code
+}
+_BEG_FIELDS = {
+    1: ('transaction_purpose', None),  # Transaction Set Purpose Code (00=Original)
+    2: ('transaction_type_code', 'NE'),  # Purchase Order Type (NE=New Order)
+    3: ('po_number', None),  # Purchase Order Number
+    5: ('po_date', None),  # Date
+}
 
 
 class DBDrivenEDIBuilder:
     """Builds EDI segments by querying DB for structure and rules."""
     
+    # Schema caches are class-level so every builder in the process shares them: a builder
+    # created per request reuses what earlier ones loaded. Keys are (id, agency, version),
+    # a small fixed set, so they are left unbounded.
+    segment_cache: ClassVar[Dict[Tuple[str, str, str], List[Dict]]] = {}
+    element_cache: ClassVar[Dict[Tuple[str, str, str], List[ElementSpec]]] = {}
+    # Same keys as element_cache: {position: element spec} for O(1) lookup in build_segment
+    element_index: ClassVar[Dict[Tuple[str, str, str], Dict[int, ElementSpec]]] = {}
+    # (agency, version) pairs whose usage tables are fully loaded into the caches
+    loaded_versions: ClassVar[set] = set()
+    # (segment_id, agency, version) -> compiled builder for fixed-shape segments
+    compiled_segments: ClassVar[Dict[Tuple[str, str, str], Callable[[ExtractedTransaction], str]]] = {}
+    # (segment_id, agency, version) -> formatter per position (index 0 is position 1, None where no spec)
+    segment_formatters: ClassVar[Dict[Tuple[str, str, str], Tuple[Optional[Callable[[Any], str]], ...]]] = {}
+    
     def __init__(self):
-        self.engine = None
-        self.segment_cache = {}
-        self.element_cache = {}
-    
-    async def initialize(self):
-        """Create async engine for DB queries."""
-        if not self.engine:
-            self.engine = create_async_engine(
-                DATABASE_URL,
-                echo=False,
-                pool_pre_ping=True,
-                pool_recycle=3600
+        self.pool = None
+    
+    async def initialize(self, preload: Iterable[Tuple[str, str]] = ()):
+        """Create asyncpg pool for DB queries and preload schema for the given (agency, version) pairs."""
+        if not self.pool:
+            # asyncpg takes a plain postgresql:// DSN, without SQLAlchemy's driver suffix
+            self.pool = await asyncpg.create_pool(
+                DATABASE_URL.replace('+asyncpg', ''),
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=DB_POOL_RECYCLE,
+                # The schema loads scan whole usage tables, so the planner's cost estimate can trigger
+                # JIT compilation, which costs more than these short queries save
+                server_settings={'jit': 'off'}
             )
+        for agency, version in preload:
+            await self.preload(agency, version)
     
     async def dispose(self):
-        """Clean up engine connection."""
-        if self.engine:
-            await self.engine.dispose()
-            self.engine = None
+        """Clean up pool connections."""
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
     
-    async def get_segment_structure(self, segment_id: str, agency: str = 'X', version: str = '004010') -> List[Dict]:
+    async def _fetch_rows(self, query: str, agency: str, version: str) -> List[Dict]:
+        async with self.pool.acquire() as conn:
+            # Prepared statements are per connection; asyncpg caches them, so re-preparing is a lookup
+            statement = await conn.prepare(query)
+            return [dict(r) for r in await statement.fetch(agency, version)]
+    
+    async def preload(self, agency: str, version: str):
+        """
+        Load elementusagedefs and segmentusage for an agency/version in two parallel queries,
+        so later lookups are served from memory. The queries already resolve custom overrides:
+        a segment/transaction present in a custom table replaces its base rows entirely.
+        """
+        if (agency, version) in self.loaded_versions:
+            return
+        
+        element_rows, segment_rows = await asyncio.gather(
+            self._fetch_rows(_ELEMENT_USAGE_SQL, agency, version),
+            self._fetch_rows(_SEGMENT_USAGE_SQL, agency, version),
+        )
+        
+        buckets = {}
+        for row in element_rows:
+            segment_id = row.pop('segment_id')
+            buckets.setdefault((segment_id, agency, version), []).append(ElementSpec(**row))
+        self.element_cache.update(buckets)
+        self.element_index.update(
+            (key, {e.position: e for e in elements}) for key, elements in buckets.items()
+        )
+        
+        buckets = {}
+        for row in segment_rows:
+            transaction_id = row.pop('transactionsetid')
+            buckets.setdefault((transaction_id, agency, version), []).append(row)
+        self.segment_cache.update(buckets)
+        
+        self.loaded_versions.add((agency, version))
+    
+    async def get_segment_structure(self, segment_id: str, agency: str = 'X', version: str = '004010') -> List[ElementSpec]:
         """
         Get element structure for a segment from elementusagedefs table.
         Returns list of elements in position order with metadata.
         """
-        cache_key = f"{segment_id}_{agency}_{version}"
-        if cache_key in self.element_cache:
-            return self.element_cache[cache_key]
-        
-        async with self.engine.begin() as conn:
-            # Try custom table first
-            result = await conn.execute(text("""
-                SELECT position, element_id, description, requirement_designator, 
-                       type, minimum_length, maximum_length, composite_element
-                FROM mercury.custom_elementusagedefs 
-                WHERE segment_id=:seg AND agency=:agency AND version=:version
-                ORDER BY position ASC
-            """), {"seg": segment_id, "agency": agency, "version": version})
-            
-            rows = result.fetchall()
-            
-            # Fallback to base table if custom not found
-            if not rows:
-                result = await conn.execute(text("""
-                    SELECT position, element_id, description, requirement_designator, 
-                           type, minimum_length, maximum_length, composite_element
-                    FROM mercury.elementusagedefs 
-                    WHERE segment_id=:seg AND agency=:agency AND version=:version
-                    ORDER BY position ASC
-                """), {"seg": segment_id, "agency": agency, "version": version})
-                rows = result.fetchall()
-            
-            elements = [dict(r._mapping) for r in rows]
-            self.element_cache[cache_key] = elements
-            return elements
+        cache_key = (segment_id, agency, version)
+        if cache_key not in self.element_cache:
+            await self.preload(agency, version)
+        return self.element_cache.get(cache_key, [])
     
     async def get_transaction_segments(self, transaction_id: str, agency: str = 'X', version: str = '004010') -> List[Dict]:
         """
         Get ordered list of segments for a transaction from segmentusage table.
         Returns segments in position order with usage metadata.
         """
-        cache_key = f"{transaction_id}_{agency}_{version}"
-        if cache_key in self.segment_cache:
-            return self.segment_cache[cache_key]
-        
-        async with self.engine.begin() as conn:
-            # Try custom table first
-            result = await conn.execute(text("""
-                SELECT position, segmentid, requirementdesignator, maximumusage, 
-                       maximumlooprepeat, loopid, section
-                FROM mercury.custom_segmentusage 
-                WHERE transactionsetid=:txn AND agency=:agency AND version=:version
-                ORDER BY position ASC
-            """), {"txn": transaction_id, "agency": agency, "version": version})
-            
-            rows = result.fetchall()
-            
-            # Fallback to base table
-            if not rows:
-                result = await conn.execute(text("""
-                    SELECT position, segmentid, requirementdesignator, maximumusage, 
-                           maximumlooprepeat, loopid, section
-                    FROM mercury.segmentusage 
-                    WHERE transactionsetid=:txn AND agency=:agency AND version=:version
-                    ORDER BY position ASC
-                """), {"txn": transaction_id, "agency": agency, "version": version})
-                rows = result.fetchall()
-            
-            segments = [dict(r._mapping) for r in rows]
-            self.segment_cache[cache_key] = segments
-            return segments
+        cache_key = (transaction_id, agency, version)
+        if cache_key not in self.segment_cache:
+            await self.preload(agency, version)
+        return self.segment_cache.get(cache_key, [])
+    
+    async def get_segment_structures(self, segment_ids: Iterable[str], agency: str = 'X',
+                                     version: str = '004010') -> Dict[str, List[ElementSpec]]:
+        """
+        Element structures for several segments at once: {segment_id: elements in position order}.
+        The agency/version is loaded with a single query at most; the rest are cache reads.
+        """
+        await self.preload(agency, version)
+        return {segment_id: self.element_cache.get((segment_id, agency, version), []) for segment_id in segment_ids}
     
-    def _format_element(self, value: Any, element_spec: Dict) -> str:
+    def _format_element(self, value: Any, element_spec: ElementSpec) -> str:
         """Format a single element value according to its specification."""
         if value is None or value == "":
             return ""
+        return _formatter_for(element_spec.type, element_spec.maximum_length)(value)
+    
+    def _element_specs(self, segment_id: str, agency: str, version: str) -> Dict[int, ElementSpec]:
+        """{position: element spec} from the preloaded cache; build_transaction preloads agency/version first."""
+        spec_by_pos = self.element_index.get((segment_id, agency, version))
+        if not spec_by_pos:
+            if (agency, version) not in self.loaded_versions:
+                raise ValueError(f"Schema for {agency}/{version} not loaded; call preload() before build_segment")
+            raise ValueError(f"No structure found for segment {segment_id}")
+        return spec_by_pos
+    
+    def _positional_formatters(self, segment_id: str, agency: str,
+                               version: str) -> Tuple[Optional[Callable[[Any], str]], ...]:
+        """Formatters resolved once per segment so positional builds skip the per-element spec lookup."""
+        key = (segment_id, agency, version)
+        formatters = self.segment_formatters.get(key)
+        if formatters is None:
+            spec_by_pos = self._element_specs(segment_id, agency, version)
+            formatters = tuple(
+                _formatter_for(spec_by_pos[pos].type, spec_by_pos[pos].maximum_length) if pos in spec_by_pos else None
+                for pos in range(1, max(spec_by_pos) + 1)
+            )
+            self.segment_formatters[key] = formatters
+        return formatters
+    
+    def _compiled_segment(self, segment_id: str, fields: Dict[int, Tuple[str, Optional[str]]],
+                          agency: str, version: str) -> Callable[[ExtractedTransaction], str]:
+        """
+        Specialize a fixed-shape segment once per agency/version: resolve which positions exist,
+        their formatters and attribute getters up front, so each build just reads attributes
+        and joins. Produces the same output as build_segment with the equivalent data map.
+        """
+        key = (segment_id, agency, version)
+        compiled = self.compiled_segments.get(key)
+        if compiled is not None:
+            return compiled
+        
+        spec_by_pos = self._element_specs(segment_id, agency, version)
+        plan = tuple(
+            (pos, attrgetter(attr), default, _formatter_for(spec_by_pos[pos].type, spec_by_pos[pos].maximum_length))
+            for pos, (attr, default) in sorted(fields.items())
+            if pos in spec_by_pos
+        )
+        
+        def compiled(data: ExtractedTransaction) -> str:
+            parts = [segment_id]
+            for pos, get_value, default, format_value in plan:
+                value = get_value(data)
+                if default is not None:
+                    value = value or default
+                if value is None or value == "":
+                    continue
+                parts.extend([""] * (pos - len(parts)))
+                parts.append(format_value(value))
+            
+            # Remove trailing empty elements
+            while len(parts) > 1 and parts[-1] == "":
+                parts.pop()
+            
+            return f'{"*".join(parts)}~'
         
-        # Convert to string
-        value_str = str(value)
-        
-        # Handle date formatting (DT type should be YYYYMMDD)
-        if element_spec['type'] == 'DT' and len(value_str) == 8:
-            return value_str
-        
-        # Handle numeric types
-        if element_spec['type'] in ('N0', 'N2', 'R'):
-            # For whole numbers, remove decimal point
-            if isinstance(value, float) and value.is_integer():
-                value_str = str(int(value))
-            elif element_spec['type'] == 'N0':
-                value_str = value_str.replace('.', '')
-            return value_str
-        
-        # Truncate to max length if needed
-        max_len = element_spec['maximum_length']
-        if len(value_str) > max_len:
-            value_str = value_str[:max_len]
-        
-        return value_str
+        self.compiled_segments[key] = compiled
+        return compiled
     
-    async def build_segment(self, segment_id: str, data_map: Dict[int, Any], 
+    def build_segment(self, segment_id: str, data_map: Union[Sequence[Any], Dict[int, Any]],
                            agency: str = 'X', version: str = '004010') -> str:
         """
         Build a segment dynamically based on DB structure.
         
         Args:
             segment_id: Segment identifier (e.g., 'BIG', 'N1', 'IT1')
-            data_map: Dict mapping position number to value
+            data_map: Element values in position order (index 0 is position 1),
+                or a dict mapping position number to value
             agency: Agency code (default 'X')
             version: EDI version (default '004010')
         
         Returns:
             Formatted EDI segment string with element separator
         """
-        structure = await self.get_segment_structure(segment_id, agency, version)
-        
-        if not structure:
-            raise ValueError(f"No structure found for segment {segment_id}")
-        
-        # Start with segment ID
-        parts = [segment_id]
-        
-        # Build elements in position order
-        max_position = structure[-1]['position']
-        
-        for pos in range(1, max_position + 1):
-            # Find element spec for this position
-            element_spec = next((e for e in structure if e['position'] == pos), None)
-            
-            if not element_spec:
-                # No spec for this position, leave empty
-                parts.append("")
-                continue
-            
-            # Get value from data map
-            value = data_map.get(pos)
-            
-            # Check if required
-            is_required = element_spec['requirement_designator'] == 'M'
-            
-            if value is None or value == "":
-                if is_required:
-                    # Required but missing - this is an error but we'll add empty
-                    parts.append("")
-                else:
-                    # Optional and missing - add empty
-                    parts.append("")
-            else:
-                # Format and add the value
-                formatted = self._format_element(value, element_spec)
-                parts.append(formatted)
-        
-        # Remove trailing empty elements
-        while len(parts) > 1 and parts[-1] == "":
-            parts.pop()
-        
-        return "*".join(parts) + "~"
+        if isinstance(data_map, dict):
+            spec_by_pos = self._element_specs(segment_id, agency, version)
+            # Sparse {position: formatted value}; only positions with both an element spec and a value
+            formatted = {}
+            for pos, value in data_map.items():
+                if value is not None and value != "" and pos in spec_by_pos:
+                    spec = spec_by_pos[pos]
+                    formatted[pos] = _formatter_for(spec.type, spec.maximum_length)(value)
+            parts = [formatted.get(pos, "") for pos in range(1, max(formatted, default=0) + 1)]
+        else:
+            # Positions without a value or without an element spec are left empty; values past the
+            # last spec'd position would only be trailing empties, so zip drops them
+            parts = [
+                "" if format_value is None or value is None or value == "" else format_value(value)
+                for format_value, value in zip(self._positional_formatters(segment_id, agency, version), data_map)
+            ]
+        
+        # Strip trailing empty elements (a value can format to "", e.g. truncated to max length 0)
+        tail = "*".join(parts).rstrip("*")
+        return f"{segment_id}*{tail}~" if tail else f"{segment_id}~"
     
     async def build_transaction(self, data: ExtractedTransaction, 
                                agency: str = 'X', version: str = '004010') -> List[str]:
@@ -200,329 +333,244 @@ class DBDrivenEDIBuilder:
         Returns:
             List of EDI segment strings
         """
-        transaction_id = data.transaction_type
+        # The only I/O in a build; every segment after this is served from memory
+        await self.preload(agency, version)
         
+        return self._route_transaction(data, agency, version, [])
+
+    async def build_transaction_str(self, data: ExtractedTransaction,
+                                    agency: str = 'X', version: str = '004010') -> str:
+        """
+        Build complete EDI transaction as one newline-separated document.
+        Prefer this over joining build_transaction() output when the caller needs the text.
+        """
+        return "\n".join(await self.build_transaction(data, agency, version))
+
+    def _route_transaction(self, data: ExtractedTransaction, agency: str, version: str, out):
+        """Route to the transaction-specific builder, which appends its segments to out."""
+        transaction_id = data.transaction_type
         if transaction_id == '810':
-            return await self._build_810_transaction(data, agency, version)
+            return self._build_810_transaction(data, agency, version, out)
         elif transaction_id == '850':
-            return await self._build_850_transaction(data, agency, version)
+            return self._build_850_transaction(data, agency, version, out)
         else:
             raise ValueError(f"Unsupported transaction type: {transaction_id}")
-    
-    async def _build_810_transaction(self, data: ExtractedTransaction, 
-                                     agency: str, version: str) -> List[str]:
+
+    def _build_810_transaction(self, data: ExtractedTransaction, 
+                                     agency: str, version: str, segments: List[str]) -> List[str]:
         """Build 810 Invoice transaction - data-driven based on what exists."""
-        segments = []
+        # Loop helpers append straight into segments rather than returning their own lists,
+        # and are only called when their source list has entries
         
         # BIG - Beginning segment for invoice
-        big_seg = await self._build_BIG(data, agency, version)
+        big_seg = self._build_BIG(data, agency, version)
         if big_seg:
             segments.append(big_seg)
         
         # N1 loops - data-driven (handles BT/II/II or RE/BT/ST patterns)
-        n1_segs = await self._build_N1_loops_810(data, agency, version)
-        segments.extend(n1_segs)
+        self._build_N1_loops_810(data, agency, version, segments)
         
         # LM/LQ - Code source information (before IT1 in DoD pattern)
-        lm_segs = await self._build_LM_loops(data, agency, version)
-        segments.extend(lm_segs)
+        if data.code_lists:
+            self._build_LM_loops(data, agency, version, segments)
         
         # FA1/FA2 - Financial accounting (after LM, before IT1 in DoD pattern)
-        fa_segs = await self._build_FA_loops(data, agency, version)
-        segments.extend(fa_segs)
+        if data.financial_accounting:
+            self._build_FA_loops(data, agency, version, segments)
         
         # IT1 - Line items (data-driven for NSN vs BP/VP structure)
-        it1_segs = await self._build_IT1_loops(data, agency, version)
-        segments.extend(it1_segs)
+        if data.items:
+            self._build_IT1_loops(data, agency, version, segments)
         
         # REF - Reference identification (after IT1)
-        ref_segs = await self._build_REF_loops(data, agency, version)
-        segments.extend(ref_segs)
+        if data.references:
+            self._build_REF_loops(data, agency, version, segments)
         
         # DTM - Date/time reference
-        dtm_segs = await self._build_DTM_loops(data, agency, version)
-        segments.extend(dtm_segs)
+        if data.dates:
+            self._build_DTM_loops(data, agency, version, segments)
         
         # ITD - Payment terms (only if present)
         if data.payment_terms:
-            itd_seg = await self._build_ITD(data, agency, version)
+            itd_seg = self._build_ITD(data, agency, version)
             if itd_seg:
                 segments.append(itd_seg)
         
         # Carrier - CAD if carrier_detail exists, TD5 if carrier_info exists
         if data.carrier_detail:
-            cad_seg = await self._build_CAD(data, agency, version)
+            cad_seg = self._build_CAD(data, agency, version)
             if cad_seg:
                 segments.append(cad_seg)
         elif data.carrier_info:
-            td5_seg = await self._build_TD5(data, agency, version)
+            td5_seg = self._build_TD5(data, agency, version)
             if td5_seg:
                 segments.append(td5_seg)
         
         # SAC - Service charges
-        sac_segs = await self._build_SAC_loops(data, agency, version)
-        segments.extend(sac_segs)
+        if data.service_charges:
+            self._build_SAC_loops(data, agency, version, segments)
         
         # Second LM/LQ block (after SAC in DoD pattern)
-        lm_segs_2 = await self._build_LM_loops_2(data, agency, version)
-        segments.extend(lm_segs_2)
+        if data.code_lists_post_sac:
+            self._build_LM_loops_2(data, agency, version, segments)
         
         # TDS - Final total monetary value
-        tds_seg = await self._build_TDS(data, agency, version)
+        tds_seg = self._build_TDS(data, agency, version)
         if tds_seg:
             segments.append(tds_seg)
         
         # CTT - Transaction totals
-        ctt_seg = await self._build_CTT(data, agency, version)
+        ctt_seg = self._build_CTT(data, agency, version)
         if ctt_seg:
             segments.append(ctt_seg)
         
         return segments
     
-    async def _build_850_transaction(self, data: ExtractedTransaction,
-                                     agency: str, version: str) -> List[str]:
+    def _build_850_transaction(self, data: ExtractedTransaction,
+                                     agency: str, version: str, segments: List[str]) -> List[str]:
         """Build 850 Purchase Order transaction."""
-        segments = []
+        # Loop helpers append straight into segments rather than returning their own lists,
+        # and are only called when their source list has entries
 
         # BEG - Beginning segment for PO
-        beg_seg = await self._build_BEG(data, agency, version)
+        beg_seg = self._build_BEG(data, agency, version)
         if beg_seg:
             segments.append(beg_seg)
 
         # CUR - Currency (always include, defaults to USD)
-        cur_seg = await self._build_CUR(data, agency, version)
+        cur_seg = self._build_CUR(data, agency, version)
         if cur_seg:
             segments.append(cur_seg)
 
         # REF - Reference identification
-        ref_segs = await self._build_REF_loops(data, agency, version)
-        segments.extend(ref_segs)
+        if data.references:
+            self._build_REF_loops(data, agency, version, segments)
 
         # FOB - Shipping terms (if present)
         if data.fob_terms:
-            fob_seg = await self._build_FOB(data, agency, version)
+            fob_seg = self._build_FOB(data, agency, version)
             if fob_seg:
                 segments.append(fob_seg)
 
         # SAC - Service charges/allowances (if present)
         if data.service_charges:
-            sac_segs = await self._build_SAC_loops(data, agency, version)
-            segments.extend(sac_segs)
+            self._build_SAC_loops(data, agency, version, segments)
 
         # ITD - Payment terms (if present)
         if data.payment_terms:
-            itd_seg = await self._build_ITD(data, agency, version)
+            itd_seg = self._build_ITD(data, agency, version)
             if itd_seg:
                 segments.append(itd_seg)
 
         # DTM - Date/time reference
-        dtm_segs = await self._build_DTM_loops(data, agency, version)
-        segments.extend(dtm_segs)
+        if data.dates:
+            self._build_DTM_loops(data, agency, version, segments)
 
         # TD5 - Carrier details (if present)
         if data.carrier_info:
-            td5_seg = await self._build_TD5(data, agency, version)
+            td5_seg = self._build_TD5(data, agency, version)
             if td5_seg:
                 segments.append(td5_seg)
 
         # N9/MTX - Special instructions and notes (if present)
         if data.special_instructions:
-            n9_mtx_segs = await self._build_N9_MTX_loops(data, agency, version)
-            segments.extend(n9_mtx_segs)
+            self._build_N9_MTX_loops(data, agency, version, segments)
 
         # N1 loops - parties in specific order for 850: BY, SE, BT, ST, SF
-        n1_segs = await self._build_N1_loops_850(data, agency, version)
-        segments.extend(n1_segs)
+        self._build_N1_loops_850(data, agency, version, segments)
 
         # PO1 - Line items (includes PO4 and AMT for each item)
-        po1_segs = await self._build_PO1_loops(data, agency, version)
-        segments.extend(po1_segs)
+        if data.items:
+            self._build_PO1_loops(data, agency, version, segments)
 
         # CTT - Transaction totals
-        ctt_seg = await self._build_CTT(data, agency, version)
+        ctt_seg = self._build_CTT(data, agency, version)
         if ctt_seg:
             segments.append(ctt_seg)
 
         # AMT - Total amount (if present)
         if data.total_amount:
-            amt_seg = await self._build_AMT_total(data, agency, version)
+            amt_seg = self._build_AMT_total(data, agency, version)
             if amt_seg:
                 segments.append(amt_seg)
 
         return segments
     
-    async def _build_BIG(self, data: ExtractedTransaction, agency: str, version: str) -> str:
+    def _build_BIG(self, data: ExtractedTransaction, agency: str, version: str) -> str:
         """Build BIG (Beginning Segment for Invoice) segment."""
-        data_map = {
-            1: data.invoice_date,  # Date
-            2: data.invoice_number,  # Invoice Number
-            3: data.po_date,  # Purchase Order Date (optional)
-            4: data.po_number,  # Purchase Order Number (optional)
-            5: None,  # Release Number
-            6: None,  # Change Order Sequence Number
-            7: data.transaction_type_code,  # Transaction Type Code (PP for prepaid)
-            8: data.transaction_purpose,  # Transaction Set Purpose Code
-            9: None,  # Action Code
-        }
-        return await self.build_segment('BIG', data_map, agency, version)
-    
-    async def _build_BEG(self, data: ExtractedTransaction, agency: str, version: str) -> str:
+        return self._compiled_segment('BIG', _BIG_FIELDS, agency, version)(data)
+    
+    def _build_BEG(self, data: ExtractedTransaction, agency: str, version: str) -> str:
         """Build BEG (Beginning Segment for Purchase Order) segment."""
-        data_map = {
-            1: data.transaction_purpose,  # Transaction Set Purpose Code (00=Original)
-            2: data.transaction_type_code or 'NE',  # Purchase Order Type (NE=New Order)
-            3: data.po_number,  # Purchase Order Number
-            4: None,  # Release Number
-            5: data.po_date,  # Date
-        }
-        return await self.build_segment('BEG', data_map, agency, version)
-    
-    async def _build_N1_loops_810(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+        return self._compiled_segment('BEG', _BEG_FIELDS, agency, version)(data)
+    
+    def _emit_party(self, entity_code: str, party, address, contact, agency: str, version: str,
+                    out: List[str], message_indicator: Optional[str] = None,
+                    n4_on_postal_code: bool = False) -> None:
+        """
+        Build the N1 loop for one party: N1, then N3/N4 if the address has data, then PER if a contact is given.
+        message_indicator goes in N1-06; n4_on_postal_code also emits N4 for a postal code without city/state.
+        """
+        n1_data = (entity_code, party.name, party.id_qualifier, party.identifier)
+        if message_indicator:
+            n1_data += (None, message_indicator)
+        out.append(self.build_segment('N1', n1_data, agency, version))
+        
+        if address:
+            if address.street_line_1 or address.street_line_2:
+                out.append(self.build_segment('N3', (address.street_line_1, address.street_line_2),
+                                              agency, version))
+            if address.city or address.state or (n4_on_postal_code and address.postal_code):
+                out.append(self.build_segment('N4', (address.city, address.state, address.postal_code,
+                                                     address.country_code), agency, version))
+        
+        if contact:
+            out.append(self._build_PER_segment(contact, agency, version))
+    
+    def _build_N1_loops_810(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build N1 loops for 810 invoices - data-driven based on what parties exist."""
-        segments = []
-        
         # Map contacts by function code
-        contact_map = {}
-        for contact in data.contacts:
-            contact_map[contact.function_code] = contact
+        contact_map = {contact.function_code: contact for contact in data.contacts}
         
         # Determine party structure based on what exists
         # Pattern 1: BT + II (DoD style) - bill_to and issuer exist
         # Pattern 2: RE + BT + ST (commercial style) - remit_to, bill_to, ship_to exist
         
+        # BT - Bill-to party with TO message indicator if no addresses (DoD pattern), BD contact
         if data.bill_to:
-            # BT - Bill-to party with TO message indicator if no addresses
-            n1_data = {
-                1: 'BT',
-                2: data.bill_to.name,
-                3: data.bill_to.id_qualifier,
-                4: data.bill_to.identifier,
-            }
-            # Add TO indicator if no address data (DoD pattern)
-            if not data.bill_to_address:
-                n1_data[6] = 'TO'
-            segments.append(await self.build_segment('N1', n1_data, agency, version))
-            
-            # Address if present
-            if data.bill_to_address:
-                if data.bill_to_address.street_line_1 or data.bill_to_address.street_line_2:
-                    segments.append(await self.build_segment('N3', {
-                        1: data.bill_to_address.street_line_1,
-                        2: data.bill_to_address.street_line_2,
-                    }, agency, version))
-                if data.bill_to_address.city or data.bill_to_address.state:
-                    segments.append(await self.build_segment('N4', {
-                        1: data.bill_to_address.city,
-                        2: data.bill_to_address.state,
-                        3: data.bill_to_address.postal_code,
-                        4: data.bill_to_address.country_code,
-                    }, agency, version))
-            
-            # Contact for BT (BD function code)
-            if 'BD' in contact_map:
-                segments.append(await self._build_PER_segment(contact_map['BD'], agency, version))
+            self._emit_party('BT', data.bill_to, data.bill_to_address, contact_map.get('BD'), agency, version, out,
+                             message_indicator=None if data.bill_to_address else 'TO')
         
-        # II - Issuer party (DoD pattern) with FR message indicator
         if data.issuer:
-            n1_data = {
-                1: 'II',
-                2: data.issuer.name,
-                3: data.issuer.id_qualifier,
-                4: data.issuer.identifier,
-            }
-            # Add FR indicator if no name (DoD pattern)
-            if not data.issuer.name:
-                n1_data[6] = 'FR'
-            segments.append(await self.build_segment('N1', n1_data, agency, version))
-            
-            # Second II with different qualifier (DoD pattern)
-            if data.bill_to:  # Only if BT exists
-                segments.append(await self.build_segment('N1', {
-                    1: 'II',
-                    2: None,
-                    3: '10',  # DODAAC
-                    4: None,
-                }, agency, version))
-        
-        # RE - Remit-to party (commercial pattern)
-        if data.remit_to and not data.issuer:  # Only if not using II pattern
-            n1_data = {
-                1: 'RE',
-                2: data.remit_to.name,
-                3: data.remit_to.id_qualifier,
-                4: data.remit_to.identifier,
-            }
-            segments.append(await self.build_segment('N1', n1_data, agency, version))
-            
-            # Address and contact for RE
-            if data.remit_to_address:
-                if data.remit_to_address.street_line_1 or data.remit_to_address.street_line_2:
-                    segments.append(await self.build_segment('N3', {
-                        1: data.remit_to_address.street_line_1,
-                        2: data.remit_to_address.street_line_2,
-                    }, agency, version))
-                if data.remit_to_address.city or data.remit_to_address.state:
-                    segments.append(await self.build_segment('N4', {
-                        1: data.remit_to_address.city,
-                        2: data.remit_to_address.state,
-                        3: data.remit_to_address.postal_code,
-                        4: data.remit_to_address.country_code,
-                    }, agency, version))
-            
-            if 'AP' in contact_map:
-                segments.append(await self._build_PER_segment(contact_map['AP'], agency, version))
-        
-        # ST - Ship-to party (commercial pattern)
-        if data.ship_to and not data.issuer:  # Only if not using II pattern
-            n1_data = {
-                1: 'ST',
-                2: data.ship_to.name,
-                3: data.ship_to.id_qualifier,
-                4: data.ship_to.identifier,
-            }
-            segments.append(await self.build_segment('N1', n1_data, agency, version))
+            # II - Issuer party (DoD pattern) with FR message indicator if no name
+            self._emit_party('II', data.issuer, None, None, agency, version, out,
+                             message_indicator=None if data.issuer.name else 'FR')
             
-            # Address and contact for ST
-            if data.ship_to_address:
-                if data.ship_to_address.street_line_1 or data.ship_to_address.street_line_2:
-                    segments.append(await self.build_segment('N3', {
-                        1: data.ship_to_address.street_line_1,
-                        2: data.ship_to_address.street_line_2,
-                    }, agency, version))
-                if data.ship_to_address.city or data.ship_to_address.state:
-                    segments.append(await self.build_segment('N4', {
-                        1: data.ship_to_address.city,
-                        2: data.ship_to_address.state,
-                        3: data.ship_to_address.postal_code,
-                        4: data.ship_to_address.country_code,
-                    }, agency, version))
-            
-            if 'SR' in contact_map:
-                segments.append(await self._build_PER_segment(contact_map['SR'], agency, version))
-        
-        return segments
+            # Second II with different qualifier (DoD pattern), only if BT exists
+            if data.bill_to:
+                out.append(self.build_segment('N1', ('II', None, '10'), agency, version))  # 10 = DODAAC
+        else:
+            # RE - Remit-to and ST - Ship-to parties (commercial pattern) with AP / SR contacts
+            commercial_hierarchy = [
+                ('RE', data.remit_to, data.remit_to_address, 'AP'),
+                ('ST', data.ship_to, data.ship_to_address, 'SR'),
+            ]
+            for entity_code, party, address, contact_code in commercial_hierarchy:
+                if party:
+                    self._emit_party(entity_code, party, address, contact_map.get(contact_code),
+                                     agency, version, out)
     
-    async def _build_PER_segment(self, contact, agency: str, version: str) -> str:
+    def _build_PER_segment(self, contact, agency: str, version: str) -> str:
         """Build a single PER segment from contact data."""
-        per_data = {1: contact.function_code, 2: contact.name}
-        pos = 3
-        if contact.phone:
-            per_data[pos] = 'TE'
-            per_data[pos + 1] = contact.phone
-            pos += 2
-        if contact.email:
-            per_data[pos] = 'EM'
-            per_data[pos + 1] = contact.email
-            pos += 2
-        if contact.fax:
-            per_data[pos] = 'FX'
-            per_data[pos + 1] = contact.fax
-        return await self.build_segment('PER', per_data, agency, version)
-    
-    async def _build_N1_loops_850(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+        # Communication number qualifier/value pairs fill positions 3-4, 5-6, 7-8 in order
+        per_data = [contact.function_code, contact.name]
+        for qualifier, number in (('TE', contact.phone), ('EM', contact.email), ('FX', contact.fax)):
+            if number:
+                per_data += (qualifier, number)
+        return self.build_segment('PER', per_data, agency, version)
+    
+    def _build_N1_loops_850(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build N1 loops for 850 purchase orders in standard hierarchy."""
-        segments = []
-        
         # Standard 850 N1 hierarchy: BY → SE → BT → ST → SF
         n1_hierarchy = [
             ('BY', data.buyer, data.buyer_address),
@@ -534,135 +582,83 @@ class DBDrivenEDIBuilder:
         
         for entity_code, party, address in n1_hierarchy:
             if party:
-                # N1 segment
-                n1_data = {
-                    1: entity_code,
-                    2: party.name,
-                    3: party.id_qualifier,
-                    4: party.identifier,
-                }
-                segments.append(await self.build_segment('N1', n1_data, agency, version))
-                
-                # N3 segment (address lines) if address present
-                if address and (address.street_line_1 or address.street_line_2):
-                    n3_data = {
-                        1: address.street_line_1,
-                        2: address.street_line_2,
-                    }
-                    segments.append(await self.build_segment('N3', n3_data, agency, version))
-                
-                # N4 segment (city/state/zip) if address present
-                if address and (address.city or address.state or address.postal_code):
-                    n4_data = {
-                        1: address.city,
-                        2: address.state,
-                        3: address.postal_code,
-                        4: address.country_code,
-                    }
-                    segments.append(await self.build_segment('N4', n4_data, agency, version))
-        
-        return segments
+                self._emit_party(entity_code, party, address, None, agency, version, out,
+                                 n4_on_postal_code=True)
     
-    async def _build_LM_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+    def _build_LM_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build LM/LQ loops from code_lists (skip empty code lists)."""
-        segments = []
-        
         if not data.code_lists:
-            return segments
+            return
         
         for code_list in data.code_lists:
             # Skip code lists with no codes
             if not code_list.codes:
                 continue
             
-            # LM segment
-            lm_data = {
-                1: code_list.agency_code,  # DF for DoD
-                2: code_list.source_subqualifier,
-            }
-            segments.append(await self.build_segment('LM', lm_data, agency, version))
+            # LM segment: agency code (DF for DoD), source subqualifier
+            out.append(self.build_segment('LM', (code_list.agency_code, code_list.source_subqualifier),
+                                          agency, version))
             
-            # LQ segments for each code
-            for code_pair in code_list.codes:
-                lq_data = {
-                    1: code_pair.qualifier,  # '0' for example
-                    2: code_pair.industry_code,  # 'FS2' for example
-                }
-                segments.append(await self.build_segment('LQ', lq_data, agency, version))
-        
-        return segments
+            # LQ segments for each code, e.g. qualifier '0', industry code 'FS2'
+            out.extend([
+                self.build_segment('LQ', (code_pair.qualifier, code_pair.industry_code), agency, version)
+                for code_pair in code_list.codes
+            ])
     
-    async def _build_FA_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+    def _build_FA_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build FA1/FA2 loops from financial_accounting."""
-        segments = []
-        
         if not data.financial_accounting or not data.financial_accounting.breakdown_codes:
-            return segments
+            return
         
         # FA1 segment - always emit if FA2 exists, default to DZ
-        fa1_data = {
-            1: data.financial_accounting.agency_code or 'DZ',
-        }
-        segments.append(await self.build_segment('FA1', fa1_data, agency, version))
-        
-        # FA2 segments
-        for breakdown in data.financial_accounting.breakdown_codes:
-            fa2_data = {
-                1: breakdown.breakdown_code,  # '58', '18'
-                2: breakdown.financial_code,  # '97X12345678', '2142020'
-            }
-            segments.append(await self.build_segment('FA2', fa2_data, agency, version))
+        out.append(self.build_segment('FA1', (data.financial_accounting.agency_code or 'DZ',), agency, version))
         
-        return segments
+        # FA2 segments: breakdown code ('58', '18'), financial code ('97X12345678', '2142020')
+        out.extend([
+            self.build_segment('FA2', (breakdown.breakdown_code, breakdown.financial_code), agency, version)
+            for breakdown in data.financial_accounting.breakdown_codes
+        ])
     
-    async def _build_IT1_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+    def _build_IT1_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build IT1 line item segments - data-driven based on what IDs are present."""
-        segments = []
-        
+        build_segment = self.build_segment
         for item in data.items:
-            it1_data = {
-                1: item.line_number,
-                2: item.quantity,
-                3: item.unit_of_measure,
-                4: item.unit_price,
-                5: 'ST' if item.nsn and not item.buyer_part_number else None,  # Basis only if NSN primary
-            }
+            # Each ID field is read once; the patterns below test them several times
+            nsn, buyer_part_number = item.nsn, item.buyer_part_number
+            nsn_primary = bool(nsn) and not buyer_part_number
+            it1_data = [
+                item.line_number,
+                item.quantity,
+                item.unit_of_measure,
+                item.unit_price,
+                'ST' if nsn_primary else None,  # Basis only if NSN primary
+            ]
             
             # Pattern 1: NSN exists and is primary (DoD pattern) - use FS qualifier
-            if item.nsn and not item.buyer_part_number:
-                # Remove dashes from NSN for FS qualifier
-                nsn_clean = item.nsn.replace('-', '')
-                it1_data[6] = 'FS'  # Federal Supply
-                it1_data[7] = nsn_clean
+            if nsn_primary:
+                it1_data += ('FS', item.nsn_flat)  # Federal Supply, NSN without dashes
             
             # Pattern 2: Buyer part exists (commercial pattern) - BP primary, VP/N4 secondary
-            elif item.buyer_part_number:
-                it1_data[6] = 'BP'
-                it1_data[7] = item.buyer_part_number
+            elif buyer_part_number:
+                it1_data += ('BP', buyer_part_number)
                 
-                # Add vendor part if present
-                if item.vendor_part_number:
-                    it1_data[8] = 'VP'
-                    it1_data[9] = item.vendor_part_number
+                # Add vendor part if present (positions 8-9 stay empty otherwise)
+                vendor_part_number = item.vendor_part_number
+                it1_data += ('VP', vendor_part_number) if vendor_part_number else (None, None)
                 
                 # Add NSN/NDC if present (with dashes)
-                if item.nsn:
-                    it1_data[10] = 'N4'
-                    it1_data[11] = item.nsn
+                if nsn:
+                    it1_data += ('N4', nsn)
             
             # Pattern 3: Only item_id exists
             elif item.item_id:
-                it1_data[6] = 'FS'
-                it1_data[7] = item.item_id
+                it1_data += ('FS', item.item_id)
             
-            segments.append(await self.build_segment('IT1', it1_data, agency, version))
-        
-        return segments
+            out.append(build_segment('IT1', it1_data, agency, version))
     
-    async def _build_PO1_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+    def _build_PO1_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build PO1 line item segments for purchase orders."""
-        segments = []
-
+        build_segment = self.build_segment
         for item in data.items:
             # For CANCELLED items, set quantity to 0
             quantity = 0 if item.status == 'CANCELLED' else item.quantity
@@ -671,266 +667,212 @@ class DBDrivenEDIBuilder:
             id_qualifier = item.product_id_qualifier or 'BP'  # BP = Buyer's Part Number
             product_id = item.nsn or item.item_id
 
-            po1_data = {
-                1: item.line_number,
-                2: quantity,
-                3: item.unit_of_measure,
-                4: item.unit_price,
-                5: None,  # Basis of Unit Price Code
-                6: id_qualifier,  # Product ID Qualifier
-                7: product_id,  # Product ID
-            }
-            segments.append(await self.build_segment('PO1', po1_data, agency, version))
+            po1_data = (
+                item.line_number,
+                quantity,
+                item.unit_of_measure,
+                item.unit_price,
+                None,  # Basis of Unit Price Code
+                id_qualifier,  # Product ID Qualifier
+                product_id,  # Product ID
+            )
+            out.append(build_segment('PO1', po1_data, agency, version))
 
             # Add PID segment for description if present
-            if item.item_description:
-                pid_data = {
-                    1: 'F',  # Item Description Type (F=Free-form)
-                    2: None,  # Product/Process Characteristic Code
-                    3: None,  # Agency Qualifier Code
-                    4: None,  # Product Description Code
-                    5: item.item_description,  # Description
-                }
-                segments.append(await self.build_segment('PID', pid_data, agency, version))
+            item_description = item.item_description
+            if item_description:
+                pid_data = (
+                    'F',  # Item Description Type (F=Free-form)
+                    None,  # Product/Process Characteristic Code
+                    None,  # Agency Qualifier Code
+                    None,  # Product Description Code
+                    item_description,  # Description
+                )
+                out.append(build_segment('PID', pid_data, agency, version))
 
             # Add PO4 segment for pack size if present
-            if item.pack_size:
-                po4_data = {
-                    1: item.pack_size,  # Pack size
-                }
-                segments.append(await self.build_segment('PO4', po4_data, agency, version))
+            pack_size = item.pack_size
+            if pack_size:
+                out.append(build_segment('PO4', (pack_size,), agency, version))
 
             # Add AMT segment for line amount if present
-            if item.extended_amount:
-                amt_data = {
-                    1: '1',  # 1 = Line Item Total
-                    2: item.extended_amount,
-                }
-                segments.append(await self.build_segment('AMT', amt_data, agency, version))
-
-        return segments
+            extended_amount = item.extended_amount
+            if extended_amount:
+                # 1 = Line Item Total
+                out.append(build_segment('AMT', ('1', extended_amount), agency, version))
     
-    async def _build_REF_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+    def _build_REF_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build REF reference segments for all reference types."""
-        segments = []
-        
-        for ref in data.references:
-            ref_data = {
-                1: ref.qualifier,  # PO, CN, TN, etc.
-                2: ref.identifier,
-                # Note: position 3 (description) is omitted per X12 spec
-            }
-            segments.append(await self.build_segment('REF', ref_data, agency, version))
-        
-        return segments
+        build_segment = self.build_segment
+        out.extend([
+            # qualifier: PO, CN, TN, etc.; position 3 (description) is omitted per X12 spec
+            build_segment('REF', (ref.qualifier, ref.identifier), agency, version)
+            for ref in data.references
+        ])
     
-    async def _build_REF_carrier(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_REF_carrier(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build REF segment for carrier tracking number from references list."""
         # Look for CN qualifier in references list
         for ref in data.references:
             if ref.qualifier == 'CN':
-                ref_data = {
-                    1: 'CN',  # Carrier's Reference Number (Tracking)
-                    2: ref.identifier,
-                    3: ref.description,
-                }
-                return await self.build_segment('REF', ref_data, agency, version)
+                # CN = Carrier's Reference Number (Tracking)
+                return self.build_segment('REF', ('CN', ref.identifier, ref.description), agency, version)
         return None
     
-    async def _build_ITD(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_ITD(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build ITD (Terms of Sale/Deferred Terms of Sale) segment."""
         if not data.payment_terms:
             return None
         
         terms = data.payment_terms
-        itd_data = {
-            1: terms.terms_type or '01',  # 01=Basic, 05=Discount Not Applicable
-            2: '3' if terms.discount_percent else None,  # 3=Invoice Date
-            3: terms.discount_percent,  # Discount %
-            4: terms.discount_due_days,  # Days from invoice date for discount
-            5: None,  # Discount Due Date (YYYYMMDD)
-            6: terms.net_due_days,  # Net Days
-            7: terms.due_date,  # Net Due Date (YYYYMMDD)
-        }
-        return await self.build_segment('ITD', itd_data, agency, version)
-    
-    async def _build_TD5(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+        itd_data = (
+            terms.terms_type or '01',  # 01=Basic, 05=Discount Not Applicable
+            '3' if terms.discount_percent else None,  # 3=Invoice Date
+            terms.discount_percent,  # Discount %
+            terms.discount_due_days,  # Days from invoice date for discount
+            None,  # Discount Due Date (YYYYMMDD)
+            terms.net_due_days,  # Net Days
+            terms.due_date,  # Net Due Date (YYYYMMDD)
+        )
+        return self.build_segment('ITD', itd_data, agency, version)
+    
+    def _build_TD5(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build TD5 (Carrier Details - Routing Sequence) segment."""
         if not data.carrier_info:
             return None
         
         carrier = data.carrier_info
-        td5_data = {
-            1: carrier.routing_sequence or 'O',  # O=Origin (Shippers' Routing)
-            2: carrier.id_qualifier or '2',  # 2=SCAC (Standard Carrier Alpha Code)
-            3: carrier.id_code,  # FDXG for FedEx Ground
-            4: carrier.transport_method or 'M',  # M=Motor (Common Carrier)
-            5: carrier.routing,  # "Federal Express Ground"
-        }
-        return await self.build_segment('TD5', td5_data, agency, version)
-    
-    async def _build_DTM_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+        td5_data = (
+            carrier.routing_sequence or 'O',  # O=Origin (Shippers' Routing)
+            carrier.id_qualifier or '2',  # 2=SCAC (Standard Carrier Alpha Code)
+            carrier.id_code,  # FDXG for FedEx Ground
+            carrier.transport_method or 'M',  # M=Motor (Common Carrier)
+            carrier.routing,  # "Federal Express Ground"
+        )
+        return self.build_segment('TD5', td5_data, agency, version)
+    
+    def _build_DTM_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build DTM date segments for all dates."""
-        segments = []
-        
-        for dt in data.dates:
-            dtm_data = {
-                1: dt.qualifier,
-                2: dt.date_value,
-                3: dt.time_value,
-            }
-            segments.append(await self.build_segment('DTM', dtm_data, agency, version))
-        
-        return segments
+        build_segment = self.build_segment
+        out.extend([
+            build_segment('DTM', (dt.qualifier, dt.date_value, dt.time_value), agency, version)
+            for dt in data.dates
+        ])
     
-    async def _build_CAD(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_CAD(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build CAD (Carrier Detail) segment - minimal carrier info (routing only)."""
         if not data.carrier_detail:
             return None
         
-        cad_data = {
-            # For DoD CAD, only send routing in position 5
-            # Positions 1-4 left empty per spec
-            5: data.carrier_detail.routing,
-        }
-        return await self.build_segment('CAD', cad_data, agency, version)
+        # For DoD CAD, only send routing in position 5
+        # Positions 1-4 left empty per spec
+        cad_data = (None, None, None, None, data.carrier_detail.routing)
+        return self.build_segment('CAD', cad_data, agency, version)
     
-    async def _build_SAC_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+    def _build_SAC_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build SAC service charge segments."""
-        segments = []
-        
-        for charge in data.service_charges:
-            # Convert amount to cents (remove decimal)
-            amount_cents = str(int(charge.amount * 100)) if charge.amount else None
-            
-            sac_data = {
-                1: charge.indicator,  # C or A
-                2: charge.code,  # D350
-                3: charge.agency_qualifier,
-                4: charge.agency_code,
-                5: amount_cents,
-            }
-            segments.append(await self.build_segment('SAC', sac_data, agency, version))
-        
-        return segments
+        build_segment = self.build_segment
+        out.extend([
+            build_segment('SAC', (
+                charge.indicator,  # C or A
+                charge.code,  # D350
+                charge.agency_qualifier,
+                charge.agency_code,
+                _to_cents(charge.amount) if charge.amount else None,
+            ), agency, version)
+            for charge in data.service_charges
+        ])
     
-    async def _build_LM_loops_2(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+    def _build_LM_loops_2(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build second LM/LQ block (appears after SAC in boss's output)."""
-        segments = []
-        
         if not data.code_lists_post_sac:
-            return segments
+            return
         
         for code_list in data.code_lists_post_sac:            # Skip if no codes present
             if not code_list.codes:
                 continue
                         # LM segment
-            lm_data = {
-                1: code_list.agency_code,  # DF for DoD
-                2: code_list.source_subqualifier,
-            }
-            segments.append(await self.build_segment('LM', lm_data, agency, version))
+            lm_data = (
+                code_list.agency_code,  # DF for DoD
+                code_list.source_subqualifier,
+            )
+            out.append(self.build_segment('LM', lm_data, agency, version))
             
-            # LQ segments for each code
-            for code_pair in code_list.codes:
-                lq_data = {
-                    1: code_pair.qualifier,  # '0', 'DE', 'DG', 'A9'
-                    2: code_pair.industry_code,  # 'FA2', 'J', '7G', 'WQQQQQ'
-                }
-                segments.append(await self.build_segment('LQ', lq_data, agency, version))
-        
-        return segments
+            # LQ segments for each code: qualifier '0', 'DE', 'DG', 'A9'; industry code 'FA2', 'J', '7G', 'WQQQQQ'
+            out.extend([
+                self.build_segment('LQ', (code_pair.qualifier, code_pair.industry_code), agency, version)
+                for code_pair in code_list.codes
+            ])
     
-    async def _build_TDS(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_TDS(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build TDS (Total Monetary Value Summary) segment for final total."""
         if not data.total_amount:
             return None
         
-        # Convert to cents
-        amount_cents = str(int(data.total_amount * 100))
-        
-        data_map = {
-            1: amount_cents,
-        }
-        return await self.build_segment('TDS', data_map, agency, version)
+        return self.build_segment('TDS', (_to_cents(data.total_amount),), agency, version)
     
-    async def _build_TDS_subtotal(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_TDS_subtotal(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build TDS segment for subtotal (before service charges)."""
         if not data.subtotal_amount:
             return None
         
-        # Convert to cents
-        amount_cents = str(int(data.subtotal_amount * 100))
-        
-        data_map = {
-            1: amount_cents,
-        }
-        return await self.build_segment('TDS', data_map, agency, version)
+        return self.build_segment('TDS', (_to_cents(data.subtotal_amount),), agency, version)
     
-    async def _build_CTT(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_CTT(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build CTT (Transaction Totals) segment."""
         if not data.number_of_line_items:
             return None
 
-        data_map = {
-            1: data.number_of_line_items,
-        }
-        return await self.build_segment('CTT', data_map, agency, version)
+        return self.build_segment('CTT', (data.number_of_line_items,), agency, version)
 
-    async def _build_AMT_total(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_AMT_total(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build AMT (Monetary Amount) segment for total order value."""
         if not data.total_amount:
             return None
 
-        data_map = {
-            1: 'GV',  # GV = Gross Invoice Amount
-            2: data.total_amount,
-        }
-        return await self.build_segment('AMT', data_map, agency, version)
+        data_map = (
+            'GV',  # GV = Gross Invoice Amount
+            data.total_amount,
+        )
+        return self.build_segment('AMT', data_map, agency, version)
 
-    async def _build_CUR(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_CUR(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build CUR (Currency) segment."""
         # Default to USD if not specified
         currency = data.currency or 'USD'
 
-        data_map = {
-            1: 'BY',  # BY = Buying Party (Buyer's Currency)
-            2: currency,
-        }
-        return await self.build_segment('CUR', data_map, agency, version)
+        data_map = (
+            'BY',  # BY = Buying Party (Buyer's Currency)
+            currency,
+        )
+        return self.build_segment('CUR', data_map, agency, version)
 
-    async def _build_FOB(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
+    def _build_FOB(self, data: ExtractedTransaction, agency: str, version: str) -> Optional[str]:
         """Build FOB (Free on Board) shipping terms segment."""
         if not data.fob_terms:
             return None
 
         fob = data.fob_terms
-        data_map = {
-            1: fob.shipment_method,  # CC=Collect, PP=Prepaid
-            2: fob.location_qualifier,  # OR=Origin, DE=Destination
-            3: fob.description,  # Description
-            4: fob.transportation_terms,  # Transportation terms code
-        }
-        return await self.build_segment('FOB', data_map, agency, version)
-
-    async def _build_N9_MTX_loops(self, data: ExtractedTransaction, agency: str, version: str) -> List[str]:
+        data_map = (
+            fob.shipment_method,  # CC=Collect, PP=Prepaid
+            fob.location_qualifier,  # OR=Origin, DE=Destination
+            fob.description,  # Description
+            fob.transportation_terms,  # Transportation terms code
+        )
+        return self.build_segment('FOB', data_map, agency, version)
+
+    def _build_N9_MTX_loops(self, data: ExtractedTransaction, agency: str, version: str, out: List[str]) -> None:
         """Build N9/MTX loops for special instructions and notes."""
-        segments = []
-
         for instruction in data.special_instructions:
             # N9 segment
-            n9_data = {
-                1: instruction.reference_qualifier or 'L1',  # L1=Letters or Notes
-                2: instruction.reference_id,
-            }
-            segments.append(await self.build_segment('N9', n9_data, agency, version))
-
-            # MTX segments for each message line
-            for message in instruction.messages:
-                mtx_data = {
-                    1: None,  # Message text type (optional)
-                    2: message,  # Message text
-                }
-                segments.append(await self.build_segment('MTX', mtx_data, agency, version))
+            n9_data = (
+                instruction.reference_qualifier or 'L1',  # L1=Letters or Notes
+                instruction.reference_id,
+            )
+            out.append(self.build_segment('N9', n9_data, agency, version))
 
-        return segments
+            # MTX segments for each message line (position 1, message text type, is optional and left empty)
+            out.extend([
+                self.build_segment('MTX', (None, message), agency, version)
+                for message in instruction.messages
+            ])
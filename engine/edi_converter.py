@@ -1,21 +1,70 @@
-from typing import List, Dict, Tuple, Any
+from typing import List, Dict, Tuple, Any, Optional, Sequence
 import json
 import asyncio
 import requests
 import os
-from tqdm import tqdm
-from engine.chains import EntityExtractionResult, ExtractedEntity, chain_entities_extraction,\
-    chain_edi_expression, chain_relevant_text, RelevantTextResult, EDIExpressionOutputParser,\
-    chain_structured_extraction
+import sys
+from tqdm.asyncio import tqdm_asyncio
+from engine.chains import EntityExtractionResult, ExtractedEntity, get_chain_entities_extraction,\
+    get_chain_edi_expression, get_chain_relevant_text, RelevantTextResult, EDIExpressionOutputParser,\
+    get_chain_structured_extraction, cached_invoke, get_chain_entities_extraction_batch
 from engine.edi_builder import EDIBuilder
 from engine.edi_builder_v2 import DBDrivenEDIBuilder
-from utils.utils import get_entities_for_segment, get_segments_usage, get_segment_description
-from utils.constants import DATABASE_URL, CHROMA_QUERY, AGENCY_MAP, TOKENS_LIMIT
+from engine.prefilter import prefilter_relevance
+from utils.utils import (get_entities_for_segment, get_segments_usage, get_segment_description, prefetch_segment_metadata,
+                         gather_bounded)
+from utils.constants import (DATABASE_URL, CHROMA_QUERY, AGENCY_MAP, TOKENS_LIMIT, CHROMA_MAX_CONCURRENCY,
+                             LLM_MAX_CONCURRENCY, DB_POOL_MAX_SIZE, DB_POOL_MAX_OVERFLOW, DB_POOL_RECYCLE)
 from utils.schemas import ExtractedTransaction, ExtractionResponse
-from chroma.chromadb_service import ChromaDBService
+from chroma.chromadb_service import ChromaDBService, document_filter
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy import text
 import tiktoken
+import numpy as np
+
+# Built once and bound per call, so SQLAlchemy compiles each statement a single time
+_Q_EDI_INFO = text('SELECT * FROM mercury."edi_info" where interchange_sender = :interchange_sender and edi_info_id = :edi_info_id')
+# Only the columns the conversions read: agency type, version, transaction set and the raw text
+_Q_EDI_INFO_WITH_RAW_DATA = text(
+    'SELECT e.type, e.standard_version, e.transaction_name, r.raw_data FROM mercury."edi_info" e '
+    'LEFT JOIN mercury."raw_processed_data" r ON r.doc_id = e.edi_info_id || \'_NL\' '
+    'WHERE e.interchange_sender = :interchange_sender AND e.edi_info_id = :edi_info_id'
+)
+# Callers only read raw_data
+_Q_RAW_DATA = text('SELECT raw_data FROM mercury."raw_processed_data" where doc_id = :doc_id')
+
+
+def _validate_810(data: ExtractedTransaction) -> List[str]:
+    """Invoice mandatory fields for _validate_extraction."""
+    errors = []
+    if not data.invoice_number:
+        errors.append("ERROR: Missing mandatory invoice number")
+    if not data.invoice_date:
+        errors.append("ERROR: Missing mandatory invoice date")
+    return errors
+
+
+def _validate_850(data: ExtractedTransaction) -> List[str]:
+    """Purchase order mandatory fields for _validate_extraction."""
+    errors = []
+    if not data.po_number:
+        errors.append("ERROR: Missing mandatory PO number")
+    if not data.po_date:
+        errors.append("WARNING: Missing PO date (recommended)")
+    return errors
+
+
+# transaction_type -> validator returning its mandatory-field errors; other types have none
+_TRANSACTION_VALIDATORS = {
+    "810": _validate_810,
+    "850": _validate_850,
+}
+
+# transaction_type -> (party attribute the type requires, warning when it is missing)
+_TRANSACTION_PARTIES = {
+    "810": ("bill_to", "WARNING: Missing bill-to information (BT party)"),
+    "850": ("buyer", "WARNING: Missing buyer information (BY party)"),
+}
 
 
 class EDIConverter:
@@ -27,148 +76,232 @@ class EDIConverter:
         self.engine = create_async_engine(
             DATABASE_URL,
             echo=False,
-            pool_pre_ping=True,
-            pool_recycle=3600,
-            pool_size=5,
-            max_overflow=10
+            pool_pre_ping=False,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_size=DB_POOL_MAX_SIZE,
+            max_overflow=DB_POOL_MAX_OVERFLOW
         )
+        # Same pool in autocommit mode for plain SELECTs, so lookups skip BEGIN/COMMIT round trips
+        self.read_engine = self.engine.execution_options(isolation_level="AUTOCOMMIT")
+        # (agency, version, transaction_type) -> metadata summary for the structured extraction prompt
+        self.metadata_summary_cache = {}
+        # BPE tables are built once here instead of on every tokens_count call
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+        # Segments are prepared concurrently; this caps the Chroma retrievals they issue at once
+        self.chroma_semaphore = asyncio.Semaphore(CHROMA_MAX_CONCURRENCY)
+        # Same for per-segment LLM calls (relevance, entity extraction, EDI expressions)
+        self.llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        # DB-driven builder shared by all v2 conversions; its pool is opened on first use
+        self._builder: Optional[DBDrivenEDIBuilder] = None
+        self._builder_lock = asyncio.Lock()
+
+    async def close(self):
+        """
+        Release pooled HTTP and database connections.
+        """
+        await self.chroma_service.close()
+        await self.engine.dispose()
+        if self._builder:
+            await self._builder.dispose()
+            self._builder = None
+
+    async def _get_builder(self, agency: str, version: str) -> DBDrivenEDIBuilder:
+        """
+        Shared builder with the agency/version schema loaded. The lock keeps concurrent
+        first requests from each opening a pool.
+        """
+        if self._builder is None:
+            async with self._builder_lock:
+                if self._builder is None:
+                    builder = DBDrivenEDIBuilder()
+                    await builder.initialize()
+                    self._builder = builder
+        await self._builder.preload(agency, version)
+        return self._builder
+
+    async def get_metadata_summary(self, agency: str, version: str, transaction_type: str) -> str:
+        """
+        Summary of the transaction's segment metadata, computed once per transaction type.
+        """
+        cache_key = (agency, version, transaction_type)
+        if cache_key not in self.metadata_summary_cache:
+            edi_segments = await get_segments_usage(agency, version, transaction_type)
+            self.metadata_summary_cache[cache_key] = f"Transaction {transaction_type} version {version} with {len(edi_segments)} segments"
+        return self.metadata_summary_cache[cache_key]
 
     def tokens_count(self, text: str):
-        encoding = tiktoken.get_encoding("cl100k_base")
-        tokens = encoding.encode(text)
-        return len(tokens)
+        return len(self.encoding.encode(text))
 
     async def query_edi_info_data(self, interchange_sender: str, edi_info_id: str):
-            async with self.engine.begin() as conn:
-                # Example: Select from mercury.your_table_name
-                result = await conn.execute(
-                    text('SELECT * FROM mercury."edi_info" where interchange_sender = :interchange_sender and edi_info_id = :edi_info_id'),
-                    {"interchange_sender": interchange_sender, "edi_info_id": edi_info_id}
-                )
-                row = result.fetchone()
-                data = {}
-                if row:
-                    for col, val in row._mapping.items():
-                        data[col] = val
-            return data
+        # The row is buffered, so the connection goes back to the pool before it is converted
+        async with self.read_engine.connect() as conn:
+            result = await conn.execute(
+                _Q_EDI_INFO, {"interchange_sender": interchange_sender, "edi_info_id": edi_info_id}
+            )
+            row = result.fetchone()
+        return dict(row._mapping) if row else {}
+
+    async def query_edi_info_with_raw_data(self, interchange_sender: str, edi_info_id: str):
+        """
+        edi_info's type, standard_version and transaction_name plus its natural-language raw text
+        ('raw_data') in one round trip; query_edi_info_data returns the full row.
+        Returns {} if the edi_info row does not exist; 'raw_data' is None if the text is missing.
+        """
+        async with self.read_engine.connect() as conn:
+            result = await conn.execute(
+                _Q_EDI_INFO_WITH_RAW_DATA, {"interchange_sender": interchange_sender, "edi_info_id": edi_info_id}
+            )
+            row = result.fetchone()
+        return dict(row._mapping) if row else {}
 
     async def query_raw_data(self, edi_info_id: str):
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(f'SELECT * FROM mercury."raw_processed_data" where doc_id = :edi_info_id'),{"edi_info_id": edi_info_id+"_NL"})
+        async with self.read_engine.connect() as conn:
+            result = await conn.execute(_Q_RAW_DATA, {"doc_id": f"{edi_info_id}_NL"})
             row = result.fetchone()
-            data = {}
-            if row:
-                for col, val in row._mapping.items():
-                    data[col] = val
-        return data
+        return dict(row._mapping) if row else {}
 
     async def query_raw_edi_data(self, edi_info_id: str):
-        async with self.engine.begin() as conn:
-            result = await conn.execute(text(f'SELECT * FROM mercury."raw_processed_data" where doc_id = :edi_info_id'),{"edi_info_id": edi_info_id+"_EDI"})
+        async with self.read_engine.connect() as conn:
+            result = await conn.execute(_Q_RAW_DATA, {"doc_id": f"{edi_info_id}_EDI"})
             row = result.fetchone()
-            data = {}
-            if row:
-                for col, val in row._mapping.items():
-                    data[col] = val
-        return data
+        return dict(row._mapping) if row else {}
     
     async def convert_text_to_edi(self, interchange_sender: str, edi_info_id: str) -> Tuple[List[str], List[List[Dict[str, str]]]]:
         """
         Convert text to EDI format.
         """
-        # get edi info id data from database
-        edi_info_data = await self.query_edi_info_data(interchange_sender, edi_info_id)
+        # get edi info id data and raw text from database
+        edi_info_data = await self.query_edi_info_with_raw_data(interchange_sender, edi_info_id)
         if not edi_info_data:
             raise ValueError(f"EDI info data not found for interchange sender {interchange_sender} and edi info id {edi_info_id}")
         edi_info_agency = edi_info_data['type']
         version = edi_info_data['standard_version']
         transactionid = edi_info_data['transaction_name']
-        agency = 'X'
-        if edi_info_agency in AGENCY_MAP:
-            agency = AGENCY_MAP[edi_info_agency]
-        raw_text = await self.query_raw_data(edi_info_id)
-        raw_text = raw_text['raw_data']
+        agency = AGENCY_MAP.get(edi_info_agency, 'X')
+        raw_text = edi_info_data['raw_data']
         edi_segments = await get_segments_usage(agency, version, transactionid)
         try:
             edi_segments = self.deduplicate_segments(edi_segments)
         except Exception as e:
             print(f"Error deduplicating segments: {e}")
         
-        edi_expressions = []
-        edi_entities_per_segment = []
-        for edi_segment in tqdm(edi_segments):
-            segment_id = edi_segment['segmentid']
-            segment_description = await get_segment_description(segment_id, agency, version)
-            segment_entities = await get_entities_for_segment(segment_id, agency, version)
-            segment_entities_str = '\n'.join([f"{entity['entity']}: {entity['required'].replace('M', 'Mandatory').replace('O', 'Optional')}" for entity in segment_entities])
-
-            # check if any entity has type 'ID'
-            if any(entity['type'] == 'ID' for entity in segment_entities):
-                print(f"Segment {segment_id} has ID type entities")
-            
-            chroma_query = CHROMA_QUERY.format(
-                segment_id=segment_id,
-                segment_description=segment_description[0]['description'],
-                entities=segment_entities_str
-            )
-            metadata_filter = {
-                "$and": [
-                    {"interchange_sender": interchange_sender},
-                    {"edi_info_id": edi_info_id}
-                ]
-            }
-
-            relevant_text = raw_text
-            if self.tokens_count(raw_text) > TOKENS_LIMIT:
-                print("Raw text is too long, using chroma to get relevant text...")
-                relevant_text = raw_text
-                relevant_chunks = await self.chroma_service.get_relevant_chunks(
-                    collection_name=self.collection_name,
-                    query=chroma_query,
-                    metadata_filter=metadata_filter,
-                    n_results=5,
-                )
-                relevant_text = '\n'.join(relevant_chunks)
-
-            is_segment_relevant = await self.is_segment_relevant(segment_id, segment_description[0]['description'], relevant_text, segment_entities_str)
-            if not is_segment_relevant.relevant:
-                print(f"Segment {segment_id} is not relevant, skipping...")
-                continue
+        segment_ids = [edi_segment['segmentid'] for edi_segment in edi_segments]
+        # Descriptions and entities for every segment in two queries instead of two per segment
+        await prefetch_segment_metadata(segment_ids, agency, version)
+        
+        # The raw text is the same for every segment, so it is tokenized once
+        use_chroma = self.tokens_count(raw_text) > TOKENS_LIMIT
+        if use_chroma:
+            print("Raw text is too long, using chroma to get relevant text...")
+        
+        # Memory hits after the prefetch; bounded so cache misses cannot drain the connection pool
+        segments_metadata = await gather_bounded(
+            self._segment_metadata(segment_id, agency, version) for segment_id in segment_ids
+        )
+        if use_chroma:
+            # Only the most relevant chunks are analyzed, retrieved for all segments in one request
+            relevant_texts = await self._relevant_texts(segment_ids, segments_metadata, interchange_sender, edi_info_id)
+        else:
+            relevant_texts = [raw_text] * len(segment_ids)
+
+        # Relevance checks are independent per segment, so run them concurrently.
+        # The progress bar is only drawn on an interactive terminal, not in server logs.
+        gather = tqdm_asyncio.gather if sys.stderr.isatty() else asyncio.gather
+        prepared_segments = await gather(*[
+            self._prepare_segment(segment_id, segment_metadata, relevant_text)
+            for segment_id, segment_metadata, relevant_text in zip(segment_ids, segments_metadata, relevant_texts)
+        ])
+        relevant_segments = [segment for segment in prepared_segments if segment is not None]
 
-            extracted_entities = self.extract_entities(relevant_text, segment_entities)
+        # One LLM call per distinct text instead of one per segment
+        extracted_per_segment = await self.extract_entities_batch(relevant_segments, edi_info_id)
+
+        complete_segments = []
+        incomplete_segment_ids = []
+        for relevant_segment in relevant_segments:
+            segment_id = relevant_segment['segment_id']
+            extracted_entities = extracted_per_segment[segment_id]
             # Check if all mandatory entities are extracted
             if not all(entity.found for entity in extracted_entities.extracted_entities if entity.required == 'M'):
-                print(f"Segment {segment_id} has missing mandatory entities, skipping...")
+                incomplete_segment_ids.append(segment_id)
                 continue
+            complete_segments.append((segment_id, [item.model_dump() for item in extracted_entities.extracted_entities]))
+        
+        # One summary line instead of a print per skipped segment
+        irrelevant_segment_ids = [segment_id for segment_id, prepared in zip(segment_ids, prepared_segments)
+                                  if prepared is None]
+        print(f"Segments: {len(edi_segments)} total, {len(complete_segments)} complete; "
+              f"not relevant: {irrelevant_segment_ids}; missing mandatory entities: {incomplete_segment_ids}")
 
-            extracted_entities = [item.model_dump() for item in extracted_entities.extracted_entities]
-            edi_expression = self.generate_edi_expression(segment_id, extracted_entities, version)
-            edi_expressions.append(edi_expression)
-            edi_entities_per_segment.append({segment_id: extracted_entities})
+        edi_expressions = await asyncio.gather(*[
+            self.generate_edi_expression(segment_id, extracted_entities, version)
+            for segment_id, extracted_entities in complete_segments
+        ])
+        edi_entities_per_segment = [{segment_id: extracted_entities} for segment_id, extracted_entities in complete_segments]
 
         return edi_expressions, edi_entities_per_segment
 
+    async def _segment_metadata(self, segment_id: str, agency: str, version: str) -> Tuple[str, List[Dict[str, str]], str]:
+        """
+        Description, entities and the entities rendered for prompts of one segment.
+        """
+        segment_description = await get_segment_description(segment_id, agency, version)
+        segment_entities = await get_entities_for_segment(segment_id, agency, version)
+        segment_entities_str = '\n'.join([f"{entity['entity']}: {entity['required'].replace('M', 'Mandatory').replace('O', 'Optional')}" for entity in segment_entities])
+        return segment_description[0]['description'], segment_entities, segment_entities_str
+
+    async def _relevant_texts(self, segment_ids: List[str], segments_metadata: List[Tuple[str, List[Dict[str, str]], str]],
+                              interchange_sender: str, edi_info_id: str) -> List[str]:
+        """
+        Most relevant chunks of the raw text for every segment, retrieved from Chroma in one batched query.
+        """
+        chroma_queries = [
+            CHROMA_QUERY.format(segment_id=segment_id, segment_description=description, entities=segment_entities_str)
+            for segment_id, (description, _, segment_entities_str) in zip(segment_ids, segments_metadata)
+        ]
+        async with self.chroma_semaphore:
+            relevant_chunks = await self.chroma_service.get_relevant_chunks_batch(
+                collection_name=self.collection_name,
+                queries=chroma_queries,
+                metadata_filter=document_filter(interchange_sender, edi_info_id),
+                n_results=5,
+            )
+        return ['\n'.join(chunks) for chunks in relevant_chunks]
+
+    async def _prepare_segment(self, segment_id: str, segment_metadata: Tuple[str, List[Dict[str, str]], str],
+                               relevant_text: str) -> Optional[Dict[str, Any]]:
+        """
+        Check whether the segment is relevant to its text (the raw text, or its most relevant chunks).
+        Returns {'segment_id', 'text', 'entities'} or None if the segment is not relevant.
+        """
+        description, segment_entities, segment_entities_str = segment_metadata
+        is_segment_relevant = await self.is_segment_relevant(segment_id, description, relevant_text, segment_entities_str,
+                                                             [entity['entity'] for entity in segment_entities])
+        if not is_segment_relevant.relevant:
+            return None
+
+        return {'segment_id': segment_id, 'text': relevant_text, 'entities': segment_entities}
+
     def deduplicate_segments(self, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
         Deduplicate segments while maintaining the order.
         """
-        # order by position
+        # order by position (the key is computed once per segment, not per comparison)
         segments.sort(key=lambda x: int(x['position']))
-        seen = set()
-        deduplicated_segments = []
+        # dicts keep insertion order; setdefault keeps the first occurrence of each segment id
+        first_by_id = {}
         for segment in segments:
-            if segment['segmentid'] not in seen:
-                seen.add(segment['segmentid'])
-                deduplicated_segments.append(segment)
-        return deduplicated_segments
+            first_by_id.setdefault(segment['segmentid'], segment)
+        return list(first_by_id.values())
 
-    def extract_entities(self, text: str, entities: List[Dict[str, str]]) -> EntityExtractionResult:
+    async def extract_entities(self, text: str, entities: List[Dict[str, str]], namespace: str = "default") -> EntityExtractionResult:
         """
         Extract entities from text using the LLM chain.
         
         Args:
             text: The text to analyze
             entities: List of entities to extract with their required status
+            namespace: Semantic cache namespace (e.g. "<edi_info_id>:<segment_id>")
         
         Returns:
             EntityExtractionResult with extracted entities and confidence score
@@ -178,7 +311,8 @@ class EDIConverter:
         entities_str = json.dumps(entities, indent=2)
         # Run the chain
         try:
-            result = chain_entities_extraction.invoke({'text': text, 'entities': entities_str})
+            async with self.llm_semaphore:
+                result = await cached_invoke(get_chain_entities_extraction(), {'text': text, 'entities': entities_str}, namespace)
             return result
         except Exception as e:
             print(f"Error during extraction: {e}")
@@ -195,19 +329,78 @@ class EDIConverter:
                 confidence_score=0.0
             )
         
-    def generate_edi_expression(self, segment_id: str, entities: List[Dict[str, str]], version: str) -> EDIExpressionOutputParser:
+    async def extract_entities_batch(self, segments: List[Dict[str, Any]], edi_info_id: str) -> Dict[str, EntityExtractionResult]:
+        """
+        Extract entities for several segments, batching segments that share the same text
+        into a single LLM request.
+        
+        Args:
+            segments: List of {'segment_id', 'text', 'entities'} dicts
+            edi_info_id: Used to namespace the semantic cache
+        
+        Returns:
+            Dict mapping segment id to its EntityExtractionResult
+        """
+        results: Dict[str, EntityExtractionResult] = {}
+        segments_by_text: Dict[str, List[Dict[str, Any]]] = {}
+        for segment in segments:
+            if not segment['entities']:
+                # Nothing to extract and nothing mandatory, so the segment needs no LLM call
+                results[segment['segment_id']] = EntityExtractionResult(extracted_entities=[], confidence_score=1.0)
+                continue
+            segments_by_text.setdefault(segment['text'], []).append(segment)
+
+        async def extract_text(text: str, text_segments: List[Dict[str, Any]]) -> None:
+            segment_ids = [segment['segment_id'] for segment in text_segments]
+            items_str = '\n'.join(
+                f"- segment_id: {segment['segment_id']}\n  entities: {json.dumps(segment['entities'])}"
+                for segment in text_segments
+            )
+            try:
+                async with self.llm_semaphore:
+                    batch = await cached_invoke(get_chain_entities_extraction_batch(), {'text': text, 'items': items_str}, f"{edi_info_id}:{','.join(segment_ids)}")
+                for result in batch.results:
+                    if result.segment_id in segment_ids:
+                        results[result.segment_id] = EntityExtractionResult(
+                            extracted_entities=result.extracted_entities,
+                            confidence_score=result.confidence_score
+                        )
+            except Exception as e:
+                print(f"Error during batch extraction, falling back to per-segment extraction: {e}")
+
+            # Segments the batch call missed are extracted individually
+            missed = [segment for segment in text_segments if segment['segment_id'] not in results]
+            extracted = await asyncio.gather(*[
+                self.extract_entities(text, segment['entities'], namespace=f"{edi_info_id}:{segment['segment_id']}")
+                for segment in missed
+            ])
+            results.update(zip([segment['segment_id'] for segment in missed], extracted))
+
+        # Distinct texts are independent requests
+        await asyncio.gather(*[extract_text(text, text_segments) for text, text_segments in segments_by_text.items()])
+        return results
+
+    async def generate_edi_expression(self, segment_id: str, entities: List[Dict[str, str]], version: str) -> EDIExpressionOutputParser:
         """
         Generate an EDI expression for a segment from the entities extracted.
         """
         entities_str = json.dumps(entities, indent=2)
-        result = chain_edi_expression.invoke({'segment': segment_id, 'entities': entities_str, 'version': version})
+        async with self.llm_semaphore:
+            result = await get_chain_edi_expression().ainvoke({'segment': segment_id, 'entities': entities_str, 'version': version})
         return result
 
-    async def is_segment_relevant(self, segment_id: str, segment_description: str, relevant_text: str, entities: str) -> RelevantTextResult:
+    async def is_segment_relevant(self, segment_id: str, segment_description: str, relevant_text: str, entities: str,
+                                  entity_names: Sequence[str] = ()) -> RelevantTextResult:
         """
         Check if the segment is relevant to the text.
+        Clear-cut cases are decided by matching entity_names in the text; only ambiguous ones call the LLM.
         """
-        is_segment_relevant = chain_relevant_text.invoke({'text': relevant_text, 'segment': f"{segment_id} - {segment_description}", 'entities': entities})
+        relevant = prefilter_relevance(relevant_text, entity_names)
+        if relevant is not None:
+            return RelevantTextResult(relevant=relevant)
+
+        async with self.llm_semaphore:
+            is_segment_relevant = await get_chain_relevant_text().ainvoke({'text': relevant_text, 'segment': f"{segment_id} - {segment_description}", 'entities': entities})
         return is_segment_relevant
     
     # ========================================================================
@@ -224,79 +417,83 @@ class EDIConverter:
         Returns:
             ExtractionResponse with extracted JSON, EDI segments, and validation errors
         """
-        # Step 1: Get metadata
-        edi_info_data = await self.query_edi_info_data(interchange_sender, edi_info_id)
+        # Steps 1-2: Get metadata and raw text
+        edi_info_data = await self.query_edi_info_with_raw_data(interchange_sender, edi_info_id)
         if not edi_info_data:
             raise ValueError(f"EDI info data not found for interchange sender {interchange_sender} and edi info id {edi_info_id}")
         
         edi_info_agency = edi_info_data['type']
         version = edi_info_data['standard_version']
         transaction_type = edi_info_data['transaction_name']
-        agency = 'X'
-        if edi_info_agency in AGENCY_MAP:
-            agency = AGENCY_MAP[edi_info_agency]
+        agency = AGENCY_MAP.get(edi_info_agency, 'X')
         
-        # Step 2: Get raw text
-        raw_data = await self.query_raw_data(edi_info_id)
-        raw_text = raw_data['raw_data']
+        raw_text = edi_info_data['raw_data']
         
         # Step 3: Get segment metadata for context
-        edi_segments = await get_segments_usage(agency, version, transaction_type)
-        metadata_summary = f"Transaction {transaction_type} version {version} with {len(edi_segments)} segments"
+        metadata_summary = await self.get_metadata_summary(agency, version, transaction_type)
+        
+        # Load the builder's schema while the LLM call runs; awaited before building
+        builder_ready = asyncio.create_task(self._get_builder(agency, version)) if build_edi else None
         
-        # Step 4: Extract structured JSON using LLM
-        print(f"Extracting structured data from text (transaction type: {transaction_type})...")
-        print(f"Text length: {len(raw_text)} characters")
-        print(f"Calling LLM with metadata: {metadata_summary}")
-
         try:
-            import time
-            start_time = time.time()
-            extracted_data: ExtractedTransaction = chain_structured_extraction.invoke({
-                'text': raw_text,
-                'transaction_type': transaction_type,
-                'metadata_summary': metadata_summary
-            })
-            elapsed = time.time() - start_time
-            print(f"✓ LLM extraction completed in {elapsed:.2f} seconds")
-        except Exception as e:
-            print(f"❌ LLM extraction failed: {str(e)}")
-            raise
+            # Step 4: Extract structured JSON using LLM
+            print(f"Extracting structured data from text (transaction type: {transaction_type})...")
+            print(f"Text length: {len(raw_text)} characters")
+            print(f"Calling LLM with metadata: {metadata_summary}")
 
-        # Step 5: Validate extracted data
-        print(f"Validating extracted data...")
-        validation_errors = self._validate_extraction(extracted_data, transaction_type)
-        print(f"Validation complete. Errors: {len(validation_errors)}")
-        
-        # Step 6: Build EDI segments deterministically (only if build_edi=True and validation passes)
-        edi_segments_output = []
-        status = "success"
-        
-        if not build_edi:
-            # Skip building, just return extracted JSON
-            print(f"⚠ Skipping EDI building (build_edi=False)")
-            status = "extraction_only"
-        elif not validation_errors or all("WARNING" in err for err in validation_errors):
             try:
-                # Use DB-driven builder for accurate segment construction
-                builder = DBDrivenEDIBuilder()
-                await builder.initialize()
-                edi_segments_output = await builder.build_transaction(extracted_data, agency, version)
-                await builder.dispose()
-                print(f"✓ Built {len(edi_segments_output)} EDI segments using DB rules")
+                import time
+                start_time = time.time()
+                extracted_data: ExtractedTransaction = await cached_invoke(get_chain_structured_extraction(), {
+                    'text': raw_text,
+                    'transaction_type': transaction_type,
+                    'metadata_summary': metadata_summary
+                }, namespace=f"{edi_info_id}:{transaction_type}")
+                elapsed = time.time() - start_time
+                print(f"✓ LLM extraction completed in {elapsed:.2f} seconds")
             except Exception as e:
-                validation_errors.append(f"ERROR: Failed to build EDI segments: {str(e)}")
-                status = "failed"
-        else:
-            status = "needs_review"
-            print(f"⚠ Validation failed with {len(validation_errors)} errors. Review required.")
+                print(f"❌ LLM extraction failed: {str(e)}")
+                raise
+
+            # Step 5: Validate extracted data
+            print(f"Validating extracted data...")
+            validation_errors = self._validate_extraction(extracted_data, transaction_type)
+            print(f"Validation complete. Errors: {len(validation_errors)}")
         
-        return ExtractionResponse(
-            extracted_data=extracted_data,
-            raw_edi_segments=edi_segments_output,
-            validation_errors=validation_errors,
-            status=status
-        )
+            # Step 6: Build EDI segments deterministically (only if build_edi=True and validation passes)
+            edi_segments_output = []
+            status = "success"
+        
+            if not build_edi:
+                # Skip building, just return extracted JSON
+                print(f"⚠ Skipping EDI building (build_edi=False)")
+                status = "extraction_only"
+            elif not validation_errors or all("WARNING" in err for err in validation_errors):
+                try:
+                    # Use DB-driven builder for accurate segment construction
+                    builder = await builder_ready
+                    edi_segments_output = await builder.build_transaction(extracted_data, agency, version)
+                    print(f"✓ Built {len(edi_segments_output)} EDI segments using DB rules")
+                except Exception as e:
+                    validation_errors.append(f"ERROR: Failed to build EDI segments: {str(e)}")
+                    status = "failed"
+            else:
+                status = "needs_review"
+                print(f"⚠ Validation failed with {len(validation_errors)} errors. Review required.")
+        
+            return ExtractionResponse(
+                extracted_data=extracted_data,
+                raw_edi_segments=edi_segments_output,
+                validation_errors=validation_errors,
+                status=status
+            )
+        finally:
+            # Whatever raised (missing raw text, validation, the LLM), the preload task is never left pending.
+            # Its own errors were already reported when building, so they are only collected here.
+            if builder_ready:
+                if not builder_ready.done():
+                    builder_ready.cancel()
+                await asyncio.gather(builder_ready, return_exceptions=True)
     
     def _validate_extraction(self, data: ExtractedTransaction, transaction_type: str) -> List[str]:
         """
@@ -308,46 +505,39 @@ class EDIConverter:
         errors = []
         
         # Check mandatory fields based on transaction type
-        if transaction_type == "810":
-            if not data.invoice_number:
-                errors.append("ERROR: Missing mandatory invoice number")
-            if not data.invoice_date:
-                errors.append("ERROR: Missing mandatory invoice date")
-        elif transaction_type == "850":
-            if not data.po_number:
-                errors.append("ERROR: Missing mandatory PO number")
-            if not data.po_date:
-                errors.append("WARNING: Missing PO date (recommended)")
+        validate_transaction = _TRANSACTION_VALIDATORS.get(transaction_type)
+        if validate_transaction:
+            errors.extend(validate_transaction(data))
         
         # Check for parties
         if not data.buyer and not data.seller:
             errors.append("WARNING: No buyer or seller information found")
         
-        if transaction_type == "850" and not data.buyer:
-            errors.append("WARNING: Missing buyer information (BY party)")
+        required_party = _TRANSACTION_PARTIES.get(transaction_type)
+        if required_party and not getattr(data, required_party[0]):
+            errors.append(required_party[1])
         
-        if transaction_type == "810" and not data.bill_to:
-            errors.append("WARNING: Missing bill-to information (BT party)")
-        
-        # Check line items
+        # Check line items; quantities/prices of non-cancelled lines are collected in the same pass
+        quantities, prices = [], []
         if not data.items:
             errors.append("ERROR: No line items found")
         else:
             for idx, item in enumerate(data.items, start=1):
-                if item.quantity is None and item.status != "CANCELLED":
-                    errors.append(f"ERROR: Line {idx} missing quantity")
-                if item.unit_price is None:
+                quantity, unit_price = item.quantity, item.unit_price
+                if item.status != "CANCELLED":
+                    if quantity is None:
+                        errors.append(f"ERROR: Line {idx} missing quantity")
+                    quantities.append(quantity or 0)
+                    prices.append(unit_price or 0)
+                if unit_price is None:
                     errors.append(f"WARNING: Line {idx} missing unit price")
                 if not item.item_id:
                     errors.append(f"WARNING: Line {idx} missing item ID")
         
         # Check totals consistency
         if data.total_amount and data.items:
-            calculated_total = sum(
-                (item.quantity or 0) * (item.unit_price or 0)
-                for item in data.items
-                if item.status != "CANCELLED"
-            )
+            calculated_total = float(np.dot(np.asarray(quantities, dtype=np.float64),
+                                            np.asarray(prices, dtype=np.float64)))
             if abs(calculated_total - data.total_amount) > 0.01:
                 errors.append(f"WARNING: Total amount mismatch (stated: {data.total_amount}, calculated: {calculated_total})")
         
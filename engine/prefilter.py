@@ -0,0 +1,43 @@
+"""
+Deterministic relevance pre-filter for segments.
+Decides the easy cases by matching entity names in the text so only ambiguous
+segments go to chain_relevant_text.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple
+
+# Distinct entity names that must appear in the text to call a segment relevant without the LLM
+RELEVANCE_MIN_HITS = int(os.getenv("RELEVANCE_MIN_HITS", "2"))
+# Texts up to this many characters with no entity name at all are treated as not relevant.
+# Off by default: entity names are X12 dictionary labels ("City Name", "Entity Identifier Code")
+# that rarely occur verbatim in natural language, so a zero-hit text is usually still relevant.
+RELEVANCE_SHORT_TEXT_CHARS = int(os.getenv("RELEVANCE_SHORT_TEXT_CHARS", "0"))
+
+
+@lru_cache(maxsize=1024)
+def _entity_pattern(entity_names: Tuple[str, ...]) -> Optional[re.Pattern]:
+    """Compiled case-insensitive alternation of the entity names (longest first), matched as whole words."""
+    names = sorted({name.strip() for name in entity_names if name and name.strip()}, key=len, reverse=True)
+    if not names:
+        return None
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(name) for name in names) + r")(?!\w)", re.IGNORECASE)
+
+
+def prefilter_relevance(text: str, entity_names: Sequence[str]) -> Optional[bool]:
+    """
+    Returns True if at least RELEVANCE_MIN_HITS distinct entity names occur in the text,
+    False if none occur and the text is at most RELEVANCE_SHORT_TEXT_CHARS long (off by default),
+    and None when the LLM should decide.
+    """
+    pattern = _entity_pattern(tuple(entity_names))
+    if pattern is None:
+        return None
+
+    hits = {match.lower() for match in pattern.findall(text)}
+    if len(hits) >= RELEVANCE_MIN_HITS:
+        return True
+    if not hits and len(text) <= RELEVANCE_SHORT_TEXT_CHARS:
+        return False
+    return None
@@ -1,25 +1,16 @@
 import asyncio
+import os
+import time
 import uuid
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import text
+from typing import Optional
+import asyncpg
 from dotenv import load_dotenv
 
 load_dotenv()
 from utils.constants import DATABASE_URL
 
-
-async def seed(transaction_type='850'):
-    """
-    Seed test data for EDI conversion
-
-    Args:
-        transaction_type: '850' for Purchase Order or '810' for Invoice
-    """
-    engine = create_async_engine(DATABASE_URL)
-    doc_id = str(uuid.uuid4())
-
-    # Sample texts for different transaction types
-    text_850 = """
+# Sample texts for different transaction types
+TEXT_850 = """
 On Thursday, February 22, 2024, at 8:08 AM, an EDI X12 interchange was received by 6303207447 from 925485US00. The interchange carried control number 850100160 and was identified as production data. No interchange acknowledgment was requested. Within this interchange, a functional group built according to the ASC X12 version 005010 standard was transmitted. The group contained a single transaction set identified as an 850 Purchase Order, with transaction set control number 108794.
 
 The purchase order was issued as an original, stand-alone order dated February 22, 2024, and was assigned purchase order number 4780904642. The buyer on the order is WAL-MART DC 7026, located at 945 Highway 138 in Grantsville, with GLN 0078742050690. The supplier listed on the order is Winland Foods, Inc.
@@ -33,66 +24,120 @@ Two line items are included in the purchase order. The first line item requests
 In total, the purchase order contains two line items with a combined gross value of $8,794.50. The transaction concludes with 34 included segments, confirming that one purchase order was transmitted within a single functional group and a single interchange.
 
 
-    """.strip()
+""".strip()
 
-    text_810 = """
+TEXT_810 = """
 Target received an invoice from FreshFoods Ltd for 50 cartons of product code FF99.
 Unit price is $25 per carton.
 Invoice date is March 20, 2026, and invoice number is INV-12345.
 Bill to Target HQ in Minnesota, shipped to Target Warehouse in Texas.
-    """.strip()
+""".strip()
+
+
+def _uuid7() -> uuid.UUID:
+    """
+    Time-ordered UUID (RFC 9562 version 7): 48-bit millisecond timestamp followed by random bits,
+    so seeded ids sort by creation time and index inserts land on the right-most pages.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76  # version 7
+    value = value & ~(0x3 << 62) | 0x2 << 62  # RFC 4122 variant
+    return uuid.UUID(int=value)
+
+
+# Python 3.14+ ships uuid7; older interpreters use the helper above
+uuid7 = getattr(uuid, 'uuid7', _uuid7)
+
+
+# Combined raw text size from which raw_processed_data rows are written with COPY
+COPY_MIN_CHARS = 1 << 20
+
+# Clean up the sender's old edi_info rows and their raw data, then insert the new edi_info records
+# ($1 sender, $2 ids, $3 transaction types) and their raw_processed_data records ($4 texts). All
+# parts of one statement see the same snapshot, so the deletes never touch the rows being inserted.
+_SQL_CLEANUP = """
+    WITH deleted AS (
+        DELETE FROM mercury.edi_info
+        WHERE interchange_sender = $1
+        RETURNING edi_info_id
+    ), deleted_raw AS (
+        DELETE FROM mercury.raw_processed_data r
+        USING deleted d
+        WHERE r.doc_id = d.edi_info_id || '_NL'
+    )"""
+_SQL_INSERT_INFO = """
+    INSERT INTO mercury.edi_info
+    (interchange_sender, edi_info_id, type, standard_version, transaction_name)
+    SELECT $1, t.id, 'EDI/X12', '004010', t.transaction_type
+    FROM unnest($2::text[], $3::text[]) AS t(id, transaction_type)"""
+_SQL_INSERT_RAW = """
+    INSERT INTO mercury.raw_processed_data (doc_id, raw_data, data_type)
+    SELECT t.id || '_NL', t.raw, 'NL'
+    FROM unnest($2::text[], $4::text[]) AS t(id, raw)"""
+_SQL_SEED = f"{_SQL_CLEANUP}, info AS ({_SQL_INSERT_INFO}\n    ){_SQL_INSERT_RAW}"
+_SQL_SEED_INFO = f"{_SQL_CLEANUP}{_SQL_INSERT_INFO}"
+
+
+async def connect() -> asyncpg.Connection:
+    """A single short-lived connection; asyncpg takes a plain postgresql:// DSN, without SQLAlchemy's driver suffix."""
+    return await asyncpg.connect(DATABASE_URL.replace('+asyncpg', ''))
+
+
+async def seed(*transaction_types, conn: Optional[asyncpg.Connection] = None):
+    """
+    Seed test data for EDI conversion
+
+    Args:
+        transaction_types: '850' for Purchase Order or '810' for Invoice; one record is seeded
+            per type given (default a single '850')
+        conn: Connection to reuse across several seed() calls in one event loop; when omitted,
+            a connection is opened and closed for this call
+    """
+    transaction_types = transaction_types or ('850',)
+    doc_ids = [str(uuid7()) for _ in transaction_types]
 
     # Select the appropriate text based on transaction type
-    if transaction_type == '810':
-        nl_text = text_810
-    else:
-        nl_text = text_850
+    nl_texts = [TEXT_810 if transaction_type == '810' else TEXT_850 for transaction_type in transaction_types]
 
     sender = "TESTNEW"
 
-    async with engine.begin() as conn:
-        # Clean up old test data first
-        await conn.execute(text("""
-            DELETE FROM mercury.raw_processed_data
-            WHERE doc_id LIKE (SELECT edi_info_id || '%' FROM mercury.edi_info WHERE interchange_sender = :sender LIMIT 1)
-        """), {"sender": sender})
-
-        await conn.execute(text("""
-            DELETE FROM mercury.edi_info
-            WHERE interchange_sender = :sender
-        """), {"sender": sender})
-
-        print(f"✓ Cleaned up old test data for sender '{sender}'")
-
-        # Insert edi_info record with the specified transaction type
-        await conn.execute(text("""
-            INSERT INTO mercury.edi_info
-            (interchange_sender, edi_info_id, type, standard_version, transaction_name)
-            VALUES (:sender, :id, 'EDI/X12', '004010', :transaction_type)
-        """), {"sender": sender, "id": doc_id, "transaction_type": transaction_type})
-
-        # Insert raw_processed_data record
-        await conn.execute(text("""
-            INSERT INTO mercury.raw_processed_data (doc_id, raw_data, data_type)
-            VALUES (:doc_id, :raw, 'NL')
-        """), {"doc_id": f"{doc_id}_NL", "raw": nl_text})
-    
-    await engine.dispose()
-
-    print("=" * 70)
-    print(f"✓ Test data seeded successfully! (Transaction Type: {transaction_type})")
-    print("=" * 70)
-    print(f"\nUse this payload to test the V2 API:\n")
-    print(f'{{"interchange_sender":"{sender}","edi_info_id":"{doc_id}"}}')
-    print(f"\nOr run this curl command:\n")
-    print(f'curl -X POST http://localhost:8000/convert_text_to_edi_v2 \\')
-    print(f'  -H "Content-Type: application/json" \\')
-    print(f'  -d \'{{"interchange_sender":"{sender}","edi_info_id":"{doc_id}"}}\'')
+    owns_connection = conn is None
+    if owns_connection:
+        conn = await connect()
+    try:
+        if sum(len(nl_text) for nl_text in nl_texts) < COPY_MIN_CHARS:
+            # One statement, one round trip, and atomic on its own. Rows travel as arrays unnested
+            # server-side, so any number of records is still one statement.
+            await conn.execute(_SQL_SEED, sender, doc_ids, list(transaction_types), nl_texts)
+        else:
+            # Large texts go through binary COPY instead of being bound as statement parameters
+            async with conn.transaction():
+                await conn.execute(_SQL_SEED_INFO, sender, doc_ids, list(transaction_types))
+                await conn.copy_records_to_table(
+                    'raw_processed_data', schema_name='mercury',
+                    columns=['doc_id', 'raw_data', 'data_type'],
+                    records=[(f"{doc_id}_NL", nl_text, 'NL') for doc_id, nl_text in zip(doc_ids, nl_texts)],
+                )
+    finally:
+        if owns_connection:
+            await conn.close()
+
+    print(f"✓ Cleaned up old test data for sender '{sender}'")
+
+    for transaction_type, doc_id in zip(transaction_types, doc_ids):
+        print("=" * 70)
+        print(f"✓ Test data seeded successfully! (Transaction Type: {transaction_type})")
+        print("=" * 70)
+        print(f"\nUse this payload to test the V2 API:\n")
+        print(f'{{"interchange_sender":"{sender}","edi_info_id":"{doc_id}"}}')
+        print(f"\nOr run this curl command:\n")
+        print(f'curl -X POST http://localhost:8000/convert_text_to_edi_v2 \\')
+        print(f'  -H "Content-Type: application/json" \\')
+        print(f'  -d \'{{"interchange_sender":"{sender}","edi_info_id":"{doc_id}"}}\'')
     print("=" * 70)
 
 
 if __name__ == "__main__":
     import sys
-    # Allow passing transaction type as argument: python seed_test.py 810
-    trans_type = sys.argv[1] if len(sys.argv) > 1 else '850'
-    asyncio.run(seed(trans_type))
+    # Allow passing transaction types as arguments: python seed_test.py 810 (or 810 850 for both)
+    asyncio.run(seed(*sys.argv[1:]))
@@ -5,7 +5,16 @@ load_dotenv()
 from engine.edi_converter import EDIConverter
 
 
-edi_converter = EDIConverter()
+_converter = None
+
+
+def get_converter() -> EDIConverter:
+    """The converter is built on first use, so importing this module does not open DB/HTTP clients."""
+    global _converter
+    if _converter is None:
+        _converter = EDIConverter()
+    return _converter
+
 
 text = """This is a summary of a transaction set with the identifier code 810 and control number 7540. The transaction occurred on Wednesday, 6th March 2024, and is linked to an invoice numbered 0090033194, dated Tuesday, 27th February 2024. The associated purchase order number is 5331450317. 
 
@@ -114,11 +123,12 @@ Note that there are no available details for size, packaging code, weight, gross
 
 •⁠  ⁠Summary: The transaction concludes with a total of 53 included segments. The transaction set control number is 7540.
 """
-# edis = asyncio.run(edi_converter.convert_text_to_edi("6303207447", "a7b1d279-0f35-4ab5-9e78-498be7b1de46"))
+if __name__ == "__main__":
+    # edis = asyncio.run(get_converter().convert_text_to_edi("6303207447", "a7b1d279-0f35-4ab5-9e78-498be7b1de46"))
 
-# print(edis)
-# for edi in edis:
-#    print(edi)
+    # print(edis)
+    # for edi in edis:
+    #    print(edi)
 
-is_relevent = asyncio.run(edi_converter.is_segment_relevant("LX", "Product Details", text, ""))
-print(is_relevent)
+    is_relevent = asyncio.run(get_converter().is_segment_relevant("LX", "Product Details", text, ""))
+    print(is_relevent)
@@ -2,6 +2,8 @@
 Test full transaction building with complete extracted data matching boss's invoice.
 """
 import asyncio
+import sys
+from itertools import zip_longest
 from engine.edi_builder_v2 import DBDrivenEDIBuilder
 from utils.schemas import (
     ExtractedTransaction, LineItem, Party, CodeList, CodePair, FinancialAccounting, FinancialBreakdown,
@@ -131,37 +133,29 @@ async def test_full_810_invoice():
             "CTT*1"
         ]
         
-        print("=" * 70)
-        print("GENERATED EDI SEGMENTS:")
-        print("=" * 70)
-        for i, seg in enumerate(segments, 1):
-            print(f"{i:2}. {seg}")
+        # The report is assembled in one buffer and written once
+        report = ["=" * 70, "GENERATED EDI SEGMENTS:", "=" * 70]
+        report += [f"{i:2}. {seg}" for i, seg in enumerate(segments, 1)]
         
-        print("\n" + "=" * 70)
-        print("EXPECTED EDI SEGMENTS (from boss):")
-        print("=" * 70)
-        for i, seg in enumerate(expected, 1):
-            print(f"{i:2}. {seg}~")
+        report += ["\n" + "=" * 70, "EXPECTED EDI SEGMENTS (from boss):", "=" * 70]
+        report += [f"{i:2}. {seg}~" for i, seg in enumerate(expected, 1)]
         
-        print("\n" + "=" * 70)
-        print("COMPARISON:")
-        print("=" * 70)
+        report += ["\n" + "=" * 70, "COMPARISON:", "=" * 70]
         
-        # Compare each segment
+        # Compare each segment; extra or missing segments on either side show up as mismatches
         matches = 0
-        for i, (gen, exp) in enumerate(zip(segments, expected), 1):
+        for i, (gen, exp) in enumerate(zip_longest(segments, expected, fillvalue=''), 1):
             gen_clean = gen.rstrip('~')
             exp_clean = exp.rstrip('~')
             match = "✓" if gen_clean == exp_clean else "✗"
-            print(f"{i:2}. {match} {gen_clean}")
+            report.append(f"{i:2}. {match} {gen_clean}")
             if gen_clean == exp_clean:
                 matches += 1
             else:
-                print(f"     Expected: {exp_clean}")
+                report.append(f"     Expected: {exp_clean}")
         
-        print("\n" + "=" * 70)
-        print(f"RESULT: {matches}/{len(expected)} segments match")
-        print("=" * 70)
+        report += ["\n" + "=" * 70, f"RESULT: {matches}/{len(expected)} segments match", "=" * 70]
+        sys.stdout.write("\n".join(report) + "\n")
         
     finally:
         await builder.dispose()
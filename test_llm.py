@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
 """Test custom LLM connection"""
 
+import asyncio
+import os
 from dotenv import load_dotenv
 load_dotenv()
 
 from engine.chains import llm
 
-def test_llm():
+# Seconds the test waits for the LLM before failing instead of hanging
+LLM_TEST_TIMEOUT = float(os.getenv("LLM_TEST_TIMEOUT", "30"))
+
+
+async def test_llm():
     """Test basic LLM functionality"""
     print("Testing LLM connection...")
-    
+
     try:
-        response = llm.invoke("Say 'Hello, EDI!' in exactly 3 words.")
+        response = await asyncio.wait_for(llm.ainvoke("Say 'Hello, EDI!' in exactly 3 words."),
+                                          timeout=LLM_TEST_TIMEOUT)
         print(f"✅ LLM Response: {response.content}")
         print(f"✅ LLM is working!")
         return True
+    except asyncio.TimeoutError:
+        print(f"❌ LLM Error: no response within {LLM_TEST_TIMEOUT:.0f} seconds")
+        return False
     except Exception as e:
         print(f"❌ LLM Error: {str(e)}")
         import traceback
@@ -22,5 +32,4 @@ def test_llm():
         return False
 
 if __name__ == "__main__":
-    test_llm()
-
+    asyncio.run(test_llm())
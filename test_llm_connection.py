@@ -1,18 +1,17 @@
 #!/usr/bin/env python3
 """Quick test to verify LLM connection is working."""
 
+import asyncio
 import httpx
-import json
+import orjson
+import os
 import time
 
 LLM_API_URL = "https://ai.kontratar.com:40726/v1/chat/completions"
 LLM_API_KEY = "c96ef1a0bd506defa4b2c0c0318a654952ad6b8ef598c6f104d99ffa36264ca7"
 LLM_MODEL = "gaunernst/gemma-3-27b-it-qat-compressed-tensors"
-
-print("🔍 Testing LLM connection...")
-print(f"URL: {LLM_API_URL}")
-print(f"Model: {LLM_MODEL}")
-print()
+# Number of identical probes to send at once (e.g. to warm up or check concurrency)
+LLM_PROBES = int(os.getenv("LLM_PROBES", "1"))
 
 # Simple test request
 payload = {
@@ -23,35 +22,46 @@ payload = {
     "max_tokens": 50,
     "temperature": 0.1
 }
+# Every probe sends the same body, so it is serialized once
+PAYLOAD_BYTES = orjson.dumps(payload)
+
+
+async def probe(client: httpx.AsyncClient, number: int):
+    """Send one test request and report its outcome."""
+    try:
+        start_time = time.time()
+        response = await client.post(LLM_API_URL, content=PAYLOAD_BYTES)
+        elapsed = time.time() - start_time
+
+        if response.status_code == 200:
+            result = orjson.loads(response.content)
+            message = result['choices'][0]['message']['content']
+            tokens = result['usage']
+
+            print(f"✅ [{number}] SUCCESS! ({elapsed:.2f} seconds)")
+            print(f"Response: {message}")
+            print(f"Tokens: {tokens}")
+        else:
+            print(f"❌ [{number}] FAILED! Status: {response.status_code}")
+            print(f"Response: {response.text}")
+
+    except Exception as e:
+        print(f"❌ [{number}] ERROR: {e}")
+
+
+async def main():
+    print("🔍 Testing LLM connection...")
+    print(f"URL: {LLM_API_URL}")
+    print(f"Model: {LLM_MODEL}")
+    print()
+
+    print(f"⏱️  Sending {LLM_PROBES} request(s)...")
+    # One HTTP/2 client: concurrent probes multiplex over a single TCP/TLS session
+    async with httpx.AsyncClient(http2=True, verify=False, timeout=60.0,
+                                 headers={"Authorization": f"Bearer {LLM_API_KEY}",
+                                          "Content-Type": "application/json"}) as client:
+        await asyncio.gather(*[probe(client, number) for number in range(1, LLM_PROBES + 1)])
 
-try:
-    print("⏱️  Sending request...")
-    start_time = time.time()
-    
-    with httpx.Client(verify=False, timeout=60.0) as client:
-        response = client.post(
-            LLM_API_URL,
-            headers={
-                "Authorization": f"Bearer {LLM_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json=payload
-        )
-    
-    elapsed = time.time() - start_time
-    
-    if response.status_code == 200:
-        result = response.json()
-        message = result['choices'][0]['message']['content']
-        tokens = result['usage']
-        
-        print(f"✅ SUCCESS! ({elapsed:.2f} seconds)")
-        print(f"Response: {message}")
-        print(f"Tokens: {tokens}")
-    else:
-        print(f"❌ FAILED! Status: {response.status_code}")
-        print(f"Response: {response.text}")
-        
-except Exception as e:
-    print(f"❌ ERROR: {e}")
 
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,4 @@
-from chroma.chromadb_service import ChromaDBService
+from chroma.chromadb_service import ChromaDBService, document_filter
 import asyncio
 
 async def main():
@@ -6,12 +6,7 @@ async def main():
     chroma_service = ChromaDBService()
     collection_name = "mercury-collection"
 
-    metadata_filter = {
-        "$and": [
-            {"interchange_sender": "6303207447"},
-            {"edi_info_id": "29940316-c9da-4a27-a5a4-3a079d57ba91"}
-        ]
-    }
+    metadata_filter = document_filter("6303207447", "29940316-c9da-4a27-a5a4-3a079d57ba91")
 
     documents = await chroma_service.get_relevant_chunks(
         collection_name=collection_name,
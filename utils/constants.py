@@ -1,17 +1,16 @@
-import pandas as pd
 import os
 import dotenv
+from types import MappingProxyType
 dotenv.load_dotenv()
 
-
-# DF_ELEMENTUSAGEDEFS = pd.read_csv('./mappings/elementusagedefs_006010.csv')
 EDI_VERSION = "006010"
-SEGMENTS_SUPPORTED = ["BIG", "DTM", "N1", "N3", "IT1"]
+# Read-only: only used for membership tests
+SEGMENTS_SUPPORTED = frozenset(("BIG", "DTM", "N1", "N3", "IT1"))
 
-AGENCY_MAP = {
+AGENCY_MAP = MappingProxyType({
     "EDI/X12": "X",
     "EDIFACT": "E",
-}
+})
 
 # Use DATABASE_URL from .env directly
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -23,8 +22,23 @@ if not DATABASE_URL:
     DB_PORT = os.getenv('POSTGRES_PORT', '5432')
     DB_NAME = os.getenv('POSTGRES_DB', 'govcon')
     DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Connection pool sizing for the EDI engines, sized for concurrent conversions
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '5'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '20'))
+DB_POOL_MAX_OVERFLOW = int(os.getenv('DB_POOL_MAX_OVERFLOW', '10'))
+# Seconds before a pooled connection is replaced; short so stale connections expire without pre-ping
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '300'))
 CHROMA_QUERY = """Return the most relevant text for the following segment: {segment_id}, {segment_description},
 Is expected to contain the following entities:
 {entities}"""
 
 TOKENS_LIMIT = 2000
+# Max Chroma retrievals in flight while segments are prepared concurrently
+CHROMA_MAX_CONCURRENCY = int(os.getenv('CHROMA_MAX_CONCURRENCY', '8'))
+# Max LLM requests a single converter has in flight (provider rate limits)
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+# Schema lookups in utils.utils are cached this many seconds, keeping at most SCHEMA_CACHE_MAXSIZE keys
+SCHEMA_CACHE_TTL = int(os.getenv('SCHEMA_CACHE_TTL', '3600'))
+SCHEMA_CACHE_MAXSIZE = int(os.getenv('SCHEMA_CACHE_MAXSIZE', '1024'))
+# Max schema lookups in flight when many segments miss the cache at once (each holds a pooled connection)
+SCHEMA_LOOKUP_CONCURRENCY = int(os.getenv('SCHEMA_LOOKUP_CONCURRENCY', '16'))
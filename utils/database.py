@@ -1,5 +1,6 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+import os
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from utils.config import settings
 from utils.entities import Base
@@ -7,31 +8,39 @@ from utils.entities import Base
 DATABASE_URL = settings.SQLALCHEMY_DATABASE_URI
 
 enable_echo = False
+# The one engine for the ORM sessions and the utils.utils schema lookups, so both share a pool
 engine = create_async_engine(
     DATABASE_URL,
     echo=enable_echo,
     future=True,
-    pool_pre_ping=True,  # Test connections before using
-    pool_recycle=3600,   # Recycle connections after 1 hour
-    pool_size=10,        # Connection pool size
-    max_overflow=20      # Max overflow connections
+    pool_pre_ping=os.getenv('POOL_PRE_PING', 'true').lower() == 'true',  # Test connections before using
+    pool_recycle=int(os.getenv('POOL_RECYCLE', '3600')),  # Recycle connections after 1 hour
+    pool_size=int(os.getenv('POOL_SIZE', '10')),          # Connection pool size
+    max_overflow=int(os.getenv('MAX_OVERFLOW', '20')),    # Max overflow connections
+    # Hand out the most recently returned connection: a small hot set keeps its statement caches warm
+    # and the connections left idle age out through pool_recycle
+    pool_use_lifo=True,
+    connect_args={
+        "server_settings": {
+            # JIT off: the schema lookups are short queries whose setup would be dominated by JIT compilation
+            "jit": "off",
+            # Keepalive probes stop NATs/load balancers from silently dropping idle pooled connections
+            "tcp_keepalives_idle": os.getenv('DB_TCP_KEEPALIVES_IDLE', '30'),
+            "tcp_keepalives_interval": os.getenv('DB_TCP_KEEPALIVES_INTERVAL', '10'),
+        },
+        # Per-connection caches of prepared statements (asyncpg's and SQLAlchemy's adapter's),
+        # so the repeated schema lookups skip parse/plan
+        "statement_cache_size": int(os.getenv('DB_STATEMENT_CACHE_SIZE', '1024')),
+        "prepared_statement_cache_size": int(os.getenv('DB_STATEMENT_CACHE_SIZE', '1024')),
+    }
 )
 
-AsyncSessionLocal = sessionmaker(
+AsyncSessionLocal = async_sessionmaker(
     bind=engine,
-    class_=AsyncSession,
     expire_on_commit=False,
     autoflush=False,
-    autocommit=False,
 )
 
-def get_session():
-    session = AsyncSessionLocal()
-    try:
-        yield session
-    finally:
-        session.close()
-
 async def get_async_session():
     """Async session generator for use with async functions"""
     session = AsyncSessionLocal()
@@ -1,27 +1,30 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean
-from sqlalchemy.ext.declarative import declarative_base
+from typing import Optional
+from sqlalchemy import Integer, String, Text
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
-Base = declarative_base()
+
+class Base(DeclarativeBase):
+    pass
 
 class SegmentNLP(Base):
     __tablename__ = 'segmentnlp'
     
-    id = Column(Integer, primary_key=True)
-    agency = Column(String(10))
-    version = Column(String(20))
-    transactionid = Column(String(50))  # transaction set ID
-    segment_id = Column(String(10))
-    description = Column(Text)
-    release = Column(Integer, default=0)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    agency: Mapped[Optional[str]] = mapped_column(String(10))
+    version: Mapped[Optional[str]] = mapped_column(String(20))
+    transactionid: Mapped[Optional[str]] = mapped_column(String(50))  # transaction set ID
+    segment_id: Mapped[Optional[str]] = mapped_column(String(10))
+    description: Mapped[Optional[str]] = mapped_column(Text)
+    release: Mapped[Optional[int]] = mapped_column(Integer, default=0)
 
 class ElementUsageDefs(Base):
     __tablename__ = 'elementusagedefs'
     
-    id = Column(Integer, primary_key=True)
-    agency = Column(String(10))
-    version = Column(String(20))
-    segment_id = Column(String(10))
-    description = Column(Text)
-    requirement_designator = Column(String(10))
-    position = Column(Integer)
-    release = Column(Integer, default=0) 
\ No newline at end of file
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    agency: Mapped[Optional[str]] = mapped_column(String(10))
+    version: Mapped[Optional[str]] = mapped_column(String(20))
+    segment_id: Mapped[Optional[str]] = mapped_column(String(10))
+    description: Mapped[Optional[str]] = mapped_column(Text)
+    requirement_designator: Mapped[Optional[str]] = mapped_column(String(10))
+    position: Mapped[Optional[int]] = mapped_column(Integer)
+    release: Mapped[Optional[int]] = mapped_column(Integer, default=0)
@@ -1,10 +1,27 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field
+from typing import Annotated, List, Optional, Dict, Any
 from datetime import date
+from functools import cached_property
+
+
+def _none_as_empty(value):
+    return [] if value is None else value
+
+# LLMs often answer null for an empty list; accept it as [] instead of failing validation
+NoneAsEmpty = BeforeValidator(_none_as_empty)
+
+
+class _NestedModel(BaseModel):
+    """
+    Base for the models nested in ExtractedTransaction. Their standalone validators are built on
+    first direct use: ExtractedTransaction embeds their schemas when it is built at import, and
+    most processes never construct them on their own.
+    """
+    model_config = ConfigDict(defer_build=True)
 
 
 # Line item for transactions (IT1, PO1, etc.)
-class LineItem(BaseModel):
+class LineItem(_NestedModel):
     line_number: Optional[int] = Field(None, description="Sequential line number")
     quantity: Optional[float] = Field(None, description="Quantity ordered/invoiced")
     unit_of_measure: Optional[str] = Field(None, description="Unit code (EA, PK, etc.)")
@@ -19,9 +36,14 @@ class LineItem(BaseModel):
     extended_amount: Optional[float] = Field(None, description="Line total (qty * price)")
     pack_size: Optional[int] = Field(None, description="Pack size/inner pack quantity (PO4 segment)")
 
+    @cached_property
+    def nsn_flat(self) -> Optional[str]:
+        """NSN without dashes (FS qualifier form), computed once per item."""
+        return self.nsn.replace('-', '') if self.nsn else None
+
 
 # Party/entity information (N1 loops)
-class Party(BaseModel):
+class Party(_NestedModel):
     entity_code: Optional[str] = Field(None, description="N1 code: BT, ST, BY, SE, RE, etc.")
     name: Optional[str] = Field(None, description="Organization name")
     id_qualifier: Optional[str] = Field(None, description="ID type: 92 (DUNS), 10 (DODAAC), 1 (DUNS+4), etc.")
@@ -29,7 +51,7 @@ class Party(BaseModel):
 
 
 # Contact information (PER segment)
-class Contact(BaseModel):
+class Contact(_NestedModel):
     function_code: str = Field(..., description="AP=Accounts Payable, BD=Buyer, SR=Receiving, etc.")
     name: Optional[str] = Field(None, description="Contact person name")
     phone: Optional[str] = Field(None, description="Phone number")
@@ -38,7 +60,7 @@ class Contact(BaseModel):
 
 
 # Address information (N3/N4)
-class Address(BaseModel):
+class Address(_NestedModel):
     street_line_1: Optional[str] = Field(None, description="Street address line 1")
     street_line_2: Optional[str] = Field(None, description="Street address line 2")
     city: Optional[str] = Field(None, description="City name")
@@ -48,46 +70,46 @@ class Address(BaseModel):
 
 
 # Date/Time reference (DTM)
-class DateReference(BaseModel):
+class DateReference(_NestedModel):
     qualifier: str = Field(..., description="DTM qualifier code (011, 063, 064, 168, etc.)")
     date_value: Optional[str] = Field(None, description="Date in YYMMDD or CCYYMMDD format")
     time_value: Optional[str] = Field(None, description="Time if applicable")
 
 
 # Reference information (REF, N9)
-class Reference(BaseModel):
+class Reference(_NestedModel):
     qualifier: str = Field(..., description="Reference type qualifier")
     identifier: Optional[str] = Field(None, description="Reference number/value")
     description: Optional[str] = Field(None, description="Free-form description")
 
 
 # Code information for LQ segments
-class CodePair(BaseModel):
+class CodePair(_NestedModel):
     qualifier: Optional[str] = Field(None, description="Code list qualifier (0, DE, DG, A9, etc.)")
     industry_code: Optional[str] = Field(None, description="Industry code value (FS2, FA2, J, 7G, etc.)")
 
 
 # Code list information (LM/LQ loops)
-class CodeList(BaseModel):
+class CodeList(_NestedModel):
     agency_code: str = Field(..., description="Agency qualifier (DF=DoD, etc.)")
     source_subqualifier: Optional[str] = Field(None, description="Source subqualifier")
-    codes: List[CodePair] = Field(default_factory=list, description="List of qualifier:code pairs")
+    codes: Annotated[List[CodePair], NoneAsEmpty] = Field(default_factory=list, description="List of qualifier:code pairs")
 
 
 # Financial breakdown for FA2 segments
-class FinancialBreakdown(BaseModel):
+class FinancialBreakdown(_NestedModel):
     breakdown_code: str = Field(..., description="Breakdown structure detail code (58, 18, etc.)")
     financial_code: str = Field(..., description="Financial information code")
 
 
 # Financial accounting data (FA1/FA2 loops)
-class FinancialAccounting(BaseModel):
+class FinancialAccounting(_NestedModel):
     agency_code: Optional[str] = Field(None, description="FA1 agency qualifier")
-    breakdown_codes: List[FinancialBreakdown] = Field(default_factory=list, description="FA2 breakdown codes")
+    breakdown_codes: Annotated[List[FinancialBreakdown], NoneAsEmpty] = Field(default_factory=list, description="FA2 breakdown codes")
 
 
 # Carrier detail (CAD segment)
-class CarrierDetail(BaseModel):
+class CarrierDetail(_NestedModel):
     transport_method: Optional[str] = Field(None, description="Transportation method code")
     equipment_initial: Optional[str] = Field(None, description="Equipment initial")
     equipment_number: Optional[str] = Field(None, description="Equipment number")
@@ -96,7 +118,7 @@ class CarrierDetail(BaseModel):
 
 
 # Service/Allowance/Charge (SAC segment)
-class ServiceCharge(BaseModel):
+class ServiceCharge(_NestedModel):
     indicator: str = Field(..., description="C=Charge, A=Allowance")
     code: Optional[str] = Field(None, description="Service/charge code (D350, etc.)")
     agency_qualifier: Optional[str] = Field(None, description="Agency qualifier")
@@ -105,7 +127,7 @@ class ServiceCharge(BaseModel):
 
 
 # Payment terms (ITD segment)
-class PaymentTerms(BaseModel):
+class PaymentTerms(_NestedModel):
     terms_type: Optional[str] = Field(None, description="01=Basic, 03=Fixed date, etc.")
     terms_basis_date: Optional[str] = Field(None, description="3=Invoice date, etc.")
     discount_percent: Optional[float] = Field(None, description="Discount percentage (e.g., 2.0 for 2%)")
@@ -115,7 +137,7 @@ class PaymentTerms(BaseModel):
 
 
 # Carrier/transportation (TD5 segment)
-class CarrierInfo(BaseModel):
+class CarrierInfo(_NestedModel):
     routing_sequence: Optional[str] = Field(None, description="Routing sequence code")
     id_qualifier: Optional[str] = Field(None, description="2=SCAC, etc.")
     id_code: Optional[str] = Field(None, description="Carrier ID (FDXG, etc.)")
@@ -125,7 +147,7 @@ class CarrierInfo(BaseModel):
 
 
 # FOB shipping terms (FOB segment)
-class FOBTerms(BaseModel):
+class FOBTerms(_NestedModel):
     shipment_method: Optional[str] = Field(None, description="CC=Collect, PP=Prepaid, etc.")
     location_qualifier: Optional[str] = Field(None, description="OR=Origin, DE=Destination, etc.")
     description: Optional[str] = Field(None, description="FOB description")
@@ -133,10 +155,10 @@ class FOBTerms(BaseModel):
 
 
 # Special instructions/notes (N9/MTX segments)
-class SpecialInstruction(BaseModel):
+class SpecialInstruction(_NestedModel):
     reference_qualifier: Optional[str] = Field(None, description="L1=Letters or Notes, etc.")
     reference_id: Optional[str] = Field(None, description="Reference identifier")
-    messages: List[str] = Field(default_factory=list, description="List of message text lines (MTX segments)")
+    messages: Annotated[List[str], NoneAsEmpty] = Field(default_factory=list, description="List of message text lines (MTX segments)")
 
 
 # Main extracted transaction structure
@@ -167,20 +189,20 @@ class ExtractedTransaction(BaseModel):
     ship_to_address: Optional[Address] = Field(None, description="Ship-to address")
     
     # Contacts (linked to parties)
-    contacts: List[Contact] = Field(default_factory=list, description="Contact persons for various functions")
+    contacts: Annotated[List[Contact], NoneAsEmpty] = Field(default_factory=list, description="Contact persons for various functions")
     
     # Line items
-    items: List[LineItem] = Field(default_factory=list, description="Line items")
+    items: Annotated[List[LineItem], NoneAsEmpty] = Field(default_factory=list, description="Line items")
     
     # References (REF segments)
-    references: List[Reference] = Field(default_factory=list, description="Reference identifications")
+    references: Annotated[List[Reference], NoneAsEmpty] = Field(default_factory=list, description="Reference identifications")
     
     # Dates
-    dates: List[DateReference] = Field(default_factory=list, description="Date references (ship, delivery, etc.)")
+    dates: Annotated[List[DateReference], NoneAsEmpty] = Field(default_factory=list, description="Date references (ship, delivery, etc.)")
     
     # Code lists (LM/LQ loops)
-    code_lists: List[CodeList] = Field(default_factory=list, description="Code source information")
-    code_lists_post_sac: List[CodeList] = Field(default_factory=list, description="Second code block (LM/LQ) after SAC segment")
+    code_lists: Annotated[List[CodeList], NoneAsEmpty] = Field(default_factory=list, description="Code source information")
+    code_lists_post_sac: Annotated[List[CodeList], NoneAsEmpty] = Field(default_factory=list, description="Second code block (LM/LQ) after SAC segment")
     
     # Financial accounting (FA1/FA2 loops)
     financial_accounting: Optional[FinancialAccounting] = Field(None, description="Financial accounting data")
@@ -196,10 +218,10 @@ class ExtractedTransaction(BaseModel):
     fob_terms: Optional[FOBTerms] = Field(None, description="FOB shipping terms and payment")
 
     # Special instructions/notes
-    special_instructions: List[SpecialInstruction] = Field(default_factory=list, description="Special instructions and notes (N9/MTX)")
+    special_instructions: Annotated[List[SpecialInstruction], NoneAsEmpty] = Field(default_factory=list, description="Special instructions and notes (N9/MTX)")
 
     # Service charges (SAC)
-    service_charges: List[ServiceCharge] = Field(default_factory=list, description="Allowances and charges")
+    service_charges: Annotated[List[ServiceCharge], NoneAsEmpty] = Field(default_factory=list, description="Allowances and charges")
     
     # Subtotal before charges
     subtotal_amount: Optional[float] = Field(None, description="Subtotal before charges/allowances")
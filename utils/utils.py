@@ -1,66 +1,225 @@
 import asyncio
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-import asyncio
-import os
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import text
+import functools
+import time
+from collections import OrderedDict, defaultdict
+from sqlalchemy import text, bindparam
 import dotenv
+# Before utils.database, which reads DATABASE_URL from the environment at import
 dotenv.load_dotenv()
-from utils.database import get_async_session
-from utils.entities import SegmentNLP
+from utils.database import engine
+from utils.constants import SCHEMA_CACHE_TTL, SCHEMA_CACHE_MAXSIZE, SCHEMA_LOOKUP_CONCURRENCY
+
+
+# Same pool in autocommit mode: these lookups are plain SELECTs and need no BEGIN/COMMIT
+read_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+
+# Cache sentinel, so a cached None or empty list still counts as a hit
+_MISSING = object()
+
+
+async def gather_bounded(coros, limit: int = SCHEMA_LOOKUP_CONCURRENCY):
+    """asyncio.gather with at most `limit` of the awaitables running at once; results keep their order."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(bounded(coro) for coro in coros))
+
+
+def _cached_lookup(func):
+    """
+    Cache an async schema lookup per argument tuple. Entries expire after SCHEMA_CACHE_TTL seconds,
+    the least recently used are evicted past SCHEMA_CACHE_MAXSIZE keys, and concurrent misses on
+    the same key share one query instead of each hitting the database.
+    """
+    cache = OrderedDict()  # args -> (stored at, value), least recently used first
+    in_flight = {}  # args -> task running the query
+
+    def lookup(args):
+        entry = cache.get(args)
+        if entry is None:
+            return _MISSING
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= SCHEMA_CACHE_TTL:
+            del cache[args]
+            return _MISSING
+        cache.move_to_end(args)
+        return value
+
+    def store(args, value):
+        cache[args] = (time.monotonic(), value)
+        cache.move_to_end(args)
+        while len(cache) > SCHEMA_CACHE_MAXSIZE:
+            cache.popitem(last=False)
+
+    def finish(args, task):
+        in_flight.pop(args, None)
+        if not task.cancelled() and task.exception() is None:
+            store(args, task.result())
 
+    @functools.wraps(func)
+    async def wrapper(*args):
+        value = lookup(args)
+        if value is not _MISSING:
+            return value
+        task = in_flight.get(args)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            in_flight[args] = task
+            task.add_done_callback(functools.partial(finish, args))
+        # A cancelled caller must not cancel the query other callers are waiting on
+        return await asyncio.shield(task)
 
-# Use DATABASE_URL from .env directly
-DATABASE_URL = os.getenv('DATABASE_URL')
-if not DATABASE_URL:
-    # Fallback to building from components
-    DB_USER = os.getenv('POSTGRES_USER', 'postgres')
-    DB_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'postgres')
-    DB_HOST = os.getenv('POSTGRES_HOST', 'localhost')
-    DB_PORT = os.getenv('POSTGRES_PORT', '5432')
-    DB_NAME = os.getenv('POSTGRES_DB', 'govcon')
-    DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    def prime(args, value):
+        """Store a value fetched elsewhere (e.g. in bulk) unless a live entry exists."""
+        if lookup(args) is _MISSING:
+            store(args, value)
 
-engine = create_async_engine(DATABASE_URL, echo=False, pool_pre_ping=True, pool_recycle=3600)
+    # Used by prefetch_segment_metadata to fill many keys from one query
+    wrapper.is_cached = lambda *args: lookup(args) is not _MISSING
+    wrapper.prime = prime
+    # Drop every entry, e.g. after the schema tables were edited
+    wrapper.cache_clear = cache.clear
+    return wrapper
 
+
+# Bulk form of get_segment_description below: a segment with custom rows uses only those
+_Q_SEGMENT_DESCRIPTIONS_BULK = text("""
+    SELECT segment_id, description FROM mercury."custom_segmentdescription"
+    WHERE segment_id = ANY(:segment_ids) AND agency = :agency AND version = :version
+    UNION ALL
+    SELECT b.segment_id, b.description FROM mercury."segmentdescription" b
+    WHERE b.segment_id = ANY(:segment_ids) AND b.agency = :agency AND b.version = :version
+      AND NOT EXISTS (
+          SELECT 1 FROM mercury."custom_segmentdescription" c
+          WHERE c.segment_id = b.segment_id AND c.agency = b.agency AND c.version = b.version
+      )
+""")
+# Entities for any set of (segment_id, agency, version) keys; the expanding parameter renders one row value per key
+_Q_SEGMENT_ENTITIES_BY_KEYS = text("""
+    SELECT segment_id, agency, version, position, description, requirement_designator, type
+    FROM mercury."custom_elementusagedefs"
+    WHERE (segment_id, agency, version) IN :keys
+    UNION ALL
+    SELECT b.segment_id, b.agency, b.version, b.position, b.description, b.requirement_designator, b.type
+    FROM mercury."elementusagedefs" b
+    WHERE (b.segment_id, b.agency, b.version) IN :keys
+      AND NOT EXISTS (
+          SELECT 1 FROM mercury."custom_elementusagedefs" c
+          WHERE c.segment_id = b.segment_id AND c.agency = b.agency AND c.version = b.version
+      )
+    ORDER BY segment_id, agency, version, position ASC
+""").bindparams(bindparam("keys", expanding=True))
+
+
+# Per-segment lookups: bound parameters, so asyncpg reuses one prepared statement per query text.
+# Each is one round trip: custom rows when there are any, otherwise the base table's rows.
+_Q_ENTITIES = text("""
+    SELECT position, description, requirement_designator, type FROM mercury."custom_elementusagedefs"
+    WHERE segment_id = :segment_id AND agency = :agency AND version = :version
+    UNION ALL
+    SELECT position, description, requirement_designator, type FROM mercury."elementusagedefs"
+    WHERE segment_id = :segment_id AND agency = :agency AND version = :version
+      AND NOT EXISTS (
+          SELECT 1 FROM mercury."custom_elementusagedefs"
+          WHERE segment_id = :segment_id AND agency = :agency AND version = :version
+      )
+    ORDER BY position ASC
+""")
+_Q_SEGMENTS_USAGE = text("""
+    SELECT segmentid, position FROM mercury."custom_segmentusage"
+    WHERE agency = :agency AND version = :version AND transactionsetid = :transaction_set_id
+    UNION ALL
+    SELECT segmentid, position FROM mercury."segmentusage"
+    WHERE agency = :agency AND version = :version AND transactionsetid = :transaction_set_id
+      AND NOT EXISTS (
+          SELECT 1 FROM mercury."custom_segmentusage"
+          WHERE agency = :agency AND version = :version AND transactionsetid = :transaction_set_id
+      )
+    ORDER BY position ASC
+""")
+_Q_SEGMENT_DESCRIPTION = text("""
+    SELECT segment_id, description FROM mercury."custom_segmentdescription"
+    WHERE segment_id = :segment_id AND agency = :agency AND version = :version
+    UNION ALL
+    SELECT segment_id, description FROM mercury."segmentdescription"
+    WHERE segment_id = :segment_id AND agency = :agency AND version = :version
+      AND NOT EXISTS (
+          SELECT 1 FROM mercury."custom_segmentdescription"
+          WHERE segment_id = :segment_id AND agency = :agency AND version = :version
+      )
+""")
+
+
+@_cached_lookup
 async def get_entities_for_segment(segment_id: str, agency: str, version: str):
-    # query custom_elementusagedefs table first, if not found, query elementusagedefs table
-    async with engine.begin() as conn:
-        result = await conn.execute(text(f"""SELECT * FROM mercury."custom_elementusagedefs" WHERE "segment_id"='{segment_id}' AND "agency"='{agency}' AND "version"='{version}' ORDER BY "position" ASC;"""))
-        rows = result.fetchall()
-        rows_dict = [dict(row._mapping) for row in rows]
-        if not rows_dict:
-            result = await conn.execute(text(f"""SELECT * FROM mercury."elementusagedefs" WHERE "segment_id"='{segment_id}' AND "agency"='{agency}' AND "version"='{version}' ORDER BY "position" ASC;"""))
-            rows = result.fetchall()
-            rows_dict = [dict(row._mapping) for row in rows]
-    segment_entities = []
-    for row in rows_dict:
-        segment_entities.append({'entity': row['description'], 'required': row['requirement_designator'], 'type': row['type']})
-
-    return segment_entities
+    # custom_elementusagedefs rows if the segment has any, else elementusagedefs rows
+    params = {"segment_id": segment_id, "agency": agency, "version": version}
+    async with read_engine.connect() as conn:
+        rows = (await conn.execute(_Q_ENTITIES, params)).all()
+    return [{'entity': description, 'required': required, 'type': type_}
+            for _, description, required, type_ in rows]
 
 
+@_cached_lookup
 async def get_segments_usage(agency: str, version: str, transaction_set_id: str):
-    # query custom_segmentusage table first, if not found, query segmentusage table
-    async with engine.begin() as conn:
-        result = await conn.execute(text(f"""SELECT * FROM mercury."custom_segmentusage" WHERE "agency"='{agency}' AND "version"='{version}' AND "transactionsetid"='{transaction_set_id}' ORDER BY "position" ASC;"""))
-        rows = result.fetchall()
-        rows_dict = [dict(row._mapping) for row in rows]
-        if not rows_dict:
-            result = await conn.execute(text(f"""SELECT * FROM mercury."segmentusage" WHERE "agency"='{agency}' AND "version"='{version}' AND "transactionsetid"='{transaction_set_id}' ORDER BY "position" ASC;"""))
-            rows = result.fetchall()
-            rows_dict = [dict(row._mapping) for row in rows]
-        return rows_dict
+    # custom_segmentusage rows if the transaction set has any, else segmentusage rows.
+    # Only the columns the converter reads are selected.
+    params = {"agency": agency, "version": version, "transaction_set_id": transaction_set_id}
+    async with read_engine.connect() as conn:
+        rows = (await conn.execute(_Q_SEGMENTS_USAGE, params)).all()
+    return [{'segmentid': segmentid, 'position': position} for segmentid, position in rows]
 
+@_cached_lookup
 async def get_segment_description(segment_id: str, agency: str, version: str):
-    # query custom_segmentdescription table first, if not found, query segmentdescription table
-    async with engine.begin() as conn:
-        result = await conn.execute(text(f"""SELECT * FROM mercury."custom_segmentdescription" WHERE "segment_id"='{segment_id}' AND "agency"='{agency}' AND "version"='{version}';"""))
-        rows = result.fetchall()  # Changed from fetchone() to fetchall()
-        rows_dict = [dict(row._mapping) for row in rows]
-        if not rows_dict:
-            result = await conn.execute(text(f"""SELECT * FROM mercury."segmentdescription" WHERE "segment_id"='{segment_id}' AND "agency"='{agency}' AND "version"='{version}';"""))
-            rows = result.fetchall()
-            rows_dict = [dict(row._mapping) for row in rows]
-    return rows_dict
+    # custom_segmentdescription rows if the segment has any, else segmentdescription rows
+    params = {"segment_id": segment_id, "agency": agency, "version": version}
+    async with read_engine.connect() as conn:
+        rows = (await conn.execute(_Q_SEGMENT_DESCRIPTION, params)).all()
+    return [{'segment_id': segment_id, 'description': description} for segment_id, description in rows]
+
+
+async def get_entities_for_segments(keys):
+    """
+    Entities for many (segment_id, agency, version) keys in one query, as {key: entities}.
+    Keys already cached are served from memory, and fetched ones seed get_entities_for_segment's cache.
+    """
+    keys = list(dict.fromkeys(tuple(key) for key in keys))
+    missing = [key for key in keys if not get_entities_for_segment.is_cached(*key)]
+    if missing:
+        async with read_engine.connect() as conn:
+            rows = (await conn.execute(_Q_SEGMENT_ENTITIES_BY_KEYS, {"keys": missing})).all()
+        fetched = defaultdict(list)
+        for segment_id, agency, version, _, description, required, type_ in rows:
+            fetched[(segment_id, agency, version)].append({'entity': description, 'required': required, 'type': type_})
+        for key in missing:
+            get_entities_for_segment.prime(key, fetched[key])
+    # Cache hits unless entries were evicted meanwhile, in which case the lookups run concurrently
+    entities = await gather_bounded(get_entities_for_segment(*key) for key in keys)
+    return dict(zip(keys, entities))
+
+
+async def prefetch_segment_metadata(segment_ids, agency: str, version: str):
+    """
+    Load descriptions and entities for many segments in two queries and seed the caches of
+    get_segment_description/get_entities_for_segment, so per-segment calls that follow are memory hits.
+    """
+    segment_ids = list(dict.fromkeys(segment_ids))
+    await get_entities_for_segments([(segment_id, agency, version) for segment_id in segment_ids])
+
+    missing = [segment_id for segment_id in segment_ids
+               if not get_segment_description.is_cached(segment_id, agency, version)]
+    if not missing:
+        return
+
+    params = {"segment_ids": missing, "agency": agency, "version": version}
+    async with read_engine.connect() as conn:
+        description_rows = (await conn.execute(_Q_SEGMENT_DESCRIPTIONS_BULK, params)).all()
+
+    descriptions = {segment_id: [] for segment_id in missing}
+    for segment_id, description in description_rows:
+        descriptions[segment_id].append({'segment_id': segment_id, 'description': description})
+    for segment_id in missing:
+        get_segment_description.prime((segment_id, agency, version), descriptions[segment_id])